@@ -0,0 +1,230 @@
+"""
+Run lighting actions locally in response to control device events
+
+An `ActionEngine` holds rules that map control device events, such as a
+push button's `ShortPress` or an occupancy sensor reporting occupied, to
+commands for control gear. The commands are built when the rule is
+added, so nothing is encoded when the event arrives. They are sent
+through the driver's transaction lock with `urgent()` where the lock
+supports it (see `dali.driver.priority`), so they go ahead of any
+background traffic already waiting for the bus.
+
+Rules are matched with the same criteria as
+`dali.device.events.EventRouter.subscribe()`, plus an optional
+condition on the event, e.g. `occupied` or `vacant`.
+
+The time from an event being received to its commands starting to
+transmit, and to their being sent, is recorded in `engine.latency`.
+
+Example:
+```
+engine = ActionEngine(driver)
+engine.add_rule(
+    GoToScene(GearGroup(1), 2),
+    short_address=5, instance_number=0, event=pushbutton.ShortPress)
+engine.add_rule(
+    DAPC(GearGroup(2), 254), event=occupancy.OccupancyEvent,
+    short_address=7, condition=occupied)
+driver.bus_traffic.register(engine.bus_traffic)
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Iterable, Optional
+
+from dali.command import Command
+from dali.device.events import EventRouter, Subscription
+from dali.device.general import _Event
+from dali.exceptions import DALIError
+
+_LOG = logging.getLogger("dali.device.actions")
+
+
+def occupied(ev: _Event) -> bool:
+    """A rule condition: an occupancy event reporting occupied"""
+    data = ev.event_data
+    return bool(getattr(data, "occupied", False)) \
+        and not getattr(data, "repeat", False)
+
+
+def vacant(ev: _Event) -> bool:
+    """A rule condition: an occupancy event reporting vacant"""
+    data = ev.event_data
+    return data is not None and not getattr(data, "occupied", True) \
+        and not getattr(data, "repeat", False)
+
+
+class LatencyStats:
+    """
+    The most recent latencies, in seconds
+
+    :param max_samples: The number of samples kept
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.samples: deque[float] = deque(maxlen=max_samples)
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p'th percentile of the samples, 0 <= p <= 100, or None"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def summary(self) -> dict[str, Optional[float]]:
+        """The median, 95th and 99th percentiles and maximum"""
+        return {
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": max(self.samples, default=None),
+        }
+
+
+class Rule:
+    """
+    Commands to send when matching events arrive; returned by
+    `ActionEngine.add_rule()`
+    """
+
+    def __init__(
+        self,
+        engine: ActionEngine,
+        commands: tuple[Command, ...],
+        condition: Optional[Callable[[_Event], bool]],
+    ):
+        self._engine = engine
+        self.commands = commands
+        self.condition = condition
+        self.subscription: Optional[Subscription] = None
+        self.fired = 0
+
+    def remove(self) -> None:
+        self.subscription.unsubscribe()
+
+
+class ActionEngine:
+    """
+    Sends gear commands in response to control device events
+
+    :param driver: A driver with `send()` and a `transaction_lock`
+    :param clock: A function returning the current time in seconds, for
+    latency measurements
+    :param max_samples: The number of latency samples kept
+    :param urgent: Whether to send ahead of other waiting traffic; only
+    turn this off to compare latencies
+    """
+
+    def __init__(
+        self,
+        driver,
+        clock: Callable[[], float] = time.perf_counter,
+        max_samples: int = 1000,
+        urgent: bool = True,
+    ):
+        self.driver = driver
+        self.urgent = urgent
+        self._clock = clock
+        self._router = EventRouter()
+        # Latency from receiving an event to its commands starting to
+        # transmit, and to their all having been sent
+        self.latency = LatencyStats(max_samples)
+        self.latency_sent = LatencyStats(max_samples)
+        self._tasks: set[asyncio.Task] = set()
+
+    def add_rule(
+        self,
+        commands: Command | Iterable[Command],
+        *,
+        condition: Optional[Callable[[_Event], bool]] = None,
+        **criteria,
+    ) -> Rule:
+        """
+        Add a rule
+
+        :param commands: A command, or commands to send in order, when a
+        matching event arrives
+        :param condition: An optional function of the event, which must
+        return True for the rule to fire
+        :param criteria: Which events the rule matches, as for
+        `EventRouter.subscribe()`: short_address, instance_number,
+        instance_type, instance_group, device_group and event
+        """
+        if isinstance(commands, Command):
+            commands = (commands,)
+        rule = Rule(self, tuple(commands), condition)
+        if not rule.commands:
+            raise ValueError("A rule needs at least one command")
+        # The router is only used for matching, so the handler is unused
+        rule.subscription = self._router.subscribe(rule, **criteria)
+        return rule
+
+    def __len__(self):
+        return len(self._router)
+
+    def feed(self, ev: _Event) -> int:
+        """
+        Act on an event; must be called from the event loop thread
+
+        :return: The number of rules that fired
+        """
+        received = self._clock()
+        fired = 0
+        for subscription in self._router.match(ev):
+            rule = subscription.handler
+            if rule.condition is not None:
+                try:
+                    if not rule.condition(ev):
+                        continue
+                except Exception:
+                    _LOG.exception("Rule condition %r failed", rule.condition)
+                    continue
+            rule.fired += 1
+            fired += 1
+            task = asyncio.get_running_loop().create_task(
+                self._send(rule.commands, received))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return fired
+
+    async def _send(self, commands: tuple[Command, ...], received: float):
+        lock = self.driver.transaction_lock
+        urgent = getattr(lock, "urgent", None) if self.urgent else None
+        try:
+            async with (urgent() if urgent else lock):
+                self.latency.add(self._clock() - received)
+                for cmd in commands:
+                    await self.driver.send(cmd, in_transaction=True)
+            self.latency_sent.add(self._clock() - received)
+        except (DALIError, OSError, asyncio.TimeoutError) as e:
+            _LOG.error(f"Sending rule commands failed: {e}")
+
+    def bus_traffic(self, driver, command, response, config_command_error):
+        """A callback for a hid driver's `bus_traffic`"""
+        if isinstance(command, _Event):
+            self.feed(command)
+
+    async def watch(self, queue: asyncio.Queue) -> None:
+        """
+        Act on the events from a serial driver's receive queue, e.g. one
+        from `driver.new_dali_rx_queue()`; runs until cancelled
+        """
+        while True:
+            command = await queue.get()
+            if isinstance(command, _Event):
+                self.feed(command)
+
+    async def close(self) -> None:
+        """Wait for commands that are being sent"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
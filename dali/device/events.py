@@ -0,0 +1,190 @@
+"""
+Route control device events to the handlers that want them
+
+An `EventRouter` holds subscriptions, each of which names the events it
+wants by any of short address, instance number, instance type, instance
+group, device group and event class. Subscriptions are indexed by the
+most selective of those they specify, so routing an event only looks at
+subscriptions that could match it rather than at every subscription.
+
+Events fed to the router are delivered once per event loop iteration:
+each handler is called once with a list of all the matching events that
+arrived since the last delivery.
+
+Example:
+```
+router = EventRouter()
+router.subscribe(on_press, short_address=5, event=pushbutton.ShortPress)
+router.subscribe(on_motion, instance_group=3)
+driver.bus_traffic.register(router.bus_traffic)
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Optional, Sequence
+
+from dali import address
+from dali.device.general import _Event
+
+_LOG = logging.getLogger("dali.device.events")
+
+# Criteria in the order they are preferred as the index key: the first
+# one a subscription specifies is used. Short addresses and groups pick
+# out few events; instance types and event classes pick out many.
+_CRITERIA = (
+    "short_address",
+    "instance_group",
+    "device_group",
+    "instance_number",
+    "instance_type",
+    "event",
+)
+
+
+def _event_key(ev: _Event, criterion: str):
+    if criterion == "short_address":
+        return ev.short_address.address if ev.short_address else None
+    return getattr(ev, criterion)
+
+
+class Subscription:
+    """
+    A handler and the events it wants; returned by `EventRouter.subscribe()`
+
+    Call `unsubscribe()` to stop receiving events.
+    """
+
+    def __init__(self, router: EventRouter, handler, criteria: dict):
+        self._router = router
+        self.handler = handler
+        self.criteria = criteria
+        self.key = next(
+            ((c, criteria[c]) for c in _CRITERIA if c in criteria),
+            (None, None))
+
+    def matches(self, ev: _Event) -> bool:
+        for criterion, wanted in self.criteria.items():
+            if criterion == "event":
+                if not isinstance(ev, wanted):
+                    return False
+            elif _event_key(ev, criterion) != wanted:
+                return False
+        return True
+
+    def unsubscribe(self) -> None:
+        self._router._remove(self)
+
+
+class EventRouter:
+    """
+    Delivers control device events to matching subscriptions
+    """
+
+    def __init__(self):
+        # (criterion, value) -> subscriptions using it as their key
+        self._index: dict[tuple, list[Subscription]] = defaultdict(list)
+        self._pending: list[_Event] = []
+        self._scheduled = False
+
+    def subscribe(
+        self,
+        handler: Callable[[list[_Event]], None],
+        *,
+        short_address: Optional[int | address.DeviceShort] = None,
+        instance_number: Optional[int] = None,
+        instance_type: Optional[int] = None,
+        instance_group: Optional[int] = None,
+        device_group: Optional[int] = None,
+        event: Optional[type[_Event]] = None,
+    ) -> Subscription:
+        """
+        Subscribe a handler to events
+
+        Criteria that are not given match any event. The handler is
+        called with a list of matching events.
+
+        :param event: An event class, for example
+        `dali.device.pushbutton.ShortPress`; subclasses match too
+        """
+        if isinstance(short_address, address.DeviceShort):
+            short_address = short_address.address
+        criteria = {
+            name: value for name, value in (
+                ("short_address", short_address),
+                ("instance_number", instance_number),
+                ("instance_type", instance_type),
+                ("instance_group", instance_group),
+                ("device_group", device_group),
+                ("event", event),
+            ) if value is not None
+        }
+        subscription = Subscription(self, handler, criteria)
+        self._index[subscription.key].append(subscription)
+        return subscription
+
+    def _remove(self, subscription: Subscription) -> None:
+        subscriptions = self._index.get(subscription.key, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._index[subscription.key]
+
+    def __len__(self):
+        return sum(len(s) for s in self._index.values())
+
+    def match(self, ev: _Event) -> list[Subscription]:
+        """The subscriptions that an event would be delivered to"""
+        candidates = list(self._index.get((None, None), ()))
+        for criterion in _CRITERIA[:-1]:
+            value = _event_key(ev, criterion)
+            if value is not None:
+                candidates.extend(self._index.get((criterion, value), ()))
+        for cls in type(ev).__mro__:
+            candidates.extend(self._index.get(("event", cls), ()))
+            if cls is _Event:
+                break
+        return [s for s in candidates if s.matches(ev)]
+
+    def dispatch(self, events: Sequence[_Event]) -> None:
+        """
+        Deliver events now
+
+        Each matching handler is called once, with its matching events
+        in the order given.
+        """
+        batches: dict[Subscription, list[_Event]] = {}
+        for ev in events:
+            for subscription in self.match(ev):
+                batches.setdefault(subscription, []).append(ev)
+        for subscription, batch in batches.items():
+            try:
+                subscription.handler(batch)
+            except Exception:
+                _LOG.exception("Event handler %r failed", subscription.handler)
+
+    def feed(self, ev: _Event) -> None:
+        """
+        Queue an event for delivery on the next event loop iteration
+
+        Must be called from the event loop thread.
+        """
+        self._pending.append(ev)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        events, self._pending = self._pending, []
+        self._scheduled = False
+        self.dispatch(events)
+
+    def bus_traffic(self, driver, command, response, config_command_error):
+        """
+        A callback for a driver's `bus_traffic`, which feeds the events
+        seen on the bus to the router
+        """
+        if isinstance(command, _Event):
+            self.feed(command)
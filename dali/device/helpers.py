@@ -3,6 +3,9 @@ Helper functions and classes, used in various other places through the library
 """
 from __future__ import annotations
 
+import json
+import logging
+import os
 import types
 from typing import Generator, Iterable, Optional
 
@@ -14,13 +17,19 @@ from dali.device.general import (
     QueryInstanceEnabled,
     QueryInstanceType,
     QueryNumberOfInstances,
+    QueryRandomAddressH,
+    QueryRandomAddressL,
+    QueryRandomAddressM,
     StartQuiescentMode,
     StopQuiescentMode,
 )
 from dali.exceptions import MissingResponse, ResponseError
 from dali.frame import BackwardFrameError
+from dali.sequences import batch as seq_batch
 from dali.sequences import progress as seq_progress
 
+_LOG = logging.getLogger("dali.device.helpers")
+
 
 def check_bad_rsp(r: Response | None) -> bool:
     """
@@ -67,25 +76,121 @@ class DeviceInstanceTypeMapper:
     One instance of DeviceInstanceTypeMapper should be created for each DALI
     bus, and then re-used whenever decoding event messages from that bus
     through the `from_frame()` method.
+
+    Devices found by `autodiscover()` are recorded with a fingerprint: their
+    random address and number of instances. A mapping can be saved to a
+    file with `save()` and read back with `load()`, after which `refresh()`
+    checks the fingerprints and only scans the devices that have changed.
     """
 
-    def __init__(self, initial=None):
+    FILE_VERSION = 1
+
+    def __init__(self, initial=None, path=None):
         """
         Creates a new DeviceInstanceTypeMapper object, optionally with
         preloaded mappings as defined by `initial`.
 
         :param initial: A dict of data to preload into the mapping
+        :param path: Optional path of the file the mapping is saved to by
+        `save()`
         """
         self._mapping: dict[(int, int), int] = {}
         if initial:
             self._mapping = initial
+        # Short address -> (random address, number of instances)
+        self._fingerprints: dict[int, tuple[int, int]] = {}
+        self.path = path
 
     @property
     def mapping(self) -> dict[(int, int), int]:
         return self._mapping
 
+    @property
+    def fingerprints(self) -> dict[int, tuple[int, int]]:
+        return self._fingerprints
+
+    @staticmethod
+    def _fingerprint_commands(addr: DeviceShort) -> list[Command]:
+        return [
+            QueryRandomAddressH(device=addr),
+            QueryRandomAddressM(device=addr),
+            QueryRandomAddressL(device=addr),
+            QueryNumberOfInstances(device=addr),
+        ]
+
+    @staticmethod
+    def _fingerprint(rsps: list[Response]) -> Optional[tuple[int, int]]:
+        if any(check_bad_rsp(r) for r in rsps):
+            return None
+        high, mid, low, num_inst = (r.value for r in rsps)
+        return (high << 16) | (mid << 8) | low, num_inst
+
+    def _forget(self, addr_int: int) -> None:
+        self._fingerprints.pop(addr_int, None)
+        for key in [k for k in self._mapping if k[0] == addr_int]:
+            del self._mapping[key]
+
+    def _scan_device(self, addr_int: int) -> Generator[Command, Response, None]:
+        addr = DeviceShort(addr_int)
+
+        # Check that the device exists and responds
+        rsp = yield QueryDeviceStatus(device=addr)
+        if check_bad_rsp(rsp):
+            return
+        if isinstance(rsp, QueryDeviceStatusResponse):
+            # Make sure the status is OK
+            if (
+                rsp.short_address_is_mask
+                or rsp.reset_state
+            ):
+                return
+        else:
+            # If the response isn't QueryDeviceStatusResponse then
+            # something is wrong
+            return
+
+        # Replace whatever was known about the device at this address
+        self._forget(addr_int)
+
+        # Find out how many instances the device has, along with its
+        # random address to recognise it again later
+        rsps = yield seq_batch(self._fingerprint_commands(addr))
+        fingerprint = self._fingerprint(rsps)
+        if check_bad_rsp(rsps[-1]):
+            return
+        num_inst = rsps[-1].value
+
+        # For each instance, check it is enabled and then query the type
+        for inst_int in range(num_inst):
+            inst = InstanceNumber(inst_int)
+            rsp = yield QueryInstanceEnabled(device=addr, instance=inst)
+            if check_bad_rsp(rsp):
+                continue
+            if not rsp.value:
+                # Skip if not enabled
+                continue
+            rsp = yield QueryInstanceType(device=addr, instance=inst)
+            if check_bad_rsp(rsp):
+                continue
+
+            yield seq_progress(
+                message=f"A²{addr_int} I{inst_int} type: {rsp.value}"
+            )
+
+            # Add the type to the device/instance map
+            self.add_type(
+                short_address=addr,
+                instance_number=inst,
+                instance_type=rsp.value,
+            )
+
+        if fingerprint is not None:
+            self._fingerprints[addr_int] = fingerprint
+
     def autodiscover(
-        self, addresses: int | tuple[int, int] | Iterable[int] = (0, 63)
+        self,
+        addresses: int | tuple[int, int] | Iterable[int] = (0, 63),
+        quiescent: bool = True,
     ) -> Generator[Command, Response, None]:
         """
         A generator sequence to scan a DALI bus for control device instances,
@@ -99,6 +204,10 @@ class DeviceInstanceTypeMapper:
         which case all addresses between the provided values will be scanned;
         or finally can be an iterable of ints in which case each address, in
         the iterator will be scanned.
+        :param quiescent: Whether to put all control devices in quiescent
+        mode during the scan, so their events don't compete for the bus.
+        Pass False if the scan is interleaved with other traffic, so input
+        devices keep working while it runs.
         :return: A generator function, to use with e.g. `driver.run_sequence()`
 
         Needs to be used through an appropriate driver, with `run_sequence()`,
@@ -110,7 +219,8 @@ class DeviceInstanceTypeMapper:
         """
 
         # Use quiescent mode to reduce bus contention from input devices
-        yield StartQuiescentMode(DeviceBroadcast())
+        if quiescent:
+            yield StartQuiescentMode(DeviceBroadcast())
 
         if isinstance(addresses, int):
             addresses = (n for n in range(0, addresses))
@@ -118,56 +228,127 @@ class DeviceInstanceTypeMapper:
             addresses = (n for n in range(addresses[0], addresses[1] + 1))
 
         for addr_int in addresses:
-            addr = DeviceShort(addr_int)
+            yield from self._scan_device(addr_int)
 
-            # Check that the device exists and responds
-            rsp = yield QueryDeviceStatus(device=addr)
-            if check_bad_rsp(rsp):
-                continue
-            if isinstance(rsp, QueryDeviceStatusResponse):
-                # Make sure the status is OK
-                if (
-                    rsp.short_address_is_mask
-                    or rsp.reset_state
-                ):
-                    continue
-            else:
-                # If the response isn't QueryDeviceStatusResponse then
-                # something is wrong
-                continue
+        # End quiescent mode
+        if quiescent:
+            yield StopQuiescentMode(DeviceBroadcast())
 
-            # Find out how many instances the device has
-            rsp = yield QueryNumberOfInstances(device=addr)
-            if check_bad_rsp(rsp):
-                continue
-            num_inst = rsp.value
-
-            # For each instance, check it is enabled and then query the type
-            for inst_int in range(num_inst):
-                inst = InstanceNumber(inst_int)
-                rsp = yield QueryInstanceEnabled(device=addr, instance=inst)
-                if check_bad_rsp(rsp):
-                    continue
-                if not rsp.value:
-                    # Skip if not enabled
-                    continue
-                rsp = yield QueryInstanceType(device=addr, instance=inst)
-                if check_bad_rsp(rsp):
-                    continue
-
-                yield seq_progress(
-                    message=f"A²{addr_int} I{inst_int} type: {rsp.value}"
-                )
+    def refresh(
+        self,
+        new_addresses: Iterable[int] = (),
+        probe: bool = True,
+        quiescent: bool = True,
+    ) -> Generator[Command, Response, set[int]]:
+        """
+        A generator sequence to bring a previously discovered mapping up to
+        date, for example one read by `load()`.
+
+        The fingerprint of every known device is queried in a single batch,
+        four queries per device, and only devices whose fingerprint has
+        changed are scanned again. Devices that do not respond at all keep
+        their entries, as they may only be switched off. In the same batch
+        every other address is sent a `QueryDeviceStatus`, and those that
+        answer are scanned in full, so devices added since the mapping was
+        made are found without visiting each address in turn.
+
+        :param new_addresses: Addresses to scan in full, in addition to any
+        changed or newly found devices
+        :param probe: Whether to look for devices at unknown addresses
+        :param quiescent: As for `autodiscover()`
+        :return: The set of addresses that were scanned
+        """
+        if quiescent:
+            yield StartQuiescentMode(DeviceBroadcast())
+
+        known = sorted(self._fingerprints)
+        unknown = [a for a in range(64) if a not in self._fingerprints] \
+            if probe else []
+        rsps = yield seq_batch(
+            [cmd for addr_int in known
+             for cmd in self._fingerprint_commands(DeviceShort(addr_int))]
+            + [QueryDeviceStatus(device=DeviceShort(addr_int))
+               for addr_int in unknown])
+        rescan = set(new_addresses)
+        for n, addr_int in enumerate(known):
+            device_rsps = rsps[4 * n:4 * n + 4]
+            if all(not r or r.raw_value is None for r in device_rsps):
+                _LOG.info(f"Control device A²{addr_int} did not respond")
+            elif self._fingerprint(device_rsps) != self._fingerprints[addr_int]:
+                rescan.add(addr_int)
+        for addr_int, rsp in zip(unknown, rsps[4 * len(known):]):
+            if rsp and rsp.raw_value is not None:
+                _LOG.info(f"New control device at A²{addr_int}")
+                rescan.add(addr_int)
+        for addr_int in sorted(rescan):
+            yield from self._scan_device(addr_int)
+
+        if quiescent:
+            yield StopQuiescentMode(DeviceBroadcast())
+        return rescan
+
+    def save(self, path=None) -> None:
+        """
+        Saves the mapping and device fingerprints to a JSON file
 
-                # Add the type to the device/instance map
-                self.add_type(
-                    short_address=addr,
-                    instance_number=inst,
-                    instance_type=rsp.value,
-                )
+        The file is replaced atomically, so an interrupted save leaves the
+        previous file intact.
 
-        # End quiescent mode
-        yield StopQuiescentMode(DeviceBroadcast())
+        :param path: The file to write; defaults to the `path` attribute
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given to save the mapping to")
+        devices = {}
+        for (addr_int, inst_int), inst_type in sorted(self._mapping.items()):
+            devices.setdefault(addr_int, {"types": {}})["types"][
+                str(inst_int)] = inst_type
+        for addr_int, (random_address, num_inst) in self._fingerprints.items():
+            entry = devices.setdefault(addr_int, {"types": {}})
+            entry["random_address"] = random_address
+            entry["instances"] = num_inst
+        data = {
+            "version": self.FILE_VERSION,
+            "devices": {str(a): devices[a] for a in sorted(devices)},
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> DeviceInstanceTypeMapper:
+        """
+        Creates a DeviceInstanceTypeMapper from a file written by `save()`
+
+        A missing, unreadable or outdated file gives an empty mapping, which
+        `autodiscover()` can then fill. Either way, the returned object
+        saves back to `path`.
+        """
+        mapper = cls(path=path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return mapper
+        except (OSError, ValueError):
+            _LOG.warning(f"Ignoring unreadable device instance map '{path}'")
+            return mapper
+        if not isinstance(data, dict) or data.get("version") != cls.FILE_VERSION:
+            _LOG.warning(f"Ignoring device instance map '{path}' of unknown version")
+            return mapper
+        for addr_str, entry in data.get("devices", {}).items():
+            addr_int = int(addr_str)
+            for inst_str, inst_type in entry.get("types", {}).items():
+                mapper.add_type(
+                    short_address=addr_int,
+                    instance_number=int(inst_str),
+                    instance_type=inst_type,
+                )
+            if "random_address" in entry and "instances" in entry:
+                mapper._fingerprints[addr_int] = (
+                    entry["random_address"], entry["instances"])
+        return mapper
 
     def add_type(
         self,
@@ -233,6 +414,7 @@ class DeviceInstanceTypeMapper:
         :return: None
         """
         self._mapping = {}
+        self._fingerprints = {}
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self._mapping})"
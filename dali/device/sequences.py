@@ -4,7 +4,8 @@ Sequence for simplifying certain interactions with 24-bit DALI devices
 from __future__ import annotations
 
 import types
-from typing import Generator, Optional, Type
+from dataclasses import dataclass, field
+from typing import Generator, Mapping, Optional, Type
 
 from dali.address import DeviceShort, InstanceNumber
 from dali.command import Command, Response
@@ -20,13 +21,22 @@ from dali.device.general import (
     QueryEventFilterH,
     QueryEventFilterL,
     QueryEventFilterM,
+    QueryEventPriority,
     QueryEventScheme,
     QueryEventSchemeResponse,
+    QueryInstanceGroup1,
+    QueryInstanceGroup2,
+    QueryPrimaryInstanceGroup,
     SetEventFilter,
+    SetEventPriority,
     SetEventScheme,
+    SetInstanceGroup1,
+    SetInstanceGroup2,
+    SetPrimaryInstanceGroup,
 )
 from dali.device.helpers import check_bad_rsp
 from dali.exceptions import DALISequenceError
+from dali.sequences import batch
 
 
 def SetEventSchemes(
@@ -275,3 +285,205 @@ def query_input_value(
         value >>= 8 - resolution
 
     return value
+
+
+@dataclass
+class InstanceConfig:
+    """
+    The wanted configuration of a control device instance, for use with
+    `ConfigureInstances()`. Settings left as None are not changed.
+
+    :param scheme: The event scheme
+    :param filter: The event filter; an `InstanceEventFilter` only sets as
+    many bytes of the filter as its type needs, a plain int sets all three
+    :param priority: The event priority
+    :param primary_group: The primary instance group, 0xFF for none
+    :param group_1: Instance group 1, 0xFF for none
+    :param group_2: Instance group 2, 0xFF for none
+    """
+
+    scheme: Optional[EventScheme] = None
+    filter: Optional[int] = None
+    priority: Optional[int] = None
+    primary_group: Optional[int] = None
+    group_1: Optional[int] = None
+    group_2: Optional[int] = None
+
+
+@dataclass
+class InstanceConfigResult:
+    """
+    The outcome of `ConfigureInstances()` for one instance, as lists of
+    the names of the settings in `InstanceConfig`
+
+    :param written: Settings that were changed, and read back correctly
+    :param unchanged: Settings that already had the wanted value
+    :param failed: Settings that could not be read, or that did not read
+    back as written
+    """
+
+    written: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+# Settings that are written from DTR0 alone: (query, set)
+_DTR0_SETTINGS = {
+    "scheme": (QueryEventScheme, SetEventScheme),
+    "priority": (QueryEventPriority, SetEventPriority),
+    "primary_group": (QueryPrimaryInstanceGroup, SetPrimaryInstanceGroup),
+    "group_1": (QueryInstanceGroup1, SetInstanceGroup1),
+    "group_2": (QueryInstanceGroup2, SetInstanceGroup2),
+}
+
+_FILTER_QUERIES = (QueryEventFilterL, QueryEventFilterM, QueryEventFilterH)
+
+
+def _filter_bytes(filter_value: int) -> int:
+    if isinstance(filter_value, InstanceEventFilter):
+        return filter_value.dali_width() // 8
+    return 3
+
+
+def _wanted(config: InstanceConfig) -> dict[str, tuple[int, ...]]:
+    # Each setting as the tuple of bytes it is written and read as
+    wanted = {}
+    for name in _DTR0_SETTINGS:
+        value = getattr(config, name)
+        if value is None:
+            continue
+        if name == "scheme":
+            # Raises a ValueError if not a valid scheme
+            EventScheme(int(value))
+        if not 0 <= int(value) <= 0xFF:
+            raise ValueError(f"'{name}' must be a byte, not {value}")
+        wanted[name] = (int(value),)
+    if config.filter is not None:
+        if not isinstance(config.filter, int):
+            raise TypeError(
+                f"'filter' must be an int, not {type(config.filter)}"
+            )
+        if not 0 <= config.filter <= 0xFFFFFF:
+            raise ValueError(f"'filter' must fit in 24 bits, not {config.filter}")
+        wanted["filter"] = tuple(config.filter.to_bytes(3, "little")[
+            :_filter_bytes(config.filter)])
+    return wanted
+
+
+def _queries(
+    device: DeviceShort, instance: InstanceNumber, name: str, width: int,
+) -> list[Command]:
+    if name == "filter":
+        return [q(device, instance) for q in _FILTER_QUERIES[:width]]
+    return [_DTR0_SETTINGS[name][0](device, instance)]
+
+
+def ConfigureInstances(
+    configs: Mapping[tuple[int, int], InstanceConfig],
+) -> Generator[
+    Command,
+    Optional[Response] | list[Optional[Response]],
+    dict[tuple[int, int], InstanceConfigResult],
+]:
+    """
+    A generator sequence to configure many control device instances at
+    once. Use with an appropriate DALI driver instance, through the
+    `run_sequence()` method.
+
+    The current settings of all the instances are read in one batch, and
+    only those that differ from the wanted configuration are written.
+    DTR0, DTR1 and DTR2 are received by every device, so the writes are
+    ordered by value and each DTR is only written when the value it needs
+    to hold changes: setting the same instance group on a hundred
+    instances writes DTR0 once. The settings that were written are read
+    back in one more batch.
+
+    :param configs: A dict of (short address, instance number) to the
+    wanted `InstanceConfig`
+    :return: A dict of (short address, instance number) to an
+    `InstanceConfigResult`
+
+    Example:
+    ```
+    configs = {
+        (addr, inst): InstanceConfig(
+            scheme=EventScheme.device_instance, group_1=3)
+        for addr, inst in dev_inst_map.mapping
+    }
+    results = await driver.run_sequence(ConfigureInstances(configs))
+    ```
+    """
+    # Check everything before sending anything
+    wanted = {key: _wanted(config) for key, config in configs.items()}
+    targets = {
+        (addr, inst): (DeviceShort(addr), InstanceNumber(inst))
+        for addr, inst in wanted
+    }
+    results = {key: InstanceConfigResult() for key in wanted}
+
+    def read(items):
+        # Reads settings in one batch; returns the bytes of each, or None
+        commands = []
+        for key, name in items:
+            commands.extend(
+                _queries(*targets[key], name, len(wanted[key][name])))
+        rsps = yield batch(commands)
+        current = {}
+        pos = 0
+        for key, name in items:
+            width = len(wanted[key][name])
+            setting = rsps[pos:pos + width]
+            pos += width
+            if any(check_bad_rsp(r) for r in setting):
+                current[(key, name)] = None
+            else:
+                current[(key, name)] = tuple(
+                    r.raw_value.as_integer for r in setting)
+        return current
+
+    items = [(key, name) for key in wanted for name in wanted[key]]
+    if not items:
+        return results
+    current = yield from read(items)
+
+    to_write = []
+    for key, name in items:
+        if current[(key, name)] is None:
+            results[key].failed.append(name)
+        elif current[(key, name)] == wanted[key][name]:
+            results[key].unchanged.append(name)
+        else:
+            to_write.append((key, name))
+    if not to_write:
+        return results
+
+    # Order the writes so that instances needing the same DTR values are
+    # written one after the other; DTR0 is the most often shared
+    def dtr_values(item):
+        key, name = item
+        return wanted[key][name] + (-1,) * (3 - len(wanted[key][name]))
+
+    commands = []
+    dtrs = [None, None, None]
+    for key, name in sorted(to_write, key=dtr_values):
+        for n, value in enumerate(wanted[key][name]):
+            if dtrs[n] != value:
+                commands.append((DTR0, DTR1, DTR2)[n](value))
+                dtrs[n] = value
+        if name == "filter":
+            commands.append(SetEventFilter(*targets[key]))
+        else:
+            commands.append(_DTR0_SETTINGS[name][1](*targets[key]))
+    yield batch(commands)
+
+    written = yield from read(to_write)
+    for key, name in to_write:
+        if written[(key, name)] == wanted[key][name]:
+            results[key].written.append(name)
+        else:
+            results[key].failed.append(name)
+    return results
@@ -0,0 +1,441 @@
+"""
+Detect event storms from control devices, and throttle them
+
+A faulty occupancy sensor or a stuck push button can send events as fast
+as the bus allows, delaying every other command. `EventStormMonitor`
+watches the decoded events seen on the bus and keeps a decaying event
+rate for each control device and each of its instances; memory use is
+constant per instance, however many events arrive.
+
+When an instance's rate goes over `instance_rate`, or a device's over
+`device_rate`, the configured mitigation is applied to it, for example
+`DisableInstanceMitigation` or `QuiescentModeMitigation`, and the alert
+callback is called. After `hold_off` seconds the mitigation is undone;
+if the storm starts again straight away the next hold off is twice as
+long, up to `max_hold_off`.
+
+Only events that carry a short address, i.e. those using the "Device"
+or "Device/Instance" schemes, can be traced to a device.
+
+Example:
+```
+monitor = EventStormMonitor(
+    driver,
+    instance_mitigation=DisableInstanceMitigation(),
+    device_mitigation=QuiescentModeMitigation(),
+    alert=print,
+)
+# hid drivers
+driver.bus_traffic.register(monitor.bus_traffic)
+# serial drivers
+asyncio.create_task(monitor.watch(driver.new_dali_rx_queue()))
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Generator, Optional
+
+from dali.address import DeviceShort, InstanceNumber
+from dali.command import Command, Response
+from dali.device.general import (
+    DTR0,
+    DTR1,
+    DTR2,
+    DisableInstance,
+    EnableInstance,
+    QueryInstanceEnabled,
+    QueryNumberOfInstances,
+    SetEventFilter,
+    StartQuiescentMode,
+    StopQuiescentMode,
+    _Event,
+)
+from dali.device.helpers import check_bad_rsp
+from dali.device.sequences import _FILTER_QUERIES, _filter_bytes
+from dali.exceptions import DALIError, MissingResponse
+from dali.sequences import batch as seq_batch
+
+_LOG = logging.getLogger("dali.device.storm")
+
+
+class EventRate:
+    """
+    An event rate that decays exponentially, in events per second
+
+    :param window: The time constant of the decay in seconds; events
+    older than a few windows have almost no effect
+    """
+
+    __slots__ = ("window", "_rate", "_last")
+
+    def __init__(self, window: float):
+        self.window = window
+        self._rate = 0.0
+        self._last: Optional[float] = None
+
+    def value(self, now: float) -> float:
+        if self._last is None:
+            return 0.0
+        return self._rate * math.exp(-(now - self._last) / self.window)
+
+    def add(self, now: float) -> float:
+        """Count an event, and return the rate including it"""
+        self._rate = self.value(now) + 1 / self.window
+        self._last = now
+        return self._rate
+
+
+class Mitigation:
+    """
+    Something done to a device or instance to stop an event storm
+
+    Subclasses implement `apply()` and `revert()` as generator sequences.
+    'instance' is None when the mitigation is applied to a whole device.
+    """
+
+    def apply(
+        self, device: DeviceShort, instance: Optional[InstanceNumber],
+    ) -> Generator[Command, Optional[Response], None]:
+        raise NotImplementedError
+
+    def revert(
+        self, device: DeviceShort, instance: Optional[InstanceNumber],
+    ) -> Generator[Command, Optional[Response], None]:
+        raise NotImplementedError
+
+
+class DisableInstanceMitigation(Mitigation):
+    """
+    Disables the instance, or the enabled instances of a device
+
+    For a whole device, only the instances that were enabled are
+    disabled, and only those are enabled again afterwards, so instances
+    disabled on purpose stay disabled.
+    """
+
+    def __init__(self):
+        # address -> the instances disabled for a device storm
+        self._disabled: dict[int, list[int]] = {}
+
+    def apply(self, device, instance):
+        if instance is not None:
+            yield DisableInstance(device, instance)
+            return
+        rsp = yield QueryNumberOfInstances(device)
+        if check_bad_rsp(rsp):
+            raise MissingResponse(
+                f"A²{device.address} did not report its instances")
+        rsps = yield seq_batch(
+            QueryInstanceEnabled(device, InstanceNumber(n))
+            for n in range(rsp.value))
+        enabled = [
+            n for n, r in enumerate(rsps)
+            if not check_bad_rsp(r) and r.value]
+        self._disabled[device.address] = enabled
+        for n in enabled:
+            yield DisableInstance(device, InstanceNumber(n))
+
+    def revert(self, device, instance):
+        if instance is not None:
+            yield EnableInstance(device, instance)
+            return
+        for n in self._disabled.pop(device.address, ()):
+            yield EnableInstance(device, InstanceNumber(n))
+
+
+class QuiescentModeMitigation(Mitigation):
+    """
+    Puts the whole device in quiescent mode
+
+    A device leaves quiescent mode by itself after 15 minutes, so a
+    `hold_off` longer than that does not keep it quiet.
+    """
+
+    def apply(self, device, instance):
+        yield StartQuiescentMode(device)
+
+    def revert(self, device, instance):
+        yield StopQuiescentMode(device)
+
+
+class EventFilterMitigation(Mitigation):
+    """
+    Narrows the event filter of an instance to 'filter_value', and puts
+    back the filter it had before
+
+    Only as many filter bytes as the `InstanceEventFilter` type of
+    'filter_value' needs are read and written, as instance types with a
+    narrower filter need not answer the other queries; a plain int is
+    taken to be a 24-bit filter.
+
+    :param filter_value: The event filter to use while mitigated, e.g. an
+    `InstanceEventFilter` without the events that are flooding the bus
+    """
+
+    def __init__(self, filter_value: int):
+        self.filter_value = int(filter_value)
+        self._width = _filter_bytes(filter_value)
+        # (address, instance) -> the filter before mitigation
+        self._saved: dict[tuple[int, int], int] = {}
+
+    def _set(self, device, instance, value: int):
+        for dtr, byte in zip(
+                (DTR0, DTR1, DTR2), value.to_bytes(3, "little")[:self._width]):
+            yield dtr(byte)
+        yield SetEventFilter(device, instance)
+
+    def apply(self, device, instance):
+        if instance is None:
+            _LOG.warning("Event filters can only be narrowed per instance")
+            return
+        saved = 0
+        for n, query in enumerate(_FILTER_QUERIES[:self._width]):
+            rsp = yield query(device, instance)
+            if check_bad_rsp(rsp):
+                # Without the whole filter it couldn't be put back, so
+                # leave it alone
+                raise MissingResponse(
+                    f"Could not read the event filter of A²{device.address} "
+                    f"I{instance.value}")
+            saved |= rsp.value << (8 * n)
+        self._saved[(device.address, instance.value)] = saved
+        yield from self._set(device, instance, self.filter_value)
+
+    def revert(self, device, instance):
+        if instance is None:
+            return
+        saved = self._saved.pop((device.address, instance.value), None)
+        if saved is not None:
+            yield from self._set(device, instance, saved)
+
+
+@dataclass
+class StormAlert:
+    """
+    Passed to the alert callback when a storm is detected or is over
+
+    :param short_address: The device short address
+    :param instance_number: The instance number, or None for a device storm
+    :param rate: The event rate, in events per second, when detected
+    :param mitigated: False when detected, or True when the mitigation has
+    been applied; for a recovery, whether the mitigation was undone
+    :param recovered: True if the storm is over and the mitigation undone
+    """
+
+    short_address: int
+    instance_number: Optional[int]
+    rate: float
+    mitigated: bool
+    recovered: bool = False
+
+
+class _Storm:
+    """The state of one device or instance that has had a storm"""
+
+    __slots__ = ("hold_off", "mitigated", "until")
+
+    def __init__(self, hold_off: float):
+        self.hold_off = hold_off
+        self.mitigated = False
+        # While mitigated: the time to undo it. Afterwards: the time
+        # before which a new storm doubles the hold off
+        self.until = 0.0
+
+
+class EventStormMonitor:
+    """
+    Tracks event rates per control device and instance, and throttles
+    those that flood the bus
+
+    :param driver: A driver with `run_sequence()`, used to apply and undo
+    mitigations
+    :param instance_rate: Events per second from one instance that count
+    as a storm
+    :param device_rate: Events per second from one device, summed over
+    its instances, that count as a storm
+    :param window: Seconds over which rates are averaged
+    :param instance_mitigation: What to do to an instance with a storm, or
+    None to only raise alerts
+    :param device_mitigation: What to do to a device with a storm, or None
+    :param hold_off: Seconds before a mitigation is first undone
+    :param max_hold_off: The longest hold off, after repeated storms
+    :param alert: A function called with a `StormAlert`
+    :param clock: A function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        driver,
+        instance_rate: float = 5.0,
+        device_rate: float = 10.0,
+        window: float = 2.0,
+        instance_mitigation: Optional[Mitigation] = None,
+        device_mitigation: Optional[Mitigation] = None,
+        hold_off: float = 60.0,
+        max_hold_off: float = 3600.0,
+        alert: Optional[Callable[[StormAlert], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.driver = driver
+        self.instance_rate = instance_rate
+        self.device_rate = device_rate
+        self.window = window
+        self.instance_mitigation = instance_mitigation
+        self.device_mitigation = device_mitigation
+        self.hold_off = hold_off
+        self.max_hold_off = max_hold_off
+        self.alert = alert
+        self._clock = clock
+        # Keyed by (address, instance number), with None as the instance
+        # number for whole devices
+        self._rates: dict[tuple[int, Optional[int]], EventRate] = {}
+        self._storms: dict[tuple[int, Optional[int]], _Storm] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def rate(
+        self, short_address: int, instance_number: Optional[int] = None,
+    ) -> float:
+        """The current event rate of a device or instance"""
+        rate = self._rates.get((short_address, instance_number))
+        return rate.value(self._clock()) if rate else 0.0
+
+    def is_mitigated(
+        self, short_address: int, instance_number: Optional[int] = None,
+    ) -> bool:
+        storm = self._storms.get((short_address, instance_number))
+        return storm is not None and storm.mitigated
+
+    def feed(self, ev: _Event) -> None:
+        """
+        Count an event seen on the bus
+
+        Must be called from the event loop thread if mitigations are
+        configured.
+        """
+        if ev.short_address is None:
+            return
+        now = self._clock()
+        address = ev.short_address.address
+        keys = [((address, None), self.device_rate)]
+        if ev.instance_number is not None:
+            keys.append(((address, ev.instance_number), self.instance_rate))
+        for key, threshold in keys:
+            rate = self._rates.get(key)
+            if rate is None:
+                rate = self._rates[key] = EventRate(self.window)
+            value = rate.add(now)
+            if value > threshold:
+                self._storm(key, value, now)
+
+    def _storm(self, key, rate: float, now: float) -> None:
+        storm = self._storms.get(key)
+        if storm is not None and storm.mitigated:
+            return
+        if storm is None:
+            storm = self._storms[key] = _Storm(self.hold_off)
+        elif now < storm.until:
+            # Back again soon after recovering: hold it off for longer
+            storm.hold_off = min(2 * storm.hold_off, self.max_hold_off)
+        else:
+            storm.hold_off = self.hold_off
+        address, instance = key
+        mitigation = self.device_mitigation if instance is None \
+            else self.instance_mitigation
+        what = f"A²{address}" if instance is None else f"A²{address} I{instance}"
+        _LOG.warning(f"Event storm from {what}: {rate:.1f} events/s")
+        storm.mitigated = True
+        storm.until = now + storm.hold_off
+        if mitigation is None:
+            self._alert(StormAlert(address, instance, rate, mitigated=False))
+        else:
+            self._start(self._mitigate(key, mitigation, rate))
+        try:
+            asyncio.get_running_loop().call_later(storm.hold_off, self.check)
+        except RuntimeError:
+            # Without an event loop, recovery waits for a call to check()
+            pass
+
+    def _start(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _alert(self, alert: StormAlert) -> None:
+        if self.alert is None:
+            return
+        try:
+            self.alert(alert)
+        except Exception:
+            _LOG.exception("Event storm alert callback failed")
+
+    @staticmethod
+    def _target(key) -> tuple[DeviceShort, Optional[InstanceNumber]]:
+        address, instance = key
+        return (
+            DeviceShort(address),
+            None if instance is None else InstanceNumber(instance),
+        )
+
+    async def _run(self, seq) -> bool:
+        try:
+            await self.driver.run_sequence(seq)
+        except (DALIError, OSError, asyncio.TimeoutError) as e:
+            _LOG.error(f"Event storm mitigation failed: {e}")
+            return False
+        return True
+
+    async def _mitigate(self, key, mitigation: Mitigation, rate: float) -> None:
+        done = await self._run(mitigation.apply(*self._target(key)))
+        self._alert(StormAlert(*key, rate, mitigated=done))
+
+    async def _recover(self, key, mitigation: Mitigation) -> None:
+        done = await self._run(mitigation.revert(*self._target(key)))
+        self._alert(StormAlert(
+            *key, self.rate(*key), mitigated=done, recovered=True))
+
+    def check(self) -> None:
+        """
+        Undo mitigations whose hold off has passed
+
+        This is scheduled automatically when an event loop is running.
+        """
+        now = self._clock()
+        for key, storm in self._storms.items():
+            if not storm.mitigated or now < storm.until:
+                continue
+            storm.mitigated = False
+            # A storm within one more hold off counts as a repeat
+            storm.until = now + storm.hold_off
+            _LOG.info(f"Event storm from {key} is over")
+            mitigation = self.device_mitigation if key[1] is None \
+                else self.instance_mitigation
+            if mitigation is None:
+                self._alert(StormAlert(
+                    *key, self.rate(*key), mitigated=False, recovered=True))
+            else:
+                self._start(self._recover(key, mitigation))
+
+    def bus_traffic(self, driver, command, response, config_command_error):
+        """A callback for a hid driver's `bus_traffic`"""
+        if isinstance(command, _Event):
+            self.feed(command)
+
+    async def watch(self, queue: asyncio.Queue) -> None:
+        """
+        Count the events from a serial driver's receive queue, e.g. one
+        from `driver.new_dali_rx_queue()`; runs until cancelled
+        """
+        while True:
+            command = await queue.get()
+            if isinstance(command, _Event):
+                self.feed(command)
+
+    async def close(self) -> None:
+        """Wait for mitigations that are being applied or undone"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
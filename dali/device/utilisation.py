@@ -0,0 +1,291 @@
+"""
+Aggregate occupancy sensor events into occupancy time and utilisation
+
+`OccupancyAggregator` follows the `OccupancyEvent`s seen on the bus and
+keeps, for each sensor instance and for each configured zone of
+sensors, whether it is occupied, how long it has been occupied in total,
+how many times it has become occupied, and its utilisation, the
+fraction of time occupied, over one or more sliding windows.
+
+Nothing is kept per event: occupied time is added into a fixed ring of
+`bucket`-second slots, sized for the longest window, so memory use
+depends only on the number of sensors and zones, and utilisation is
+accurate to about one bucket. A snapshot can be taken at any time, and
+accounts for time up to that moment.
+
+A zone is occupied while any of its sensors is. Only events that carry
+a short address and instance number, i.e. those using the
+"Device/Instance" scheme, can be traced to a sensor.
+
+Example:
+```
+aggregator = OccupancyAggregator(
+    zones={"meeting room": [(3, 0), (4, 0)]},
+    windows=(900, 3600),
+)
+driver.bus_traffic.register(aggregator.bus_traffic)
+...
+print(aggregator.zone("meeting room").utilisation[3600])
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from dali.device.general import _Event
+from dali.device.occupancy import OccupancyEvent
+
+
+@dataclass(frozen=True)
+class OccupancySnapshot:
+    """
+    The occupancy of a sensor instance or zone at `time`
+
+    Times are in seconds, as given by the aggregator's clock.
+    """
+
+    time: float
+    occupied: bool
+    # When the sensor or zone last changed between occupied and vacant,
+    # or when it was first seen
+    since: float
+    occupied_time: float
+    # The number of times it has become occupied
+    periods: int
+    # Window length -> fraction of that window spent occupied
+    utilisation: dict[float, float]
+    events: int
+    # The movement flag of the most recent event; any sensor, for a zone
+    movement: bool
+
+    @property
+    def dwell(self) -> float:
+        """How long it has been in its current state"""
+        return self.time - self.since
+
+    @property
+    def mean_dwell(self) -> Optional[float]:
+        """The mean length of an occupied period, including any current one"""
+        return self.occupied_time / self.periods if self.periods else None
+
+
+class _Tracker:
+    """Occupied state and time of one sensor instance or zone"""
+
+    __slots__ = (
+        "occupied", "since", "start", "last", "occupied_time", "periods",
+        "events", "movement", "_bucket", "_slots", "_index",
+    )
+
+    def __init__(self, bucket: float, num_buckets: int, now: float):
+        self.occupied = False
+        self.since = now
+        self.start = now
+        # Time has been accounted for up to here
+        self.last = now
+        self.occupied_time = 0.0
+        self.periods = 0
+        self.events = 0
+        self.movement = False
+        self._bucket = bucket
+        # Occupied seconds in each bucket, as a ring
+        self._slots = array("d", bytes(8 * num_buckets))
+        self._index = int(now // bucket)
+
+    def _roll(self, index: int) -> None:
+        n = len(self._slots)
+        if index - self._index >= n:
+            for i in range(n):
+                self._slots[i] = 0.0
+        else:
+            for i in range(self._index + 1, index + 1):
+                self._slots[i % n] = 0.0
+        self._index = index
+
+    def advance(self, now: float) -> None:
+        t = self.last
+        if now <= t:
+            return
+        if self.occupied:
+            self.occupied_time += now - t
+        # Only the last ring's worth of buckets can still be seen
+        t = max(t, now - len(self._slots) * self._bucket)
+        while t < now:
+            index = int(t // self._bucket)
+            if index > self._index:
+                self._roll(index)
+            end = min(now, (index + 1) * self._bucket)
+            if self.occupied:
+                self._slots[index % len(self._slots)] += end - t
+            t = end
+        self._roll(max(self._index, int(now // self._bucket)))
+        self.last = now
+
+    def set(self, occupied: bool, now: float) -> None:
+        self.advance(now)
+        if occupied != self.occupied:
+            self.occupied = occupied
+            self.since = now
+            if occupied:
+                self.periods += 1
+
+    def utilisation(self, window: float, now: float) -> float:
+        self.advance(now)
+        n = len(self._slots)
+        k = min(n, max(1, math.ceil(window / self._bucket)))
+        occupied = sum(self._slots[(self._index - j) % n] for j in range(k))
+        span = (k - 1) * self._bucket + (now - self._index * self._bucket)
+        span = min(span, now - self.start)
+        return min(1.0, occupied / span) if span > 0 else 0.0
+
+    def snapshot(
+        self, windows: tuple[float, ...], now: float, movement: bool,
+    ) -> OccupancySnapshot:
+        utilisation = {w: self.utilisation(w, now) for w in windows}
+        return OccupancySnapshot(
+            time=now,
+            occupied=self.occupied,
+            since=self.since,
+            occupied_time=self.occupied_time,
+            periods=self.periods,
+            utilisation=utilisation,
+            events=self.events,
+            movement=movement,
+        )
+
+
+class OccupancyAggregator:
+    """
+    Keeps running occupancy statistics for sensors and zones
+
+    :param zones: Zone name -> the (short address, instance number) of
+    the sensor instances in it; more can be added with `add_zone()`
+    :param windows: The lengths, in seconds, of the sliding windows to
+    report utilisation over
+    :param bucket: The resolution, in seconds, of the sliding windows
+    :param clock: A function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        zones: Optional[dict[str, Iterable[tuple[int, int]]]] = None,
+        windows: Iterable[float] = (900.0, 3600.0),
+        bucket: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.windows = tuple(windows)
+        if not self.windows or min(self.windows) <= 0 or bucket <= 0:
+            raise ValueError("Windows and bucket must be positive")
+        self.bucket = bucket
+        self._num_buckets = math.ceil(max(self.windows) / bucket)
+        self._clock = clock
+        self._sensors: dict[tuple[int, int], _Tracker] = {}
+        self._zones: dict[str, _Tracker] = {}
+        self._members: dict[str, frozenset[tuple[int, int]]] = {}
+        # Sensor -> names of the zones it is in
+        self._zones_of: dict[tuple[int, int], list[str]] = {}
+        # Zone name -> number of its sensors that are occupied
+        self._occupied_count: dict[str, int] = {}
+        for name, members in (zones or {}).items():
+            self.add_zone(name, members)
+
+    def _tracker(self) -> _Tracker:
+        return _Tracker(self.bucket, self._num_buckets, self._clock())
+
+    def add_zone(self, name: str, members: Iterable[tuple[int, int]]) -> None:
+        """Add a zone, made up of sensor instances"""
+        if name in self._zones:
+            raise ValueError(f"Zone {name!r} already exists")
+        members = frozenset(
+            (int(address), int(instance)) for address, instance in members)
+        tracker = self._tracker()
+        self._zones[name] = tracker
+        self._members[name] = members
+        count = 0
+        for member in members:
+            self._zones_of.setdefault(member, []).append(name)
+            sensor = self._sensors.get(member)
+            if sensor is not None and sensor.occupied:
+                count += 1
+        self._occupied_count[name] = count
+        tracker.set(count > 0, tracker.start)
+
+    @property
+    def zones(self) -> list[str]:
+        return list(self._zones)
+
+    @property
+    def sensors(self) -> list[tuple[int, int]]:
+        """The (short address, instance number) of each sensor seen"""
+        return list(self._sensors)
+
+    def feed(self, ev: _Event) -> None:
+        """Account for an event seen on the bus"""
+        if not isinstance(ev, OccupancyEvent) or ev.short_address is None \
+                or ev.instance_number is None:
+            return
+        data = ev.event_data
+        if data is None:
+            return
+        now = self._clock()
+        key = (ev.short_address.address, ev.instance_number)
+        sensor = self._sensors.get(key)
+        if sensor is None:
+            sensor = self._sensors[key] = self._tracker()
+        was_occupied = sensor.occupied
+        sensor.set(data.occupied, now)
+        sensor.events += 1
+        sensor.movement = data.movement
+        for name in self._zones_of.get(key, ()):
+            zone = self._zones[name]
+            zone.events += 1
+            if data.occupied != was_occupied:
+                self._occupied_count[name] += 1 if data.occupied else -1
+                zone.set(self._occupied_count[name] > 0, now)
+
+    def sensor(
+        self, short_address: int, instance_number: int,
+    ) -> Optional[OccupancySnapshot]:
+        """The current statistics of a sensor instance, if it has been seen"""
+        sensor = self._sensors.get((short_address, instance_number))
+        if sensor is None:
+            return None
+        return sensor.snapshot(self.windows, self._clock(), sensor.movement)
+
+    def zone(self, name: str) -> OccupancySnapshot:
+        """The current statistics of a zone"""
+        movement = any(
+            self._sensors[m].movement for m in self._members[name]
+            if m in self._sensors)
+        return self._zones[name].snapshot(
+            self.windows, self._clock(), movement)
+
+    def snapshot(self) -> tuple[
+        dict[tuple[int, int], OccupancySnapshot],
+        dict[str, OccupancySnapshot],
+    ]:
+        """The current statistics of every sensor and every zone"""
+        return (
+            {key: self.sensor(*key) for key in self._sensors},
+            {name: self.zone(name) for name in self._zones},
+        )
+
+    def bus_traffic(self, driver, command, response, config_command_error):
+        """A callback for a hid driver's `bus_traffic`"""
+        if isinstance(command, _Event):
+            self.feed(command)
+
+    async def watch(self, queue: asyncio.Queue) -> None:
+        """
+        Account for the events from a serial driver's receive queue, e.g.
+        one from `driver.new_dali_rx_queue()`; runs until cancelled
+        """
+        while True:
+            command = await queue.get()
+            if isinstance(command, _Event):
+                self.feed(command)
@@ -0,0 +1,159 @@
+"""
+Last-writer-wins coalescing of commands waiting to be sent
+
+When commands are produced faster than the bus can carry them, for
+example while a slider in a user interface is being dragged, most of
+them are out of date before they are sent. `CommandCoalescer` keeps
+commands that are waiting for the bus in a queue, and when a new
+command would simply overwrite the effect of one that is still waiting,
+the waiting one is dropped.
+
+Only commands whose effect is completely replaced by a later command to
+the same destination are merged: DAPC, the DT8 "Set Temporary ..."
+commands and Activate. Queries, send-twice configuration commands and
+everything else are sent exactly as queued, and nothing queued after
+them is merged with anything queued before them. A waiting command is
+also never merged past a different mergeable command that may reach the
+same control gear, so that for example a newer "Set Temporary ..." is
+not moved after an Activate queued between the two.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Optional, Sequence
+
+from dali import command
+from dali.address import DeviceShort, GearShort
+from dali.gear import colour
+from dali.gear.general import DAPC, DTR0, DTR1, DTR2
+
+# Commands that can be merged, and the DTRs that select *what* the
+# command sets rather than supplying the value; commands setting
+# different things are never merged
+_MERGEABLE = {
+    DAPC: (),
+    colour.SetTemporaryXCoordinate: (),
+    colour.SetTemporaryYCoordinate: (),
+    colour.SetTemporaryColourTemperature: (),
+    colour.SetTemporaryPrimaryNDimLevel: (DTR2,),
+    colour.SetTemporaryRGBDimLevel: (),
+    colour.SetTemporaryWAFDimLevel: (),
+    colour.SetTemporaryRGBWAFControl: (),
+    colour.Activate: (),
+}
+
+_DTRS = (DTR0, DTR1, DTR2)
+
+
+def coalesce_key(commands: Sequence[command.Command]) -> Optional[tuple]:
+    """
+    Work out whether a group of commands can be merged with others
+
+    :param commands: Commands that are sent together: optionally some
+    DTR writes, followed by the commands that use them
+    :return: A key which is equal for groups of commands that the later
+    one completely overrides, or None if the group must not be merged
+    """
+    key = []
+    dtrs = {}
+    for cmd in commands:
+        if type(cmd) in _DTRS:
+            dtrs[type(cmd)] = cmd.param
+            continue
+        selectors = _MERGEABLE.get(type(cmd))
+        if selectors is None or cmd.is_query or cmd.sendtwice:
+            return None
+        key.append((
+            type(cmd),
+            cmd.destination.__class__,
+            str(cmd.destination),
+            tuple(dtrs.get(dtr) for dtr in selectors),
+        ))
+    return tuple(key) if key else None
+
+
+def _may_overlap(key: tuple, other: tuple) -> bool:
+    """Could the commands of two keys reach any of the same bus units?"""
+    for _, cls, dest, _ in key:
+        for _, other_cls, other_dest, _ in other:
+            if (cls, dest) == (other_cls, other_dest):
+                return True
+            # Groups and broadcasts may include any short address
+            if not issubclass(cls, (GearShort, DeviceShort)) \
+                    or not issubclass(other_cls, (GearShort, DeviceShort)):
+                return True
+    return False
+
+
+class CommandCoalescer:
+    """
+    A queue of commands waiting to be sent through a driver, which
+    merges waiting commands that are overridden by newer ones
+
+    The driver must provide a `transaction_lock` and an async
+    `send(command, in_transaction=...)` method.
+    """
+
+    def __init__(self, driver):
+        self._driver = driver
+        # Entries are [key, commands, future]; a key of None is a
+        # barrier that nothing is merged across
+        self._pending: list[list] = []
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """The number of groups of commands waiting to be sent"""
+        return len(self._pending)
+
+    async def send(self, *commands: command.Command) -> Optional[command.Response]:
+        """
+        Queue commands to be sent together, and wait until they have been
+        sent or superseded
+
+        :param commands: One or more commands, sent as a transaction
+        :return: The response to the last command, or None if no
+        response is expected or the commands were superseded by newer
+        ones before they could be sent
+        """
+        if not commands:
+            raise ValueError("At least one command must be given")
+        key = coalesce_key(commands)
+        if key is not None:
+            for entry in reversed(self._pending):
+                if entry[0] is None:
+                    break
+                if entry[0] == key:
+                    self._pending.remove(entry)
+                    if not entry[2].done():
+                        entry[2].set_result(None)
+                    break
+                # A different command that may reach the same bus units
+                # has to stay between the two
+                if _may_overlap(entry[0], key):
+                    break
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append([key, commands, future])
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            async with self._driver.transaction_lock:
+                # Only take the entry once the bus is ours, so that it
+                # can still be superseded while waiting for the lock
+                if not self._pending:
+                    break
+                _, commands, future = self._pending.pop(0)
+                try:
+                    response = None
+                    for cmd in commands:
+                        response = await self._driver.send(
+                            cmd, in_transaction=True)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(response)
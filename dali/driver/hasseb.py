@@ -10,6 +10,7 @@ from dali.frame import BackwardFrameError
 
 from dali.sequences import sleep as sequence_sleep
 from dali.sequences import progress as sequence_progress
+from dali.sequences import batch as sequence_batch
 
 import dali.gear.general as gear
 
@@ -105,6 +106,12 @@ class HassebDALIUSBDriver(DALIDriver):
                 elif isinstance(cmd, sequence_progress):
                     if (callable(progress_cb)):
                         progress_cb(cmd)
+                elif isinstance(cmd, sequence_batch):
+                    response = []
+                    for batch_cmd in cmd.commands:
+                        if batch_cmd.devicetype != 0:
+                            self.send(EnableDeviceType(batch_cmd.devicetype))
+                        response.append(self.send(batch_cmd))
                 else:
                     if cmd.devicetype != 0:
                         self.send(EnableDeviceType(cmd.devicetype))
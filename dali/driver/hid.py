@@ -11,8 +11,11 @@ import logging
 import random
 import glob
 from dali.exceptions import UnsupportedFrameTypeError, CommunicationError
+from dali.driver.coalesce import CommandCoalescer
+from dali.driver.priority import PriorityLock
 from dali.sequences import sleep as seq_sleep
 from dali.sequences import progress as seq_progress
+from dali.sequences import batch as seq_batch
 import dali.frame
 
 # dali.command and dali.gear are required for the bus traffic callback
@@ -74,8 +77,12 @@ class hid:
 
         # Acquire this lock to perform a series of commands as a
         # transaction.  While you hold the lock, you must call send()
-        # with keyword argument in_transaction=True
-        self.transaction_lock = asyncio.Lock()
+        # with keyword argument in_transaction=True.  Use
+        # transaction_lock.urgent() to go ahead of other waiters.
+        self.transaction_lock = PriorityLock()
+
+        # Commands waiting to be sent by send_coalesced()
+        self._coalescer = CommandCoalescer(self)
 
         # Register to be called back with "connected", "disconnected"
         # or "failed" as appropriate ("failed" means the reconnect
@@ -210,6 +217,23 @@ class hid:
             if not in_transaction:
                 self.transaction_lock.release()
 
+    async def send_coalesced(self, *commands):
+        """Send DALI commands, dropping them if they are overridden first
+
+        The commands are sent together as a transaction.  While they
+        are waiting for the bus, later calls with commands to the same
+        destination that override them completely (for example
+        another DAPC) replace them; the replaced call then returns
+        None without anything being sent.  Queries and other commands
+        are never replaced.  Any DTR writes the commands need must be
+        passed too, before the commands that use them.  See
+        dali.driver.coalesce for details.
+
+        Useful for commands that come from a user interface faster
+        than the bus can carry them.
+        """
+        return await self._coalescer.send(*commands)
+
     async def power_supply(self, supply_on, in_transaction=False, exceptions=None):
         """
         TODO
@@ -250,6 +274,8 @@ class hid:
                 elif isinstance(cmd, seq_progress):
                     if progress:
                         progress(cmd)
+                elif isinstance(cmd, seq_batch):
+                    response = await self._send_batch(cmd.commands)
                 else:
                     if cmd.devicetype != 0:
                         await self._send_raw(EnableDeviceType(cmd.devicetype))
@@ -258,6 +284,21 @@ class hid:
             self.transaction_lock.release()
             seq.close()
 
+    async def _send_batch(self, commands):
+        """Send a batch of commands from a sequence, in order
+
+        Returns a list of responses.  Drivers for devices that can
+        have more than one command outstanding at once override this
+        to avoid waiting for each response before sending the next
+        command.
+        """
+        responses = []
+        for cmd in commands:
+            if cmd.devicetype != 0:
+                await self._send_raw(EnableDeviceType(cmd.devicetype))
+            responses.append(await self._send_raw(cmd))
+        return responses
+
     def _initialise_device(self):
         """Send any device-specific initialisation commands
         """
@@ -414,73 +455,118 @@ class tridonic(hid):
             return tridonic._SEND_MODE_DALI24
         raise UnsupportedFrameTypeError
 
+    async def _send_batch(self, commands):
+        # The device accepts a second command while the first is still
+        # in progress.  Each command is written to the device only once
+        # the previous one has been, so they go out in order; only the
+        # waits for their responses overlap.
+        to_send = []
+        for cmd in commands:
+            if cmd.devicetype != 0:
+                to_send.append(EnableDeviceType(cmd.devicetype))
+            to_send.append(cmd)
+        pending = []
+        try:
+            for cmd in to_send:
+                pending.append(await self._transmit(cmd))
+            responses = [await p for p in pending]
+        except BaseException:
+            for p in pending:
+                p.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+        return [r for cmd, r in zip(to_send, responses)
+                if not isinstance(cmd, EnableDeviceType)]
+
     async def _send_raw(self, command):
+        return await (await self._transmit(command))
+
+    async def _transmit(self, command):
+        """Write a command to the device
+
+        Returns once the command has been written, with a task that
+        completes with its response.  The command holds one of the
+        device's two slots for outstanding commands until that task is
+        done.
+        """
         frame = command.frame
         if len(frame) not in (16, 24):
             raise UnsupportedFrameTypeError
         await self.connected.wait()
-        async with self._command_semaphore:
-            seq = next(self._cmd_seq)
-            self._log.debug("Sending with seq %x", seq)
-            event = asyncio.Event()
-            messages = []
-            # If seq is in self._outstanding this means we've wrapped
-            # around the whole sequence number space with an event
-            # still outstanding: clearly a bug!
-            assert seq not in self._outstanding
-            self._outstanding[seq] = (event, messages)
-            data = self._cmd(
-                self._CMD_SEND, seq,
-                ctrl=self._SEND_CTRL_SENDTWICE if command.sendtwice else 0,
-                mode=self._command_mode(frame),
-                frame=frame.pack_len(4))
-            try:
-                os.write(self._f, data)
-            except OSError:
-                # The device has failed.  Disconnect, schedule a
-                # reconnection, and report this command as failed.
-                self._log.debug("fail on transmit, disconnecting")
-                self.disconnect(reconnect=True)
+        await self._command_semaphore.acquire()
+        seq = next(self._cmd_seq)
+        self._log.debug("Sending with seq %x", seq)
+        event = asyncio.Event()
+        messages = []
+        # If seq is in self._outstanding this means we've wrapped
+        # around the whole sequence number space with an event
+        # still outstanding: clearly a bug!
+        assert seq not in self._outstanding
+        self._outstanding[seq] = (event, messages)
+
+        def _done(task=None):
+            self._outstanding.pop(seq, None)
+            self._command_semaphore.release()
+
+        data = self._cmd(
+            self._CMD_SEND, seq,
+            ctrl=self._SEND_CTRL_SENDTWICE if command.sendtwice else 0,
+            mode=self._command_mode(frame),
+            frame=frame.pack_len(4))
+        try:
+            os.write(self._f, data)
+        except OSError:
+            # The device has failed.  Disconnect, schedule a
+            # reconnection, and report this command as failed.
+            _done()
+            self._log.debug("fail on transmit, disconnecting")
+            self.disconnect(reconnect=True)
+            raise CommunicationError
+        # The cleanup is a done callback rather than part of the task,
+        # so that it also happens if the task is cancelled before it
+        # starts
+        task = asyncio.ensure_future(self._receive(command, event, messages))
+        task.add_done_callback(_done)
+        return task
+
+    async def _receive(self, command, event, messages):
+        outstanding_transmissions = 2 if command.sendtwice else 1
+        response = None
+        while outstanding_transmissions or response is None:
+            self._log.debug(f"waiting for {outstanding_transmissions=} "
+                            "{response=}")
+            if len(messages) == 0:
+                await event.wait()
+                event.clear()
+            message = messages.pop(0)
+            if message == "fail":
+                # The device has gone away, possibly in the middle
+                # of processing our command.
+                self._log.debug("processing queued fail on receive")
                 raise CommunicationError
 
-            outstanding_transmissions = 2 if command.sendtwice else 1
-            response = None
-            while outstanding_transmissions or response is None:
-                self._log.debug(f"waiting for {outstanding_transmissions=} "
-                                "{response=}")
-                if len(messages) == 0:
-                    await event.wait()
-                    event.clear()
-                message = messages.pop(0)
-                if message == "fail":
-                    # The device has gone away, possibly in the middle
-                    # of processing our command.
-                    self._log.debug("processing queued fail on receive")
-                    raise CommunicationError
-
-                # The message mode is guaranteed to be _MODE_RESPONSE
-                mode, rtype, frame, interval, seq = self._resptmpl.unpack(
-                    message)
-                self._log.debug(f"message mode={mode:02x} rtype={rtype:02x} frame={frame} interval={interval:04x} seq={seq:02x}")
-                if rtype in (self._RESPONSE_FRAME_DALI16,
-                             self._RESPONSE_FRAME_DALI24):
-                    # XXX check the frame contents?
-                    outstanding_transmissions -= 1
-                elif rtype == self._RESPONSE_FRAME_DALI8:
-                    response = dali.frame.BackwardFrame(frame)
-                elif rtype == self._RESPONSE_INFO \
-                     and frame[3] == self._BUS_STATUS_FRAMING_ERROR:
-                    response = dali.frame.BackwardFrameError(255)
-                elif rtype == self._RESPONSE_NO_FRAME:
-                    response = "no"
-                else:
-                    self._log.debug(f"didn't understand {rtype=}")
-            del self._outstanding[seq], event, messages
-            if command.response:
-                # Construct response and return it
-                if response == "no":
-                    return command.response(None)
-                return command.response(response)
+            # The message mode is guaranteed to be _MODE_RESPONSE
+            mode, rtype, frame, interval, seq = self._resptmpl.unpack(
+                message)
+            self._log.debug(f"message mode={mode:02x} rtype={rtype:02x} frame={frame} interval={interval:04x} seq={seq:02x}")
+            if rtype in (self._RESPONSE_FRAME_DALI16,
+                         self._RESPONSE_FRAME_DALI24):
+                # XXX check the frame contents?
+                outstanding_transmissions -= 1
+            elif rtype == self._RESPONSE_FRAME_DALI8:
+                response = dali.frame.BackwardFrame(frame)
+            elif rtype == self._RESPONSE_INFO \
+                 and frame[3] == self._BUS_STATUS_FRAMING_ERROR:
+                response = dali.frame.BackwardFrameError(255)
+            elif rtype == self._RESPONSE_NO_FRAME:
+                response = "no"
+            else:
+                self._log.debug(f"didn't understand {rtype=}")
+        if command.response:
+            # Construct response and return it
+            if response == "no":
+                return command.response(None)
+            return command.response(response)
 
     async def _bus_watch(self):
         # Why is this a task, and not just run from _handle_read()?
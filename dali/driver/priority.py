@@ -0,0 +1,87 @@
+"""
+A transaction lock that lets urgent bus traffic go first
+
+Drivers serialise access to the bus with `transaction_lock`. With a plain
+`asyncio.Lock`, a command that must go out quickly, such as switching
+lights in response to a button press, waits behind everything already
+queued. `PriorityLock` works like `asyncio.Lock`, but waiters that take it
+through `urgent()` are handed the lock before any other waiter. The
+command or transaction that currently holds the lock is never
+interrupted.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from collections import deque
+
+
+class PriorityLock:
+    """
+    An asyncio lock with two queues of waiters: urgent and normal
+
+    `acquire()`, `release()`, `locked()` and `async with` behave as for
+    `asyncio.Lock`; waiters in each queue get the lock in the order they
+    asked for it.
+    """
+
+    def __init__(self):
+        self._locked = False
+        # Futures of waiters: urgent first, then normal
+        self._waiters: tuple[deque, deque] = (deque(), deque())
+
+    def locked(self) -> bool:
+        return self._locked
+
+    @property
+    def waiting(self) -> int:
+        """The number of tasks waiting for the lock"""
+        return sum(
+            1 for queue in self._waiters for f in queue if not f.done())
+
+    async def acquire(self, urgent: bool = False) -> bool:
+        if not self._locked and not self.waiting:
+            self._locked = True
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        queue = self._waiters[0 if urgent else 1]
+        queue.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # The lock was handed over just as we were cancelled
+                self.release()
+            else:
+                with contextlib.suppress(ValueError):
+                    queue.remove(fut)
+            raise
+        return True
+
+    def release(self) -> None:
+        if not self._locked:
+            raise RuntimeError("Lock is not acquired")
+        # Hand the lock straight to the next waiter, so nothing else can
+        # take it in between
+        for queue in self._waiters:
+            while queue:
+                fut = queue.popleft()
+                if not fut.done():
+                    fut.set_result(True)
+                    return
+        self._locked = False
+
+    @contextlib.asynccontextmanager
+    async def urgent(self):
+        """Hold the lock, ahead of everything not urgent that is waiting"""
+        await self.acquire(urgent=True)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
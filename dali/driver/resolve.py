@@ -0,0 +1,160 @@
+"""
+Background resolution of events with an unknown instance type
+
+An event using the "Device/Instance" addressing scheme can only be
+decoded if the instance type of the sending instance is known; if it is
+not, `Command.from_frame()` returns an `AmbiguousInstanceType`.
+
+`InstanceTypeResolver` holds such events back instead of passing them
+on. For each device address and instance number it sends a single
+`QueryInstanceType` in the background, once the bus is not otherwise in
+use, adds the answer to the `DeviceInstanceTypeMapper` and then passes
+on the held events, decoded. Holding an event never waits for the bus,
+so it can be done from a driver's receive path.
+
+Events that cannot be resolved, because the instance does not answer,
+are passed on as `AmbiguousInstanceType`; further events from that
+instance are passed on straight away until `retry_after` seconds have
+passed.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Callable
+
+from dali.address import DeviceShort, InstanceNumber
+from dali.device.general import AmbiguousInstanceType, QueryInstanceType
+from dali.device.helpers import DeviceInstanceTypeMapper, check_bad_rsp
+from dali.exceptions import DALIError
+
+_LOG = logging.getLogger("dali.driver.resolve")
+
+
+class InstanceTypeResolver:
+    """
+    Holds ambiguous events until the instance type of their sender has
+    been queried
+
+    The driver must provide a `transaction_lock` and an async
+    `send(command)` method.
+
+    :param driver: The driver to send queries through
+    :param dev_inst_map: The mapping to look up and add instance types in
+    :param idle: Seconds to wait for the bus to be free before querying;
+    the query is only sent once the driver's transaction lock has been
+    free for this long
+    :param retry_after: Seconds before an instance that did not answer is
+    queried again
+    :param max_held: The most events held for one instance; older events
+    are dropped beyond this
+    """
+
+    def __init__(
+        self,
+        driver,
+        dev_inst_map: DeviceInstanceTypeMapper,
+        idle: float = 0.1,
+        retry_after: float = 60.0,
+        max_held: int = 32,
+    ):
+        self.driver = driver
+        self.dev_inst_map = dev_inst_map
+        self.idle = idle
+        self.retry_after = retry_after
+        self.max_held = max_held
+        # (address, instance) -> events waiting, with where to pass them on
+        self._held: dict[tuple[int, int], deque] = {}
+        self._tasks: dict[tuple[int, int], asyncio.Task] = {}
+        # (address, instance) -> loop time before which not to query again
+        self._failed: dict[tuple[int, int], float] = {}
+
+    @property
+    def pending(self) -> int:
+        """The number of events being held"""
+        return sum(len(h) for h in self._held.values())
+
+    def hold(
+        self,
+        ev: AmbiguousInstanceType,
+        emit: Callable[[object], None],
+    ) -> None:
+        """
+        Take an ambiguous event, and pass it on through 'emit' once it has
+        been decoded
+
+        If the instance type is already known the decoded event is passed
+        on straight away. Must be called from the event loop thread.
+        """
+        decoded = ev.retry_decode(self.dev_inst_map)
+        if decoded is not None:
+            emit(decoded)
+            return
+        key = (ev.short_address.address, ev.instance_number)
+        loop = asyncio.get_running_loop()
+        if self._failed.get(key, 0.0) > loop.time():
+            emit(ev)
+            return
+        held = self._held.get(key)
+        if held is None:
+            held = self._held[key] = deque()
+        if len(held) >= self.max_held:
+            _LOG.warning(
+                f"Dropping event from A²{key[0]} I{key[1]}, too many waiting "
+                "for its instance type")
+            held.popleft()
+        held.append((ev, emit))
+        if key not in self._tasks:
+            self._tasks[key] = loop.create_task(self._resolve(key))
+
+    async def _wait_idle(self) -> None:
+        # Let other users of the bus go first: only continue once the
+        # transaction lock has been free for a while
+        lock = self.driver.transaction_lock
+        while True:
+            await asyncio.sleep(self.idle)
+            if not lock.locked():
+                return
+
+    async def _resolve(self, key: tuple[int, int]) -> None:
+        address, instance = key
+        try:
+            await self._wait_idle()
+            try:
+                rsp = await self.driver.send(QueryInstanceType(
+                    device=DeviceShort(address),
+                    instance=InstanceNumber(instance)))
+            except (DALIError, OSError, asyncio.TimeoutError) as e:
+                _LOG.warning(
+                    f"Querying instance type of A²{address} I{instance} "
+                    f"failed: {e}")
+                rsp = None
+            if check_bad_rsp(rsp):
+                self._failed[key] = \
+                    asyncio.get_running_loop().time() + self.retry_after
+            else:
+                self._failed.pop(key, None)
+                self.dev_inst_map.add_type(
+                    short_address=address,
+                    instance_number=instance,
+                    instance_type=rsp.value,
+                )
+                _LOG.debug(f"A²{address} I{instance} type: {rsp.value}")
+        finally:
+            self._tasks.pop(key, None)
+            for ev, emit in self._held.pop(key, ()):
+                emit(ev.retry_decode(self.dev_inst_map) or ev)
+
+    async def close(self) -> None:
+        """Stop resolving, and pass on the events still held"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Tasks cancelled before they started never got to their cleanup
+        self._tasks.clear()
+        held, self._held = self._held, {}
+        for events in held.values():
+            for ev, emit in events:
+                emit(ev)
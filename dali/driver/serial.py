@@ -34,6 +34,10 @@ import serial_asyncio
 import dali.gear
 from dali import command, frame, gear, sequences
 from dali.driver import trace_logging  # noqa: F401
+from dali.driver.coalesce import CommandCoalescer
+from dali.driver.priority import PriorityLock
+from dali.driver.resolve import InstanceTypeResolver
+from dali.device.general import AmbiguousInstanceType
 from dali.device.helpers import DeviceInstanceTypeMapper
 
 _LOG = logging.getLogger("dali.driver")
@@ -147,7 +151,15 @@ class DriverSerialBase:
         if dev_inst_map is None:
             self.dev_inst_map = DeviceInstanceTypeMapper()
         self._connected = asyncio.Event()
-        self.transaction_lock = asyncio.Lock()
+        self.transaction_lock = PriorityLock()
+        self._coalescer = CommandCoalescer(self)
+        # Set to None to pass on events of unknown instance type as
+        # AmbiguousInstanceType straight away
+        self.instance_type_resolver: Optional[InstanceTypeResolver] = \
+            InstanceTypeResolver(self, self.dev_inst_map)
+        self._dev_inst_scan: Optional[asyncio.Task] = None
+        self._dev_inst_scanned = asyncio.Event()
+        self._dev_inst_scanned.set()
 
     def __repr__(self):
         return f'{self.__class__.__name__}("{urlunparse(self.uri)}")'
@@ -162,12 +174,82 @@ class DriverSerialBase:
 
         :param scan_dev_inst: Whether or not to scan the DALI bus for control
         devices, and update the mapping of addresses and instance numbers to
-        instance type
+        instance type, using `scan_dev_inst()`. The scan runs in the
+        background: `connect()` returns as soon as the transport is ready,
+        the mapping fills in as devices are found, and
+        `wait_dev_inst_scanned()` waits for the scan to finish.
         """
         raise NotImplementedError(
             "'connect()' needs to be implemented in a subclass"
         )
 
+    def _start_scan_dev_inst(self) -> None:
+        # Called by subclasses from 'connect()', once connected
+        if self._dev_inst_scan is not None and not self._dev_inst_scan.done():
+            return
+        self._dev_inst_scanned.clear()
+        self._dev_inst_scan = asyncio.create_task(self._scan_dev_inst_task())
+
+    async def _scan_dev_inst_task(self) -> None:
+        try:
+            await self.scan_dev_inst()
+        except (OSError, asyncio.TimeoutError) as exc:
+            _LOG.error(f"Scanning for control devices failed: {exc}")
+        except Exception:
+            # Nothing awaits this task, so log rather than let the
+            # exception go unretrieved
+            _LOG.exception("Scanning for control devices failed")
+        finally:
+            self._dev_inst_scanned.set()
+
+    async def wait_dev_inst_scanned(self) -> None:
+        """
+        Blocks until the background scan for control devices started by
+        `connect()` has finished; returns straight away if no scan is
+        running
+
+        :return: None
+        """
+        await self._dev_inst_scanned.wait()
+
+    async def scan_dev_inst(self) -> None:
+        """
+        Updates the mapping of addresses and instance numbers to instance
+        type. If the mapping already holds devices with fingerprints, for
+        example after `DeviceInstanceTypeMapper.load()`, those devices are
+        checked and the other addresses probed with a single batch, and
+        only changed or new devices are scanned; otherwise the whole bus is
+        scanned. If the mapping has a `path` it is saved afterwards.
+
+        The scan is interleaved with other traffic, see `run_sequence()`, so
+        it doesn't hold up commands and the mapping can be used while it
+        runs. Control devices are not put in quiescent mode, so input
+        devices keep sending events during the scan, and a scan that stops
+        partway through leaves none of them silenced.
+        """
+        if self.dev_inst_map.fingerprints:
+            _LOG.info("Checking known DALI control devices")
+            rescanned = await self.run_sequence(
+                self.dev_inst_map.refresh(quiescent=False), interleave=True
+            )
+            _LOG.info(
+                f"Scanned {len(rescanned)} changed or new control devices")
+        else:
+            _LOG.info("Scanning DALI bus for control devices")
+            await self.run_sequence(
+                self.dev_inst_map.autodiscover(quiescent=False),
+                interleave=True,
+            )
+        _LOG.info(
+            f"Found {len(self.dev_inst_map.mapping)} enabled control "
+            "device instances"
+        )
+        if self.dev_inst_map.path:
+            try:
+                self.dev_inst_map.save()
+            except OSError as exc:
+                _LOG.warning(f"Could not save device instance map: {exc}")
+
     @property
     def is_connected(self) -> bool:
         """
@@ -203,6 +285,25 @@ class DriverSerialBase:
             "'send()' needs to be implemented in a subclass"
         )
 
+    async def send_coalesced(
+        self, *msgs: command.Command
+    ) -> Optional[command.Response]:
+        """
+        Send DALI commands as a transaction, unless they are overridden
+        while waiting for the bus.
+
+        While the commands are waiting, later calls with commands to the
+        same destination that override them completely (for example
+        another DAPC) replace them. The replaced call then returns None
+        without anything being sent. Queries and other commands are never
+        replaced. See `dali.driver.coalesce` for details.
+
+        :param msgs: One or more Command objects; any DTR writes they need
+        must be included, before the commands that use them
+        :return: The response to the last command, or None
+        """
+        return await self._coalescer.send(*msgs)
+
     def new_dali_rx_queue(self) -> DistributorQueue:
         """
         Returns a DistributorQueue child object, which can then be used as a
@@ -237,6 +338,7 @@ class DriverSerialBase:
             Any,  # The return type depends specifically on the sequence
         ],
         progress: Optional[Callable[[str | sequences.progress], None]] = None,
+        interleave: bool = False,
     ) -> Any:
         """
         Run a command sequence as a transaction. Implements the same API as
@@ -248,35 +350,66 @@ class DriverSerialBase:
         some sequences to provide status information. The function must
         accept a single argument. A suitable example is `progress=print` to
         use the built-in `print()` function.
+        :param interleave: If True, the sequence is not run as a transaction:
+        the transaction lock is taken for each command in turn, so other
+        commands waiting for the bus are sent in between. Only suitable for
+        sequences where each command stands alone, e.g. queries that don't
+        use DTRs.
         :return: Depends on the sequence being used
         """
+        if interleave:
+            return await self._run_sequence(seq, progress, interleave=True)
         async with self.transaction_lock:
-            response = None
-            try:
-                while True:
-                    try:
-                        # Note that 'send()' here refers to the Python
-                        # 'generator' paradigm, not to the DALI driver!
-                        cmd = seq.send(response)
-                    except StopIteration as r:
-                        return r.value
-                    response = None
-                    if isinstance(cmd, sequences.sleep):
-                        await asyncio.sleep(cmd.delay)
-                    elif isinstance(cmd, sequences.progress):
-                        if progress:
-                            progress(cmd)
-                    else:
-                        if cmd.devicetype != 0:
-                            # The 'send()' calls here *do* refer to the DALI
-                            # transmit method
-                            await self.send(
-                                gear.general.EnableDeviceType(cmd.devicetype),
-                                in_transaction=True,
-                            )
-                        response = await self.send(cmd, in_transaction=True)
-            finally:
-                seq.close()
+            return await self._run_sequence(seq, progress)
+
+    async def _run_sequence(
+        self,
+        seq: Generator[command.Command, command.Response, Any],
+        progress: Optional[Callable[[str | sequences.progress], None]],
+        interleave: bool = False,
+    ) -> Any:
+        response = None
+        try:
+            while True:
+                try:
+                    # Note that 'send()' here refers to the Python
+                    # 'generator' paradigm, not to the DALI driver!
+                    cmd = seq.send(response)
+                except StopIteration as r:
+                    return r.value
+                response = None
+                if isinstance(cmd, sequences.sleep):
+                    await asyncio.sleep(cmd.delay)
+                elif isinstance(cmd, sequences.progress):
+                    if progress:
+                        progress(cmd)
+                elif isinstance(cmd, sequences.batch):
+                    # These drivers wait for each response before
+                    # sending the next command, so send the batch
+                    # one command at a time
+                    response = []
+                    for batch_cmd in cmd.commands:
+                        response.append(
+                            await self._send_in_sequence(batch_cmd, interleave))
+                else:
+                    response = await self._send_in_sequence(cmd, interleave)
+        finally:
+            seq.close()
+
+    async def _send_in_sequence(
+        self, cmd: command.Command, interleave: bool = False
+    ) -> Optional[command.Response]:
+        if interleave:
+            # Queue behind anything else waiting for the bus
+            async with self.transaction_lock:
+                return await self._send_in_sequence(cmd)
+        if cmd.devicetype != 0:
+            # The 'send()' calls here *do* refer to the DALI transmit method
+            await self.send(
+                gear.general.EnableDeviceType(cmd.devicetype),
+                in_transaction=True,
+            )
+        return await self.send(cmd, in_transaction=True)
 
 
 def drivers_map() -> dict[str, type[DriverSerialBase]]:
@@ -392,6 +525,8 @@ class DriverLubaRs232(DriverSerialBase):
             self._connected = asyncio.Event()
             self._dev_info: Optional[DriverLubaRs232.LubaDeviceInfo] = None
             self._dev_inst_map: Optional[DeviceInstanceTypeMapper] = None
+            # Holds events of unknown instance type while they are resolved
+            self.resolver: Optional[InstanceTypeResolver] = None
 
             self.reset()
 
@@ -883,6 +1018,15 @@ class DriverLubaRs232(DriverSerialBase):
                     else:
                         self._prev_rx_enable_dt = 0
 
+                    if self.resolver is not None and isinstance(
+                        dali_command, AmbiguousInstanceType
+                    ):
+                        _LOG.debug(f"Resolving instance type for: {dali_command}")
+                        self.resolver.hold(
+                            dali_command, self._queue_rx_dali.distribute
+                        )
+                        return
+
                     _LOG.debug(f"Adding DALI command to queue: {dali_command}")
                     self._queue_rx_dali.distribute(dali_command)
 
@@ -1048,18 +1192,16 @@ class DriverLubaRs232(DriverSerialBase):
         await self._protocol.send_device_info_query()
         await self._protocol.send_device_settings()
         self._protocol.dev_inst_map = self.dev_inst_map
+        if self.instance_type_resolver is not None:
+            self.instance_type_resolver.dev_inst_map = self.dev_inst_map
+        self._protocol.resolver = self.instance_type_resolver
 
         self._connected.set()
 
         # Scan the bus for control devices, and create a mapping of addresses
         # to instance types
         if scan_dev_inst:
-            _LOG.info("Scanning DALI bus for control devices")
-            await self.run_sequence(self.dev_inst_map.autodiscover())
-            _LOG.info(
-                f"Found {len(self.dev_inst_map.mapping)} enabled control "
-                "device instances"
-            )
+            self._start_scan_dev_inst()
 
     async def send(
         self, msg: command.Command, in_transaction: bool = False
@@ -1219,6 +1361,8 @@ class DriverSCIRS232(DriverSerialBase):
             self._connected = asyncio.Event()
             self._dev_info: Optional[DriverSCIRS232.SCIRS232DeviceReply] = None
             self._dev_inst_map: Optional[DeviceInstanceTypeMapper] = None
+            # Holds events of unknown instance type while they are resolved
+            self.resolver: Optional[InstanceTypeResolver] = None
             self._device_settings = DriverSCIRS232.SCIRS232DeviceSettings(
                 monitor_enable=True,
                 identify=False,
@@ -1568,6 +1712,15 @@ class DriverSCIRS232(DriverSerialBase):
                 else:
                     self._prev_rx_enable_dt = 0
 
+                if self.resolver is not None and isinstance(
+                    dali_command, AmbiguousInstanceType
+                ):
+                    _LOG.debug(f"Resolving instance type for: {dali_command}")
+                    self.resolver.hold(
+                        dali_command, self._queue_rx_dali.distribute
+                    )
+                    return
+
                 _LOG.debug(f"Adding DALI command to queue: {dali_command}")
                 self._queue_rx_dali.distribute(dali_command)
 
@@ -1639,18 +1792,16 @@ class DriverSCIRS232(DriverSerialBase):
 
         await self._protocol.send_device_info_query()
         self._protocol.dev_inst_map = self.dev_inst_map
+        if self.instance_type_resolver is not None:
+            self.instance_type_resolver.dev_inst_map = self.dev_inst_map
+        self._protocol.resolver = self.instance_type_resolver
 
         self._connected.set()
 
         # Scan the bus for control devices, and create a mapping of addresses
         # to instance types
         if scan_dev_inst:
-            _LOG.info("Scanning DALI bus for control devices")
-            await self.run_sequence(self.dev_inst_map.autodiscover())
-            _LOG.info(
-                f"Found {len(self.dev_inst_map.mapping)} enabled control "
-                "device instances"
-            )
+            self._start_scan_dev_inst()
 
     async def send(
         self, msg: command.Command, in_transaction: bool = False
@@ -0,0 +1,320 @@
+"""
+Snapshots of the configuration of all the control gear on a bus
+
+`ReadInventory()` reads the configuration of every control gear on a
+bus into an `InventorySnapshot`. Passing a previous snapshot back in
+refreshes it cheaply: only the volatile fields are re-read, plus any
+fields that have been invalidated by configuration commands passed to
+`InventorySnapshot.observe()` in the meantime, for example from a
+driver's bus traffic callback.
+"""
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass, field, fields
+from typing import Generator, Iterable, Optional
+
+from dali import command
+from dali.address import (
+    GearBroadcast,
+    GearBroadcastUnaddressed,
+    GearGroup,
+    GearShort,
+)
+from dali.exceptions import DALISequenceError
+from dali.gear import general
+from dali.memory import info
+from dali.memory.location import MemoryLocationNotImplemented
+from dali.sequences import FindYesResponders, QueryDeviceTypes, QueryGroups
+from dali.sequences import batch as seq_batch
+from dali.sequences import progress as seq_progress
+
+# Fields that can change without any configuration command being
+# sent, and are therefore re-read on every refresh
+VOLATILE_FIELDS = frozenset({"actual_level"})
+
+# Fields that are stored in ROM, and only ever need to be read again
+# if different control gear turns up at the address
+ROM_FIELDS = frozenset({"device_types", "bank0"})
+
+# Configuration commands, and the fields of the addressed control gear
+# that they invalidate
+_INVALIDATES = {
+    general.SetScene: {"scenes"},
+    general.RemoveFromScene: {"scenes"},
+    general.AddToGroup: {"groups"},
+    general.RemoveFromGroup: {"groups"},
+    general.SetMaxLevel: {"max_level", "min_level"},
+    general.SetMinLevel: {"min_level", "max_level"},
+    general.SetPowerOnLevel: {"power_on_level"},
+    general.SetSystemFailureLevel: {"system_failure_level"},
+    general.SetFadeTime: {"fade_time"},
+    general.SetFadeRate: {"fade_rate"},
+    general.SetExtendedFadeTime: {"extended_fade_time"},
+    general.SetOperatingMode: {"operating_mode"},
+}
+
+# Bank 0 is read up to the last location that is decoded, even if the
+# control gear implements more
+_BANK0_LAST_DECODED = max(
+    loc.address for v in info.BANK_0.values for loc in v.locations)
+
+
+@dataclass
+class GearInventory:
+    """
+    The configuration of one control gear
+
+    Level values are the raw values read from the control gear, so 255
+    means "MASK". A scene the control gear is not part of is None.
+    Fields that could not be read are None, and are left in `stale` so
+    that the next refresh tries again.
+    """
+
+    address: int
+    device_types: Optional[list[int]] = None
+    bank0: Optional[dict] = None
+    groups: Optional[set[int]] = None
+    scenes: Optional[list[Optional[int]]] = None
+    min_level: Optional[int] = None
+    max_level: Optional[int] = None
+    power_on_level: Optional[int] = None
+    system_failure_level: Optional[int] = None
+    fade_time: Optional[int] = None
+    fade_rate: Optional[int] = None
+    extended_fade_time: Optional[int] = None
+    operating_mode: Optional[int] = None
+    actual_level: Optional[int] = None
+    stale: set[str] = field(default_factory=set)
+
+    @classmethod
+    def field_names(cls) -> frozenset[str]:
+        """The names of all the fields that are read from the gear"""
+        return frozenset(
+            f.name for f in fields(cls) if f.name not in ("address", "stale")
+        )
+
+
+@dataclass
+class InventorySnapshot:
+    """
+    The configuration of all the control gear on a bus
+
+    `gear` is a dict of short address to `GearInventory`. Addresses in
+    `pending` will be fully read by the next refresh; they are added
+    when a short address is observed being assigned.
+    """
+
+    gear: dict[int, GearInventory] = field(default_factory=dict)
+    pending: set[int] = field(default_factory=set)
+    _dtr0: Optional[int] = field(
+        default=None, init=False, repr=False, compare=False)
+
+    def __getitem__(self, address: int) -> GearInventory:
+        return self.gear[address]
+
+    def __contains__(self, address: int) -> bool:
+        return address in self.gear
+
+    def _addressed(self, destination) -> Iterable[GearInventory]:
+        if isinstance(destination, GearShort):
+            g = self.gear.get(destination.address)
+            return [g] if g else []
+        if isinstance(destination, GearGroup):
+            return [
+                g for g in self.gear.values()
+                if g.groups is None or "groups" in g.stale
+                or destination.group in g.groups
+            ]
+        if isinstance(destination, GearBroadcastUnaddressed):
+            return []
+        if isinstance(destination, GearBroadcast):
+            return list(self.gear.values())
+        return []
+
+    def observe(self, cmd: command.Command) -> None:
+        """
+        Update the snapshot for a command seen on the bus
+
+        Fields that the command may have changed are marked as stale, so
+        that the next refresh reads them again. Commands that do not
+        change configuration are ignored.
+
+        :param cmd: A command sent on the bus
+        """
+        if isinstance(cmd, general.DTR0):
+            self._dtr0 = cmd.param
+        elif isinstance(cmd, general.ProgramShortAddress):
+            if cmd.address != "MASK":
+                self.pending.add(cmd.address)
+        elif isinstance(cmd, general.SetShortAddress):
+            # The control gear moves to the address in DTR0, or
+            # becomes unaddressed; whatever was at the new address
+            # before must be read again too
+            for g in self._addressed(cmd.destination):
+                g.stale |= GearInventory.field_names()
+                self.pending.add(g.address)
+            if self._dtr0 is not None and self._dtr0 & 0x81 == 0x01:
+                self.pending.add(self._dtr0 >> 1)
+        elif isinstance(cmd, general.Reset):
+            for g in self._addressed(cmd.destination):
+                g.stale |= GearInventory.field_names() - ROM_FIELDS
+        else:
+            invalidated = _INVALIDATES.get(type(cmd))
+            if invalidated:
+                for g in self._addressed(cmd.destination):
+                    g.stale |= invalidated
+
+
+def _raw(r: Optional[command.Response]) -> Optional[int]:
+    if r is None or r.raw_value is None or r.raw_value.error:
+        return None
+    return r.raw_value.as_integer
+
+
+def _read_bank0(
+    addr: GearShort,
+) -> Generator[command.Command, Optional[command.Response], Optional[dict]]:
+    # DTR1 must already select bank 0. Location 0 holds the last
+    # implemented location, and DTR0 auto-increments on every read,
+    # so a single DTR0 write covers the whole bank.
+    yield general.DTR0(0)
+    last = _raw((yield general.ReadMemoryLocation(addr)))
+    if last is None:
+        return None
+    responses = yield seq_batch(
+        general.ReadMemoryLocation(addr)
+        for _ in range(1, min(last, _BANK0_LAST_DECODED) + 1))
+    raw_data = [last] + [_raw(r) for r in responses]
+    result = {}
+    for memory_value in info.BANK_0.values:
+        try:
+            result[memory_value] = memory_value.from_list(raw_data)
+        except MemoryLocationNotImplemented:
+            pass
+    return result
+
+
+def ReadInventory(
+    previous: Optional[InventorySnapshot] = None,
+    addresses: Optional[Iterable[int]] = None,
+) -> Generator[command.Command, Optional[command.Response], InventorySnapshot]:
+    """
+    A generator sequence to read the configuration of the control gear
+    on a bus
+
+    Without `previous`, the bus is scanned for control gear and every
+    field of every control gear found is read. With `previous`, only
+    the control gear in that snapshot (plus any `pending` addresses) is
+    read, and only the volatile fields, fields marked as stale and
+    fields that could not be read last time are requested. Control
+    gear that no longer answers is dropped from the result. `previous`
+    is not modified.
+
+    Memory bank 0 of every control gear is read with a single DTR1
+    write for the whole bus and a single DTR0 write per control gear.
+
+    :param previous: An optional `InventorySnapshot` to refresh
+    :param addresses: Optional iterable of short addresses to read. On a
+    full read only these are scanned; on a refresh these are read in
+    full if they are not already in the snapshot.
+    :return: A new `InventorySnapshot`
+
+    Needs to be used through an appropriate driver, with `run_sequence()`,
+    for example:
+    ```
+    snapshot = await driver.run_sequence(ReadInventory())
+    ...
+    snapshot = await driver.run_sequence(ReadInventory(snapshot))
+    ```
+    """
+    if previous is None:
+        snapshot = InventorySnapshot()
+        present = yield from FindYesResponders(
+            general.QueryControlGearPresent, addresses=addresses)
+        to_read = {a: GearInventory.field_names() for a in present}
+    else:
+        snapshot = copy.deepcopy(previous)
+        snapshot.pending = set()
+        to_read = {
+            a: VOLATILE_FIELDS | g.stale
+            for a, g in snapshot.gear.items()
+        }
+        for a in previous.pending | set(addresses or ()):
+            if a not in snapshot.gear or a in previous.pending:
+                to_read[a] = GearInventory.field_names()
+
+    dtr1_set = False
+    done = 0
+    for a in sorted(to_read):
+        wanted = to_read[a]
+        addr = GearShort(a)
+        g = snapshot.gear.get(a) or GearInventory(address=a)
+        yield seq_progress(
+            message=f"Reading A{a}", completed=done, size=len(to_read))
+        done += 1
+
+        # Reading the actual level also checks that the control gear
+        # is still present
+        g.actual_level = _raw((yield general.QueryActualLevel(addr)))
+        if g.actual_level is None:
+            snapshot.gear.pop(a, None)
+            continue
+        failed = set()
+
+        if "device_types" in wanted:
+            try:
+                g.device_types = yield from QueryDeviceTypes(addr)
+            except DALISequenceError:
+                g.device_types = None
+                failed.add("device_types")
+        if "groups" in wanted:
+            try:
+                g.groups = yield from QueryGroups(addr)
+            except DALISequenceError:
+                g.groups = None
+                failed.add("groups")
+        if "scenes" in wanted:
+            scenes = []
+            responses = yield seq_batch(
+                general.QuerySceneLevel(addr, scene) for scene in range(16))
+            for r in responses:
+                level = _raw(r)
+                if level is None:
+                    failed.add("scenes")
+                scenes.append(None if level in (None, 255) else level)
+            g.scenes = scenes
+        for name, query in (
+            ("min_level", general.QueryMinLevel),
+            ("max_level", general.QueryMaxLevel),
+            ("power_on_level", general.QueryPowerOnLevel),
+            ("system_failure_level", general.QuerySystemFailureLevel),
+            ("extended_fade_time", general.QueryExtendedFadeTime),
+            ("operating_mode", general.QueryOperatingMode),
+        ):
+            if name in wanted:
+                value = _raw((yield query(addr)))
+                setattr(g, name, value)
+                if value is None:
+                    failed.add(name)
+        if wanted & {"fade_time", "fade_rate"}:
+            value = _raw((yield general.QueryFadeTimeFadeRate(addr)))
+            if value is None:
+                g.fade_time = g.fade_rate = None
+                failed |= {"fade_time", "fade_rate"}
+            else:
+                g.fade_time = value >> 4
+                g.fade_rate = value & 0x0f
+        if "bank0" in wanted:
+            if not dtr1_set:
+                yield general.DTR1(info.BANK_0.address)
+                dtr1_set = True
+            g.bank0 = yield from _read_bank0(addr)
+            if g.bank0 is None:
+                failed.add("bank0")
+
+        g.stale = failed | (g.stale - wanted)
+        snapshot.gear[a] = g
+
+    yield seq_progress(completed=len(to_read), size=len(to_read))
+    return snapshot
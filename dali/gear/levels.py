@@ -0,0 +1,137 @@
+"""
+Set many control gear to individual levels using as few frames as possible
+
+Sending one DAPC per control gear costs a frame per control gear.
+`plan_levels()` instead builds the levels up in layers: a command to
+broadcast, then commands to groups, then corrections to individual
+short addresses, and optionally recalls scenes that already hold the
+wanted levels. Each command overrides the ones before it, so a bus
+where everything is at one level except a few control gear costs a
+frame plus one frame per exception.
+"""
+from __future__ import annotations
+
+from typing import Generator, Iterable, Mapping, Optional
+
+from dali import command
+from dali.address import GearBroadcast, GearGroup, GearShort
+from dali.gear.general import DAPC, GoToScene, Off
+
+
+def _level_command(destination, level: int) -> command.Command:
+    if level == 0:
+        return Off(destination)
+    return DAPC(destination, level)
+
+
+def plan_levels(
+    targets: Mapping[int, int],
+    groups: Optional[Mapping[int, Iterable[int]]] = None,
+    scenes: Optional[Mapping[int, list[Optional[int]]]] = None,
+    present: Optional[Iterable[int]] = None,
+) -> list[command.Command]:
+    """
+    Work out the fewest commands to set control gear to target levels
+
+    :param targets: A dict of short address to arc power level, 0..254;
+    0 is sent as `Off`
+    :param groups: An optional dict of short address to the groups that
+    control gear is a member of, for example from an `InventorySnapshot`.
+    This must be accurate, because commands sent to a group affect all
+    its members.
+    :param scenes: An optional dict of short address to a list of the 16
+    scene levels of that control gear, with None for scenes it is not
+    part of. Scenes that already hold the target levels are recalled
+    with `GoToScene`. Control gear left out may be part of any scene, so
+    scenes are never recalled through a broadcast or group that includes
+    them.
+    :param present: The short addresses of all control gear on the bus,
+    if there are any that are not in `targets`. Those control gear must
+    not change level, so broadcast and any group they are members of is
+    only used for `GoToScene` of scenes they are not part of.
+    :return: A list of commands
+    """
+    for level in targets.values():
+        if not 0 <= level <= 254:
+            raise ValueError(f"Level {level} is out of range 0..254")
+    groups = groups or {}
+    scenes = scenes or {}
+    everything = set(targets) | set(present or ())
+
+    destinations = [(GearBroadcast(), everything)]
+    members = {}
+    for address in everything:
+        for group in groups.get(address, ()):
+            members.setdefault(group, set()).add(address)
+    destinations.extend(
+        (GearGroup(group), m) for group, m in sorted(members.items())
+        if len(m) > 1)
+
+    # Each option is a command, and a dict of the levels it would set
+    options = []
+    levels = set(targets.values())
+    for destination, addressed in destinations:
+        if addressed <= targets.keys():
+            options.extend(
+                (_level_command(destination, level),
+                 {a: level for a in addressed})
+                for level in sorted(levels))
+        if any(scenes.get(a) is None for a in addressed):
+            # Control gear whose scenes aren't known might respond
+            continue
+        for scene in range(16):
+            effect = {}
+            for a in addressed:
+                level = scenes[a][scene]
+                if level is not None:
+                    effect[a] = level
+            if effect and effect.keys() <= targets.keys():
+                options.append((GoToScene(destination, scene), effect))
+
+    # Greedily add whichever command fixes the most control gear,
+    # counting control gear it would break again, until no command
+    # fixes more than one: individual corrections are as cheap then
+    state = {}
+    commands = []
+    while True:
+        best, best_gain = None, 1
+        for option in options:
+            _, effect = option
+            gain = 0
+            for a, level in effect.items():
+                was = state.get(a) == targets[a]
+                now = level == targets[a]
+                gain += now - was
+            if gain > best_gain:
+                best, best_gain = option, gain
+        if best is None:
+            break
+        commands.append(best[0])
+        state.update(best[1])
+
+    for a in sorted(targets):
+        if state.get(a) != targets[a]:
+            commands.append(_level_command(GearShort(a), targets[a]))
+    return commands
+
+
+def SetLevels(
+    targets: Mapping[int, int],
+    groups: Optional[Mapping[int, Iterable[int]]] = None,
+    scenes: Optional[Mapping[int, list[Optional[int]]]] = None,
+    present: Optional[Iterable[int]] = None,
+) -> Generator[command.Command, Optional[command.Response], None]:
+    """
+    A generator sequence to set control gear to target levels, using the
+    commands from `plan_levels()`
+
+    Needs to be used through an appropriate driver, with `run_sequence()`,
+    for example:
+    ```
+    levels = {a: 100 for a in range(64)}
+    levels[10] = 0
+    await driver.run_sequence(SetLevels(levels))
+    ```
+    """
+    for cmd in plan_levels(targets, groups, scenes, present):
+        yield cmd
@@ -0,0 +1,270 @@
+"""
+Bring control gear configuration into line with a desired configuration
+
+`plan_reconcile()` compares a desired configuration for each control
+gear with an `InventorySnapshot` of the bus, and works out a short
+stream of commands to get from one to the other:
+
+* values that are already correct are not written
+* where several control gear need the same value, it is written once
+  to broadcast or to a group, as long as that does not change any
+  control gear that should keep its current value
+* writes that need the same DTR0 value share a single DTR0 command
+
+`Reconcile()` is a sequence that sends those commands.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Generator, Mapping, Optional
+
+from dali import command
+from dali.address import GearBroadcast, GearGroup, GearShort
+from dali.gear import general
+from dali.gear.inventory import InventorySnapshot
+
+# Settings that are written by putting a value in DTR0 and then sending
+# the command, and the name of the GearInventory field they set
+_DTR_SETTINGS = {
+    "fade_time": general.SetFadeTime,
+    "fade_rate": general.SetFadeRate,
+    "min_level": general.SetMinLevel,
+    "max_level": general.SetMaxLevel,
+    "power_on_level": general.SetPowerOnLevel,
+    "system_failure_level": general.SetSystemFailureLevel,
+}
+
+
+@dataclass
+class GearConfig:
+    """
+    The desired configuration of one control gear
+
+    Fields left as None are not changed. `scenes` only needs to contain
+    the scenes that matter: a scene mapped to None means the control
+    gear should not be part of that scene.
+    """
+
+    groups: Optional[set[int]] = None
+    scenes: Optional[dict[int, Optional[int]]] = None
+    fade_time: Optional[int] = None
+    fade_rate: Optional[int] = None
+    min_level: Optional[int] = None
+    max_level: Optional[int] = None
+    power_on_level: Optional[int] = None
+    system_failure_level: Optional[int] = None
+
+
+# Marks a current value that is not known, so must always be written
+_UNKNOWN = object()
+
+
+class _Setting:
+    """Changes needed to one setting, across all the control gear
+
+    'need' maps each value to the addresses that must be changed to
+    it, and 'have' maps each value to the addresses that already have
+    it and can therefore be sent it again harmlessly.
+    """
+
+    def __init__(self):
+        self.need = defaultdict(set)
+        self.have = defaultdict(set)
+
+    def add(self, address, current, wanted):
+        if current is _UNKNOWN:
+            return
+        if wanted is _UNKNOWN:
+            self.have[current].add(address)
+        elif current == wanted:
+            self.have[wanted].add(address)
+        else:
+            self.need[wanted].add(address)
+
+    def add_wanted(self, address, current, wanted):
+        if current is _UNKNOWN:
+            self.need[wanted].add(address)
+        else:
+            self.add(address, current, wanted)
+
+
+def _destinations(
+    need: set[int],
+    harmless: set[int],
+    everything: set[int],
+    members: Mapping[int, set[int]],
+) -> list[GearBroadcast | GearGroup | GearShort]:
+    """Choose the fewest destinations that cover 'need' without
+    addressing any control gear outside 'harmless'
+    """
+    if everything <= harmless:
+        return [GearBroadcast()]
+    result = []
+    remaining = set(need)
+    usable = {
+        g: m for g, m in members.items() if m <= harmless and m & remaining
+    }
+    while remaining:
+        best = max(
+            usable, key=lambda g: len(usable[g] & remaining), default=None)
+        if best is None or len(usable[best] & remaining) < 2:
+            break
+        result.append(GearGroup(best))
+        remaining -= usable.pop(best)
+    result.extend(GearShort(a) for a in sorted(remaining))
+    return result
+
+
+def _limit_rounds(config: GearConfig, old_min, old_max) -> dict:
+    """Work out which rounds MIN LEVEL and MAX LEVEL are written in
+
+    Control gear clamps MAX LEVEL to be no lower than MIN LEVEL and vice
+    versa, so when both change the order matters.
+    """
+    if config.min_level is None or config.max_level is None:
+        return {general.SetMinLevel: (0,), general.SetMaxLevel: (0,)}
+    if old_min is not _UNKNOWN and config.max_level >= old_min:
+        return {general.SetMaxLevel: (0,), general.SetMinLevel: (1,)}
+    if old_max is not _UNKNOWN and config.min_level <= old_max:
+        return {general.SetMinLevel: (0,), general.SetMaxLevel: (1,)}
+    return {general.SetMaxLevel: (0, 2), general.SetMinLevel: (1,)}
+
+
+def plan_reconcile(
+    desired: Mapping[int, GearConfig],
+    snapshot: InventorySnapshot,
+) -> list[command.Command]:
+    """
+    Work out the commands needed to reach a desired configuration
+
+    The snapshot must include every control gear on the bus, because
+    commands may be sent to broadcast or to groups. Control gear that
+    is in the snapshot but not in `desired` is left unchanged. Values
+    that are missing from the snapshot, or marked as stale, are always
+    written.
+
+    :param desired: A dict of short address to `GearConfig`
+    :param snapshot: An up-to-date `InventorySnapshot` of the bus
+    :return: A list of commands
+    """
+    everything = set(snapshot.gear) | set(desired)
+    configs = {a: desired.get(a) or GearConfig() for a in everything}
+
+    def current(address, name):
+        g = snapshot.gear.get(address)
+        if g is None or name in g.stale or getattr(g, name) is None:
+            return _UNKNOWN
+        return getattr(g, name)
+
+    # Group membership first, using only broadcast and short
+    # addresses because the groups themselves are changing
+    commands = []
+    final_groups = {}
+    for group in range(16):
+        membership = _Setting()
+        for address, config in configs.items():
+            groups = current(address, "groups")
+            was = _UNKNOWN if groups is _UNKNOWN else group in groups
+            if config.groups is None:
+                membership.add(address, was, _UNKNOWN)
+            else:
+                membership.add_wanted(
+                    address, was, group in config.groups)
+        for wanted, cmd in ((True, general.AddToGroup),
+                            (False, general.RemoveFromGroup)):
+            need = membership.need[wanted]
+            if need:
+                harmless = need | membership.have[wanted]
+                for dest in _destinations(need, harmless, everything, {}):
+                    commands.append(cmd(dest, group))
+    for address, config in configs.items():
+        groups = current(address, "groups")
+        if config.groups is not None:
+            groups = set(config.groups)
+        final_groups[address] = groups
+    members = defaultdict(set)
+    for address, groups in final_groups.items():
+        # Control gear with unknown membership could be in any group
+        for group in (range(16) if groups is _UNKNOWN else groups):
+            members[group].add(address)
+
+    # Every other setting, keyed by (command, parameter).  Scenes that
+    # control gear should not be part of use the value None.
+    settings = defaultdict(_Setting)
+    rounds = {}
+    for address, config in configs.items():
+        for name, cmd in _DTR_SETTINGS.items():
+            wanted = getattr(config, name)
+            if wanted is None:
+                settings[(cmd, None)].add(
+                    address, current(address, name), _UNKNOWN)
+            else:
+                settings[(cmd, None)].add_wanted(
+                    address, current(address, name), wanted)
+        rounds[address] = _limit_rounds(
+            config, current(address, "min_level"),
+            current(address, "max_level"))
+        scenes = current(address, "scenes")
+        wanted_scenes = config.scenes or {}
+        for scene in range(16):
+            was = _UNKNOWN if scenes is _UNKNOWN else scenes[scene]
+            if scene in wanted_scenes:
+                settings[(general.SetScene, scene)].add_wanted(
+                    address, was, wanted_scenes[scene])
+            else:
+                settings[(general.SetScene, scene)].add(
+                    address, was, _UNKNOWN)
+
+    # Turn the settings into (round, DTR0 value, command) writes
+    writes = []
+    for (cmd, param), s in settings.items():
+        for value, need in s.need.items():
+            harmless = need | s.have[value]
+            by_round = defaultdict(set)
+            for address in need:
+                for rnd in rounds[address].get(cmd, (0,)):
+                    by_round[rnd].add(address)
+            if value is None:
+                # Removing from a scene doesn't need DTR0
+                write, dtr = general.RemoveFromScene, None
+            else:
+                write, dtr = cmd, value
+            for rnd, addresses in by_round.items():
+                for dest in _destinations(
+                        addresses, harmless, everything, members):
+                    c = write(dest) if param is None else write(dest, param)
+                    writes.append((rnd, dtr, c))
+
+    # Share DTR0 writes: within each round, group writes by DTR0 value
+    writes.sort(key=lambda w: (w[0], -1 if w[1] is None else w[1]))
+    dtr0 = None
+    for _, value, c in writes:
+        if value is not None and value != dtr0:
+            commands.append(general.DTR0(value))
+            dtr0 = value
+        commands.append(c)
+    return commands
+
+
+def Reconcile(
+    desired: Mapping[int, GearConfig],
+    snapshot: InventorySnapshot,
+) -> Generator[command.Command, Optional[command.Response], list]:
+    """
+    A generator sequence to bring control gear into line with a desired
+    configuration, using the commands from `plan_reconcile()`
+
+    The snapshot is updated through `InventorySnapshot.observe()` as
+    commands are sent, so the fields that were changed are marked as
+    stale and will be re-read by the next `ReadInventory()` refresh.
+
+    :param desired: A dict of short address to `GearConfig`
+    :param snapshot: An up-to-date `InventorySnapshot` of the bus
+    :return: The list of commands that was sent
+    """
+    commands = plan_reconcile(desired, snapshot)
+    for cmd in commands:
+        yield cmd
+        snapshot.observe(cmd)
+    return commands
@@ -0,0 +1,331 @@
+"""
+Memory bank operations on many bus units at once
+
+DTR0 and DTR1 are special commands received by every bus unit, but
+ReadMemoryLocation only increments DTR0 in the bus unit it addresses.
+So to read the same memory location from many bus units, DTR1 and DTR0
+only need to be written once, followed by one ReadMemoryLocation per
+bus unit. Afterwards every bus unit's DTR0 points at the next location,
+so the next location can be read from all of them without writing DTR0
+again.
+
+Writes work the other way round: WriteMemoryLocationNoReply is also a
+special command, so only one bus unit at a time has writing enabled,
+and only the memory locations whose contents change are written.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Generator, Iterable, Mapping, Optional
+
+from dali.address import (
+    DeviceBroadcast,
+    DeviceShort,
+    GearBroadcast,
+    GearShort,
+)
+from dali.command import Command, Response
+from dali import exceptions
+from dali.exceptions import (
+    MemoryLocationNotImplemented,
+    MemoryValueNotWriteable,
+)
+from dali.memory.location import (
+    MemoryType,
+    MemoryValue,
+    _DTR0,
+    _DTR1,
+    _EnableWriteMemory,
+    _ReadMemoryLocation,
+    _WriteMemoryLocationNoReply,
+    _runs,
+)
+from dali.memory.location import read_raw_values as _read_unit_raw_values
+from dali.sequences import batch
+
+
+def _raw(r: Optional[Response]) -> Optional[int]:
+    if r is None or r.raw_value is None or r.raw_value.error:
+        return None
+    return r.raw_value.as_integer
+
+
+def _latch(broadcast, value):
+    # WriteMemoryLocationNoReply is a special command: every bus unit
+    # with writing enabled accepts it, so one latch write covers them
+    # all. DTR1 must already select the bank.
+    yield _EnableWriteMemory(broadcast)
+    yield _DTR0(broadcast, 0x02)
+    yield _WriteMemoryLocationNoReply(broadcast, value)
+
+
+def _read_columns(
+    addresses: list[GearShort] | list[DeviceShort],
+    values: list[type[MemoryValue]],
+    use_latch: bool,
+    raw_bytes: bool = False,
+) -> Generator[Command, Any, dict[int, dict]]:
+    if isinstance(addresses[0], GearShort):
+        broadcast = GearBroadcast()
+    else:
+        broadcast = DeviceBroadcast()
+    result = {a.address: {} for a in addresses}
+
+    by_bank = defaultdict(list)
+    for value in values:
+        by_bank[value.bank].append(value)
+
+    for bank in sorted(by_bank, key=lambda b: b.address):
+        bank_values = by_bank[bank]
+        locations = [loc.address for v in bank_values for loc in v.locations]
+        raw = {a.address: [None] * (max(locations) + 1) for a in addresses}
+
+        yield _DTR1(broadcast, bank.address)
+        dtr0 = None
+        latched = use_latch and bank.has_latch
+        if latched:
+            yield from _latch(broadcast, 0xAA)
+            dtr0 = 3
+        for start, length in _runs(locations):
+            if start != dtr0:
+                yield _DTR0(broadcast, start)
+            run = range(start, start + length)
+            responses = iter((yield batch(
+                _ReadMemoryLocation(a) for _ in run for a in addresses)))
+            for location in run:
+                for a, r in zip(addresses, responses):
+                    raw[a.address][location] = _raw(r)
+            dtr0 = start + length
+        if latched:
+            yield from _latch(broadcast, 0xFF)
+
+        for address, data in raw.items():
+            for value in bank_values:
+                if raw_bytes:
+                    contents = [data[loc.address] for loc in value.locations]
+                    if None not in contents:
+                        result[address][value] = bytes(contents)
+                    continue
+                try:
+                    result[address][value] = value.from_list(data)
+                except MemoryLocationNotImplemented:
+                    pass
+    return result
+
+
+def _short_addresses(
+    addresses: Iterable[int | GearShort | DeviceShort],
+) -> list[GearShort] | list[DeviceShort]:
+    addrs = []
+    for address in addresses:
+        if isinstance(address, int):
+            address = GearShort(address)
+        if not isinstance(address, (GearShort, DeviceShort)):
+            raise TypeError(
+                f"Invalid addr: {address}, expected GearShort or DeviceShort")
+        addrs.append(address)
+    if len({type(a) for a in addrs}) > 1:
+        raise TypeError("Control gear and control devices can't be mixed")
+    return addrs
+
+
+def read_values(
+    addresses: Iterable[int | GearShort | DeviceShort],
+    values: Iterable[type[MemoryValue]],
+    use_latch: bool = True,
+) -> Generator[Command, Any, dict[int, dict]]:
+    """
+    A generator sequence to read memory values from many bus units
+
+    The reads are planned column by column: each memory location is
+    read from every bus unit in turn, so DTR1 is written once per
+    memory bank and DTR0 only where the locations being read are not
+    contiguous. Reading a one byte value from 64 control gear costs
+    about 64 frames instead of about 256.
+
+    If a memory bank has a latch and `use_latch` is set, all bus units
+    are latched together with broadcast commands before reading the
+    bank, and unlatched afterwards, so that multi-byte values such as
+    energy counters are consistent.
+
+    :param addresses: Short addresses of the bus units to read, either
+    all control gear or all control devices; ints are treated as
+    control gear
+    :param values: MemoryValue classes to read, from any banks
+    :param use_latch: Whether to latch banks that support it
+    :return: A dict of short address as an int to a dict of MemoryValue
+    to the value read, as `MemoryValue.read()` would return it. Values
+    that are not implemented by a bus unit are left out.
+
+    Example:
+    ```
+    gtins = await driver.run_sequence(
+        read_values(range(64), [info.GTIN, info.FirmwareVersion]))
+    ```
+    """
+    addrs = _short_addresses(addresses)
+    if not addrs:
+        return {}
+    return (yield from _read_columns(addrs, list(values), use_latch))
+
+
+def read_raw_values(
+    addresses: Iterable[int | GearShort | DeviceShort],
+    values: Iterable[type[MemoryValue]],
+    use_latch: bool = True,
+) -> Generator[Command, Any, dict[int, dict]]:
+    """
+    A generator sequence to read memory values from many bus units
+    without interpretation
+
+    Reads the same way as `read_values()`, but returns the raw bytes of
+    each value, as `MemoryValue.read_raw()` would return them.
+    """
+    addrs = _short_addresses(addresses)
+    if not addrs:
+        return {}
+    return (yield from _read_columns(addrs, list(values), use_latch, True))
+
+
+_WRITEABLE = (
+    MemoryType.RAM_RW,
+    MemoryType.NVM_RW,
+    MemoryType.NVM_RW_L,
+    MemoryType.NVM_RW_P,
+)
+
+
+@dataclass
+class WriteResult:
+    """
+    The outcome of writing memory values to one bus unit
+
+    * written: the number of memory locations that were written
+    * unchanged: values that already held the wanted contents
+    * failed: values that could not be written or did not read back as
+      written, with the reason
+    * error: an exception that stopped the writes to this bus unit, or
+      None
+    """
+
+    written: int = 0
+    unchanged: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.failed
+
+
+def _write_unit(addr, raws, verify):
+    result = WriteResult()
+    by_bank = defaultdict(list)
+    for value in raws:
+        by_bank[value.bank].append(value)
+
+    for bank in sorted(by_bank, key=lambda b: b.address):
+        bank_values = by_bank[bank]
+        current = yield from _read_unit_raw_values(addr, bank_values, False)
+        changes = {}
+        written = {}
+        unlock = False
+        for value in bank_values:
+            if value not in current:
+                result.failed[value] = "not implemented"
+                continue
+            raw = raws[value]
+            diff = {
+                loc.address: byte
+                for loc, byte, old in zip(value.locations, raw, current[value])
+                if byte != old
+            }
+            if not diff:
+                result.unchanged.append(value)
+                continue
+            changes.update(diff)
+            written[value] = diff
+            unlock |= any(
+                loc.type_ == MemoryType.NVM_RW_L for loc in value.locations)
+        if not changes:
+            continue
+
+        yield _DTR1(addr, bank.address)
+        yield _EnableWriteMemory(addr)
+        dtr0 = None
+        if unlock:
+            yield _DTR0(addr, 0x02)
+            yield _WriteMemoryLocationNoReply(addr, 0x55)
+            dtr0 = 3
+        for start, length in _runs(changes):
+            if start != dtr0:
+                yield _DTR0(addr, start)
+            for location in range(start, start + length):
+                yield _WriteMemoryLocationNoReply(addr, changes[location])
+            dtr0 = start + length
+        if unlock:
+            yield _DTR0(addr, 0x02)
+            yield _WriteMemoryLocationNoReply(addr, 0xFF)
+        result.written += len(changes)
+
+        if verify:
+            check = yield from _read_unit_raw_values(addr, list(written), False)
+            for value, diff in written.items():
+                raw = check.get(value)
+                if raw is None:
+                    result.failed[value] = "not read back"
+                    continue
+                read_back = {
+                    loc.address: byte
+                    for loc, byte in zip(value.locations, raw)}
+                if any(read_back[a] != b for a, b in diff.items()):
+                    result.failed[value] = "read back differs"
+    return result
+
+
+def write_values(
+    addresses: Iterable[int | GearShort | DeviceShort],
+    values: Mapping[type[MemoryValue], Any],
+    verify: bool = True,
+) -> Generator[Command, Any, dict[int, WriteResult]]:
+    """
+    A generator sequence to write memory values to many bus units
+
+    For each bus unit, the current contents of the memory values are
+    read first and only the memory locations that differ are written,
+    using WriteMemoryLocationNoReply with DTR0 auto-incrementing over
+    contiguous runs. Lockable banks are unlocked and relocked once per
+    bank. If `verify` is set, the written values are then read back in
+    a single pass, instead of checking the response to every write.
+
+    :param addresses: Short addresses of the bus units to write, either
+    all control gear or all control devices; ints are treated as
+    control gear
+    :param values: A dict of MemoryValue class to the value to write, as
+    passed to `MemoryValue.write()`
+    :param verify: Whether to read back the written values
+    :return: A dict of short address as an int to `WriteResult`
+    :raises MemoryValueNotWriteable: if any value is not writeable
+    :raises ValueError: if any value can't be converted to raw bytes
+    """
+    raws = {}
+    for value, v in values.items():
+        if any(loc.type_ not in _WRITEABLE for loc in value.locations):
+            raise MemoryValueNotWriteable(
+                f"{str(value)} is not a writeable MemoryValue")
+        raws[value] = value.value_to_raw(v)
+
+    results = {}
+    for address in addresses:
+        if isinstance(address, int):
+            address = GearShort(address)
+        elif not isinstance(address, (GearShort, DeviceShort)):
+            raise TypeError(
+                f"Invalid addr: {address}, expected GearShort or DeviceShort")
+        try:
+            results[address.address] = yield from _write_unit(
+                address, raws, verify)
+        except (exceptions.MemoryError, exceptions.ResponseError) as e:
+            results[address.address] = WriteResult(error=e)
+    return results
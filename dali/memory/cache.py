@@ -0,0 +1,273 @@
+"""
+A read-through cache of memory bank values
+
+Many memory values never or rarely change: GTIN, firmware versions and
+rated lifetimes are in ROM or non-volatile memory. `MemoryCache` keeps
+the values it has read, keyed by the identity of the bus unit (its GTIN
+and identification number from memory bank 0) so that entries survive
+a bus unit moving to a different short address. How long an entry stays
+valid depends on the MemoryType of its locations:
+
+* ROM entries never expire
+* NVM entries stay valid until a write to their memory bank or a
+  ResetMemoryBank is passed to `MemoryCache.observe()`
+* RAM entries expire after a configurable time, as well as being
+  invalidated like NVM entries
+
+The identity of the bus unit at each short address is itself cached,
+but is read again after `identity_ttl` seconds and before any value is
+read from the bus, so a bus unit swapped for another at the same short
+address is noticed.
+
+The cache holds at most `max_entries` values, evicting the least
+recently used ones first.
+
+`MemoryCache.read()` is a sequence that can be used in place of
+`MemoryValue.read()`, and `MemoryCache.watch()` wraps any sequence so
+that the commands it sends are observed:
+```
+cache = MemoryCache()
+gtin = await driver.run_sequence(cache.read(GearShort(1), info.GTIN))
+await driver.run_sequence(cache.watch(oem.LuminaireColor.write(1, "red")))
+```
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generator, Optional
+
+from dali import command, device, gear
+from dali.address import DeviceShort, GearShort
+from dali.memory import info
+from dali.memory.location import MemoryType, MemoryValue, read_values
+from dali.sequences import batch
+
+# How volatile each MemoryType is; a value is as volatile as the most
+# volatile of its locations
+_ROM, _NVM, _RAM = range(3)
+_VOLATILITY = {
+    MemoryType.ROM: _ROM,
+    MemoryType.NVM_RO: _NVM,
+    MemoryType.NVM_RW: _NVM,
+    MemoryType.NVM_RW_L: _NVM,
+    MemoryType.NVM_RW_P: _NVM,
+    MemoryType.RAM_RO: _RAM,
+    MemoryType.RAM_RW: _RAM,
+}
+
+_IDENTITY_VALUES = (info.GTIN, info.IdentificationNumber)
+
+# Returned by MemoryCache._lookup() when there is no valid entry
+_MISSING = object()
+
+
+def _volatility(memory_value: type[MemoryValue]) -> int:
+    # Locations without a declared type are treated as RAM
+    return max(
+        _VOLATILITY.get(loc.type_, _RAM) for loc in memory_value.locations)
+
+
+class MemoryCache:
+    """
+    A cache of memory values read from bus units
+
+    :param ttl: Seconds that values stored in RAM stay valid
+    :param max_entries: The maximum number of values to keep
+    :param identity_ttl: Seconds before the identity of the bus unit at a
+    short address is read again
+    :param clock: A function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        max_entries: int = 4096,
+        identity_ttl: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.identity_ttl = identity_ttl
+        self._clock = clock
+        # (identity, MemoryValue) -> (value, expiry time or None)
+        self._entries: OrderedDict[tuple, tuple] = OrderedDict()
+        # (is_device, short address) -> (identity, expiry time)
+        self._identities: dict[tuple, tuple] = {}
+        # DTR0 and DTR1 are separate for control gear and devices
+        self._dtr0 = {False: None, True: None}
+        self._dtr1 = {False: None, True: None}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Forget all cached values and bus unit identities"""
+        self._entries.clear()
+        self._identities.clear()
+
+    def _known_identity(self, addr: GearShort | DeviceShort):
+        known = self._identities.get(
+            (isinstance(addr, DeviceShort), addr.address))
+        if known is not None and self._clock() < known[1]:
+            return known[0]
+        return None
+
+    def identity(
+        self, addr: GearShort | DeviceShort, refresh: bool = False,
+    ) -> Generator[command.Command, Any, Optional[tuple]]:
+        """
+        A sequence that returns the identity used to key a bus unit's
+        values, reading it from memory bank 0 if it is not known or is
+        older than `identity_ttl`
+
+        :param refresh: Read the identity even if it is known
+        :return: A tuple, or None if the bus unit does not implement
+        both GTIN and identification number
+        """
+        key = (isinstance(addr, DeviceShort), addr.address)
+        if not refresh:
+            identity = self._known_identity(addr)
+            if identity is not None:
+                return identity
+        self._identities.pop(key, None)
+        values = yield from read_values(addr, _IDENTITY_VALUES)
+        if any(not isinstance(values.get(v), int) for v in _IDENTITY_VALUES):
+            return None
+        identity = (key[0],) + tuple(values[v] for v in _IDENTITY_VALUES)
+        self._identities[key] = (identity, self._clock() + self.identity_ttl)
+        return identity
+
+    def read(
+        self,
+        addr: int | GearShort | DeviceShort,
+        memory_value: type[MemoryValue],
+    ) -> Generator[command.Command, Any, Any]:
+        """
+        A sequence that reads a memory value through the cache
+
+        Returns the same as `memory_value.read(addr)`, and raises the
+        same exceptions; failed reads are not cached. Bus units without
+        an identity are always read from the bus.
+        """
+        if isinstance(addr, int):
+            # Assume 16-bit DALI, if not explicit
+            addr = GearShort(addr)
+        elif not isinstance(addr, (GearShort, DeviceShort)):
+            raise TypeError(
+                f"Invalid addr: {addr}, expected GearShort or DeviceShort")
+        known = self._known_identity(addr) is not None
+        identity = yield from self.identity(addr)
+        value = self._lookup(identity, memory_value)
+        if value is _MISSING and known:
+            # About to read from the bus anyway: make sure it's still the
+            # same bus unit at this address
+            identity = yield from self.identity(addr, refresh=True)
+            value = self._lookup(identity, memory_value)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        if identity is None:
+            return (yield from memory_value.read(addr))
+        key = (identity, memory_value)
+        self.misses += 1
+        value = yield from memory_value.read(addr)
+        expiry = None
+        if _volatility(memory_value) == _RAM:
+            expiry = self._clock() + self.ttl
+        self._entries[key] = (value, expiry)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def _lookup(self, identity: Optional[tuple], memory_value):
+        if identity is None:
+            return _MISSING
+        key = (identity, memory_value)
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expiry = entry
+        if expiry is not None and self._clock() >= expiry:
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _invalidate(self, is_device: bool, destination, bank: Optional[int]):
+        """Drop non-ROM entries of a bank, or of every bank if 'bank' is
+        None, for the bus units addressed by destination
+        """
+        identities = None
+        if isinstance(destination, (GearShort, DeviceShort)):
+            known = self._identities.get((is_device, destination.address))
+            if known is not None:
+                identities = {known[0]}
+        for key in list(self._entries):
+            identity, memory_value = key
+            if identity[0] != is_device:
+                continue
+            if identities is not None and identity not in identities:
+                continue
+            if bank is not None and memory_value.bank.address != bank:
+                continue
+            if _volatility(memory_value) != _ROM:
+                del self._entries[key]
+
+    def observe(self, cmd: command.Command) -> None:
+        """
+        Update the cache for a command seen on the bus
+
+        Memory writes invalidate the memory bank selected by DTR1 in
+        every bus unit, because they are received by all bus units that
+        have writing enabled. Changes of short address make the cache
+        read the identities of bus units again.
+
+        :param cmd: A command sent on the bus
+        """
+        if isinstance(cmd, device.general._DeviceCommand):
+            general, is_device = device.general, True
+        elif isinstance(cmd, gear.general._GearCommand):
+            general, is_device = gear.general, False
+        else:
+            return
+        if isinstance(cmd, general.DTR0):
+            self._dtr0[is_device] = cmd.param
+        elif isinstance(cmd, general.DTR1):
+            self._dtr1[is_device] = cmd.param
+        elif isinstance(cmd, (general.WriteMemoryLocation,
+                              general.WriteMemoryLocationNoReply)):
+            bank = self._dtr1[is_device]
+            self._invalidate(is_device, None, bank)
+            if bank is None or bank == 0:
+                # Without knowing the bank, or after writing bank 0,
+                # identities can't be trusted either
+                self._identities.clear()
+        elif isinstance(cmd, general.ResetMemoryBank):
+            bank = self._dtr0[is_device]
+            self._invalidate(is_device, cmd.destination, bank or None)
+        elif isinstance(cmd, (general.SetShortAddress,
+                              general.ProgramShortAddress)):
+            self._identities.clear()
+
+    def watch(self, seq: Generator) -> Generator:
+        """
+        Wrap a sequence so that every command it sends is observed
+
+        :param seq: Any sequence
+        :return: A sequence that behaves the same as 'seq'
+        """
+        response = None
+        while True:
+            try:
+                item = seq.send(response)
+            except StopIteration as r:
+                return r.value
+            if isinstance(item, batch):
+                for cmd in item.commands:
+                    self.observe(cmd)
+            elif isinstance(item, command.Command):
+                self.observe(item)
+            response = yield item
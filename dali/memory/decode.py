@@ -0,0 +1,238 @@
+"""
+Compiled plans for decoding a whole memory bank at once
+
+`MemoryValue.from_list()` walks the value's locations, builds a bytes
+object and checks it for MASK, TMASK and validity every time it is
+called. A `DecodePlan` does that work once per memory bank: it records
+the offset and width of each value, its scaling and the integers that
+mean MASK and TMASK, and then decodes a complete bank dump in one pass.
+Values with their own decoding, such as strings and version numbers,
+are decoded through `from_list()` as before.
+
+`DecodePlan.decode_columns()` decodes the same bank from many dumps at
+once into NumPy arrays, one per value. NumPy is optional and only
+needed for that method.
+
+Plans are normally obtained with `MemoryBank.decode_plan()`:
+```
+values = info.BANK_0.decode_plan().decode(raw_bank_0)
+```
+"""
+from __future__ import annotations
+
+from decimal import Decimal
+from typing import Any, Optional, Sequence
+
+from dali.exceptions import MemoryLocationNotImplemented
+from dali.memory.energy import ScaledNumericValue
+from dali.memory.location import (
+    FixedScaleNumericValue,
+    FlagValue,
+    MemoryBank,
+    MemoryValue,
+    NumericValue,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# How a value is decoded
+_PLAIN, _FIXED, _SCALED, _GENERIC = range(4)
+
+
+def _same(cls, name, base) -> bool:
+    return getattr(cls, name).__func__ is getattr(base, name).__func__
+
+
+def _kind(value: type[MemoryValue]) -> int:
+    # Only values that use the standard numeric decoding are compiled;
+    # anything that overrides it is decoded through from_list()
+    if not issubclass(value, NumericValue) \
+            or not _same(value, "check_raw", MemoryValue) \
+            or not _same(value, "is_valid", NumericValue):
+        if issubclass(value, ScaledNumericValue) \
+                and _same(value, "check_raw", ScaledNumericValue) \
+                and _same(value, "raw_to_value", ScaledNumericValue) \
+                and _same(value, "is_valid", NumericValue):
+            return _SCALED
+        return _GENERIC
+    if _same(value, "raw_to_value", NumericValue):
+        return _PLAIN
+    if issubclass(value, FixedScaleNumericValue) \
+            and _same(value, "raw_to_value", FixedScaleNumericValue):
+        return _FIXED
+    return _GENERIC
+
+
+class _Entry:
+    """The compiled decoding of one memory value"""
+
+    def __init__(self, value: type[MemoryValue]):
+        self.value = value
+        self.kind = _kind(value)
+        self.offsets = tuple(loc.address for loc in value.locations)
+        self.start = self.offsets[0]
+        self.width = len(self.offsets)
+        self.contiguous = self.offsets == tuple(
+            range(self.start, self.start + self.width))
+        self.signed = value.signed
+        self.min_value = getattr(value, "min_value", None)
+        self.max_value = getattr(value, "max_value", None)
+        self.scaling_factor = getattr(value, "scaling_factor", 1)
+        # MASK and TMASK as integers, compared against the value bytes;
+        # for scaled values these exclude the scale byte
+        self.mask = self.tmask = None
+        if value.mask_supported:
+            self.mask = int.from_bytes(value.mask, "big", signed=self.signed)
+        if value.tmask_supported:
+            self.tmask = int.from_bytes(value.tmask, "big", signed=self.signed)
+
+    def _flag(self, n: int) -> Optional[FlagValue]:
+        if n == self.mask:
+            return FlagValue.MASK
+        if n == self.tmask:
+            return FlagValue.TMASK
+        if self.min_value is not None and n < self.min_value:
+            return FlagValue.Invalid
+        if self.max_value is not None and n > self.max_value:
+            return FlagValue.Invalid
+        return None
+
+    def decode(self, data: Sequence[Optional[int]]) -> Any:
+        if self.kind == _GENERIC:
+            return self.value.from_list(data)
+        if self.contiguous:
+            raw = data[self.start:self.start + self.width]
+        else:
+            raw = [data[o] for o in self.offsets if o < len(data)]
+        if len(raw) != self.width or None in raw:
+            raise MemoryLocationNotImplemented(
+                f"List is missing memory locations of {self.value}")
+        if self.kind == _SCALED:
+            scale = raw[0] - 256 if raw[0] > 127 else raw[0]
+            if 6 < raw[0] < 0xfa:
+                return FlagValue.Invalid
+            n = int.from_bytes(bytes(raw[1:]), "big", signed=self.signed)
+            flag = self._flag(n)
+            if flag:
+                return flag
+            return int.from_bytes(bytes(raw[1:]), "big") \
+                * pow(Decimal(10), scale)
+        n = int.from_bytes(bytes(raw), "big", signed=self.signed)
+        flag = self._flag(n)
+        if flag:
+            return flag
+        if self.kind == _FIXED:
+            return self.scaling_factor * n
+        return n
+
+
+class DecodePlan:
+    """
+    A compiled decoding of all the memory values of a memory bank
+
+    :param bank: The memory bank; the plan covers the values registered
+    with it when the plan is made
+    """
+
+    def __init__(self, bank: MemoryBank):
+        self.bank = bank
+        self.entries = [_Entry(v) for v in bank.values]
+
+    @property
+    def values(self) -> list[type[MemoryValue]]:
+        return [e.value for e in self.entries]
+
+    def decode(self, data: Sequence[Optional[int]]) -> dict:
+        """
+        Decode every value of the bank from a bank dump
+
+        :param data: The contents of the bank by memory location, with
+        None for locations that are not implemented, as passed to
+        `MemoryValue.from_list()`
+        :return: A dict of MemoryValue class to value, leaving out values
+        whose locations are not all present, like `MemoryBank.read_all()`
+        """
+        result = {}
+        for entry in self.entries:
+            try:
+                result[entry.value] = entry.decode(data)
+            except MemoryLocationNotImplemented:
+                pass
+        return result
+
+    def decode_columns(self, data, present=None) -> dict:
+        """
+        Decode the bank from many bank dumps at once, using NumPy
+
+        :param data: A two dimensional array of uint8, one row per bank
+        dump and one column per memory location
+        :param present: An optional array of bools of the same shape,
+        False for locations that are not implemented
+        :return: A dict of MemoryValue class to a tuple of (values,
+        valid). 'valid' is an array of bools, False where the value is
+        missing or is MASK, TMASK or invalid. 'values' is an array of
+        int64, uint64 or float64 for compiled values; for other values
+        it is an array of objects holding what `from_list()` returns,
+        or None.
+        """
+        if numpy is None:
+            raise ImportError("decode_columns() needs numpy")
+        data = numpy.asarray(data, dtype=numpy.uint8)
+        rows, columns = data.shape
+        if present is None:
+            present = numpy.ones(data.shape, dtype=bool)
+        else:
+            present = numpy.asarray(present, dtype=bool)
+        result = {}
+        for entry in self.entries:
+            if max(entry.offsets) >= columns:
+                result[entry.value] = (
+                    numpy.zeros(rows, dtype=object),
+                    numpy.zeros(rows, dtype=bool))
+                continue
+            offsets = list(entry.offsets)
+            valid = present[:, offsets].all(axis=1)
+            if entry.kind == _GENERIC:
+                values = numpy.empty(rows, dtype=object)
+                for row in numpy.nonzero(valid)[0]:
+                    contents = [
+                        int(b) if p else None
+                        for b, p in zip(data[row], present[row])]
+                    values[row] = entry.value.from_list(contents)
+                    if isinstance(values[row], FlagValue):
+                        valid[row] = False
+                result[entry.value] = (values, valid)
+                continue
+            columns_used = data[:, offsets].astype(numpy.uint64)
+            if entry.kind == _SCALED:
+                scale = data[:, offsets[0]].astype(numpy.int8)
+                valid &= (scale >= -6) & (scale <= 6)
+                columns_used = columns_used[:, 1:]
+            n = numpy.zeros(rows, dtype=numpy.uint64)
+            for column in range(columns_used.shape[1]):
+                n = (n << numpy.uint64(8)) | columns_used[:, column]
+            bits = 8 * columns_used.shape[1]
+            if entry.signed and bits < 64:
+                n = n.astype(numpy.int64)
+                n = numpy.where(n >= 1 << (bits - 1), n - (1 << bits), n)
+            elif bits < 64:
+                n = n.astype(numpy.int64)
+            for flag in (entry.mask, entry.tmask):
+                if flag is not None:
+                    valid &= n != flag
+            if entry.min_value is not None:
+                valid &= n >= entry.min_value
+            if entry.max_value is not None:
+                valid &= n <= entry.max_value
+            if entry.kind == _SCALED:
+                values = n.astype(numpy.float64) \
+                    * numpy.power(10.0, scale.astype(numpy.float64))
+            elif entry.kind == _FIXED:
+                values = n * float(entry.scaling_factor)
+            else:
+                values = n
+            result[entry.value] = (values, valid)
+        return result
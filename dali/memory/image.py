@@ -0,0 +1,338 @@
+"""
+Raw memory bank images, and files holding many of them
+
+A `MemoryImage` holds the raw contents of all the memory banks of one
+bus unit, as read by `read_image()`. Any MemoryValue can be decoded from
+an image without bus access, because the bank views it provides behave
+like the lists that `MemoryValue.from_list()` expects.
+
+The packed form of an image is, for each memory bank: the bank number,
+the number of locations n as two bytes (big-endian, since a full bank
+has 256 locations), a bitmap of which of the n locations were
+implemented (LSB first), then the n bytes of contents.
+
+`ImageFile.write()` stores many images in one file, indexed by bus
+number and short address. Opening the file with `ImageFile` maps it
+into memory: an image from the file is a view of the mapped file, so
+nothing is copied or parsed until a value is decoded.
+
+Example:
+```
+images = {}
+for bus, driver in enumerate(drivers):
+    for address in range(64):
+        images[(bus, address)] = await driver.run_sequence(
+            read_image(GearShort(address)))
+ImageFile.write("site.img", images)
+
+with ImageFile("site.img") as f:
+    gtin = f[(0, 5)].decode(info.GTIN)
+```
+"""
+from __future__ import annotations
+
+import mmap
+import struct
+from typing import Any, Generator, Iterable, Mapping, Optional
+
+from dali.address import DeviceShort, GearShort
+from dali.command import Command, Response
+from dali.exceptions import MemoryLocationNotImplemented
+from dali.memory import diagnostics, energy, info, maintenance, oem
+from dali.memory.location import (
+    MemoryBank,
+    MemoryValue,
+    _DTR0,
+    _DTR1,
+    _EnableWriteMemory,
+    _ReadMemoryLocation,
+    _WriteMemoryLocationNoReply,
+)
+from dali.sequences import batch
+
+# The memory banks read by default
+DEFAULT_BANKS = (
+    info.BANK_0,
+    oem.BANK_1,
+    energy.BANK_202,
+    energy.BANK_203,
+    energy.BANK_204,
+    diagnostics.BANK_205,
+    diagnostics.BANK_206,
+    maintenance.BANK_207,
+)
+
+
+# Bank number and number of locations, at the start of each bank's record
+_BANK_HEADER = struct.Struct("!BH")
+
+
+def _raw(r: Optional[Response]) -> Optional[int]:
+    if r is None or r.raw_value is None or r.raw_value.error:
+        return None
+    return r.raw_value.as_integer
+
+
+class BankImage:
+    """
+    The contents of one memory bank in an image
+
+    Indexing by memory location returns the contents as an int, None if
+    the location was not implemented, and raises IndexError beyond the
+    last location read, like the lists used by `MemoryValue.from_list()`.
+    """
+
+    def __init__(self, number: int, present: memoryview, data: memoryview):
+        self.number = number
+        self._present = present
+        self._data = data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, location):
+        if isinstance(location, slice):
+            return [self[n] for n in range(*location.indices(len(self)))]
+        if not 0 <= location < len(self._data):
+            raise IndexError(location)
+        if not self._present[location >> 3] & (1 << (location & 7)):
+            return None
+        return self._data[location]
+
+    def to_list(self) -> list[Optional[int]]:
+        return [self[n] for n in range(len(self))]
+
+
+class MemoryImage:
+    """
+    The raw contents of the memory banks of one bus unit
+
+    :param buffer: The packed image; a memoryview of it is kept, so a
+    slice of a memory mapped file is not copied
+    """
+
+    def __init__(self, buffer=b""):
+        self._buffer = memoryview(buffer)
+        # Bank number -> offset of its record
+        self._banks: dict[int, int] = {}
+        pos = 0
+        while pos < len(self._buffer):
+            number, length = _BANK_HEADER.unpack_from(self._buffer, pos)
+            self._banks[number] = pos
+            pos += _BANK_HEADER.size + (length + 7) // 8 + length
+
+    @classmethod
+    def from_banks(
+        cls, banks: Mapping[int, list[Optional[int]]],
+    ) -> MemoryImage:
+        """
+        Pack bank contents into an image
+
+        :param banks: A dict of bank number to a list of the contents of
+        its locations, None for locations that are not implemented
+        """
+        out = bytearray()
+        for number, contents in sorted(banks.items()):
+            if len(contents) > 256:
+                raise ValueError(f"Bank {number} has too many locations")
+            present = bytearray((len(contents) + 7) // 8)
+            for n, byte in enumerate(contents):
+                if byte is not None:
+                    present[n >> 3] |= 1 << (n & 7)
+            out += _BANK_HEADER.pack(number, len(contents)) + present
+            out += bytes(0 if b is None else b for b in contents)
+        return cls(bytes(out))
+
+    @property
+    def banks(self) -> list[int]:
+        return sorted(self._banks)
+
+    def bank(self, number: int) -> Optional[BankImage]:
+        """The contents of a memory bank, or None if it was not read"""
+        pos = self._banks.get(number)
+        if pos is None:
+            return None
+        _, length = _BANK_HEADER.unpack_from(self._buffer, pos)
+        present = pos + _BANK_HEADER.size
+        data = present + (length + 7) // 8
+        return BankImage(
+            number, self._buffer[present:data],
+            self._buffer[data:data + length])
+
+    def decode(self, memory_value: type[MemoryValue]) -> Any:
+        """
+        Decode a memory value from the image
+
+        Returns the same as `memory_value.read()` would have.
+
+        :raises MemoryLocationNotImplemented: if the image does not hold
+        all the locations of the value
+        """
+        bank = self.bank(memory_value.bank.address)
+        if bank is None:
+            raise MemoryLocationNotImplemented(
+                f"Image does not include memory bank "
+                f"{memory_value.bank.address}")
+        return memory_value.from_list(bank)
+
+    def decode_all(self, bank: MemoryBank) -> dict:
+        """Decode every memory value of a bank, as `MemoryBank.read_all()`"""
+        data = self.bank(bank.address)
+        if data is None:
+            return {}
+        return bank.decode_plan().decode(data)
+
+    def to_bytes(self) -> bytes:
+        return self._buffer.tobytes()
+
+    def __len__(self):
+        return len(self._buffer)
+
+
+def read_image(
+    addr: int | GearShort | DeviceShort,
+    banks: Iterable[MemoryBank] = DEFAULT_BANKS,
+    use_latch: bool = True,
+) -> Generator[Command, Any, MemoryImage]:
+    """
+    A generator sequence to read the memory banks of a bus unit into an
+    image
+
+    Each bank is read up to its last implemented location; banks that
+    are not implemented are left out. Banks with a latch are latched
+    while locations from 3 onwards are read, after reading the lock
+    byte.
+    """
+    if isinstance(addr, int):
+        # Assume 16-bit DALI, if not explicit
+        addr = GearShort(addr)
+    elif not isinstance(addr, (GearShort, DeviceShort)):
+        raise TypeError(
+            f"Invalid addr: {addr}, expected GearShort or DeviceShort")
+    contents = {}
+    for bank in banks:
+        yield _DTR1(addr, bank.address)
+        yield _DTR0(addr, 0)
+        last = _raw((yield _ReadMemoryLocation(addr)))
+        if last is None:
+            continue
+        data = [last]
+        # DTR0 is now 1
+        responses = yield batch(
+            _ReadMemoryLocation(addr) for _ in range(1, min(last, 2) + 1))
+        data.extend(_raw(r) for r in responses)
+        if last > 2:
+            latched = use_latch and bank.has_latch
+            if latched:
+                yield _EnableWriteMemory(addr)
+                yield _DTR0(addr, 2)
+                yield _WriteMemoryLocationNoReply(addr, 0xAA)
+            responses = yield batch(
+                _ReadMemoryLocation(addr) for _ in range(3, last + 1))
+            data.extend(_raw(r) for r in responses)
+            if latched:
+                yield _DTR0(addr, 2)
+                yield _WriteMemoryLocationNoReply(addr, 0xFF)
+        contents[bank.address] = data
+    return MemoryImage.from_banks(contents)
+
+
+class ImageFile:
+    """
+    A file of memory images, indexed by bus number and short address
+
+    The file is memory mapped; images returned from it are views of the
+    mapping and must not be used after the file is closed.
+
+    The file starts with a header: the magic bytes, the number of
+    images, then one index entry per image holding the bus number, the
+    short address, a flag that is 1 for control devices, and the offset
+    and length of the packed image.
+    """
+
+    MAGIC = b"DALIMIMG\x02"
+    _HEADER = struct.Struct("!9sI")
+    _ENTRY = struct.Struct("!HBBQI")
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, count = self._HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a memory image file")
+        self._index = {}
+        pos = self._HEADER.size
+        for _ in range(count):
+            bus, address, device, offset, length = self._ENTRY.unpack_from(
+                self._map, pos)
+            self._index[(bus, address, bool(device))] = (offset, length)
+            pos += self._ENTRY.size
+
+    @classmethod
+    def write(
+        cls,
+        path,
+        images: Mapping[tuple, MemoryImage],
+    ) -> None:
+        """
+        Write images to a file
+
+        :param images: A dict of (bus number, short address) to image;
+        keys may also be (bus number, short address, is_device) for
+        control devices
+        """
+        keys = []
+        for key in images:
+            bus, address, *device = key
+            keys.append((key, bus, address, bool(device and device[0])))
+        offset = cls._HEADER.size + cls._ENTRY.size * len(keys)
+        with open(path, "wb") as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, len(keys)))
+            for key, bus, address, device in keys:
+                length = len(images[key])
+                f.write(cls._ENTRY.pack(bus, address, device, offset, length))
+                offset += length
+            for key, *_ in keys:
+                f.write(images[key].to_bytes())
+
+    def get(
+        self, bus: int, address: int, device: bool = False,
+    ) -> Optional[MemoryImage]:
+        entry = self._index.get((bus, address, device))
+        if entry is None:
+            return None
+        offset, length = entry
+        return MemoryImage(self._view[offset:offset + length])
+
+    def __getitem__(self, key: tuple) -> MemoryImage:
+        image = self.get(*key)
+        if image is None:
+            raise KeyError(key)
+        return image
+
+    def __contains__(self, key: tuple) -> bool:
+        return self.get(*key) is not None
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self) -> list[tuple[int, int, bool]]:
+        return sorted(self._index)
+
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Images from the file are still in use; the mapping is
+            # closed when they have all gone
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -13,6 +13,7 @@ from dali.exceptions import (
     MemoryWriteFailure,
     ResponseError,
 )
+from dali.sequences import batch
 
 
 def _DTR0(addr: Address, value: int):
@@ -85,6 +86,104 @@ def _QueryContentDTR0(addr: Address):
         raise TypeError(f"Invalid addr: {addr}, expected GearAddress or DeviceAddress")
 
 
+def _runs(locations):
+    """Split memory location addresses into runs of contiguous locations
+
+    Returns a list of (start, length) tuples. Gaps are never read
+    through: a read costs a forward frame plus a backward frame, or a
+    timeout for an unimplemented location, while moving DTR0 past the
+    gap costs a single forward frame.
+    """
+    runs = []
+    for location in sorted(set(locations)):
+        if runs and runs[-1][0] + runs[-1][1] == location:
+            runs[-1][1] += 1
+        else:
+            runs.append([location, 1])
+    return [tuple(r) for r in runs]
+
+
+def read_raw_values(addr: Address, values, use_latch: bool = True):
+    """Read several memory values from a bus unit without interpretation
+
+    The memory locations of all the values are merged into contiguous
+    runs for each memory bank. DTR1 is written once per bank, and DTR0
+    only at the start of each run: within a run the bus unit increments
+    DTR0 after each read. The reads in each run don't depend on each
+    other's responses, so they are sent as a batch.
+
+    If a memory bank has a latch, the latch is set while its values are
+    read so that they represent a snapshot in time. If you don't want
+    this behaviour, pass use_latch=False.
+
+    Returns a dict of MemoryValue class to bytes, as read_raw() would
+    return them. Values that the bus unit does not implement are left
+    out.
+    """
+    if isinstance(addr, int):
+        # Assume 16-bit DALI, if not explicit
+        addr = GearShort(addr)
+    elif not isinstance(addr, (GearShort, DeviceShort)):
+        raise TypeError(f"Invalid addr: {addr}, expected GearShort or DeviceShort")
+    by_bank = {}
+    for memory_value in values:
+        by_bank.setdefault(memory_value.bank, []).append(memory_value)
+
+    result = {}
+    for bank in sorted(by_bank, key=lambda b: b.address):
+        bank_values = by_bank[bank]
+        locations = [
+            loc.address for v in bank_values for loc in v.locations]
+        raw_data = [None] * (max(locations) + 1)
+        yield _DTR1(addr, bank.address)
+        dtr0 = None
+        latched = use_latch and bank.has_latch
+        if latched:
+            yield _EnableWriteMemory(addr)
+            yield _DTR0(addr, 2)
+            yield _WriteMemoryLocationNoReply(addr, 0xAA)
+            dtr0 = 3
+        for start, length in _runs(locations):
+            if start != dtr0:
+                yield _DTR0(addr, start)
+            responses = yield batch(
+                _ReadMemoryLocation(addr) for _ in range(length))
+            for loc, r in zip(range(start, start + length), responses):
+                if r.raw_value is not None:
+                    if r.raw_value.error:
+                        raise ResponseError(
+                            f"Framing error while reading memory bank "
+                            f"{bank.address} location {loc}"
+                        )
+                    raw_data[loc] = r.raw_value.as_integer
+            dtr0 = start + length
+        if latched:
+            yield _DTR0(addr, 2)
+            yield _WriteMemoryLocationNoReply(addr, 0xFF)
+        for memory_value in bank_values:
+            raw = [raw_data[loc.address] for loc in memory_value.locations]
+            if None not in raw:
+                result[memory_value] = bytes(raw)
+    return result
+
+
+def read_values(addr: Address, values, use_latch: bool = True):
+    """Read several memory values from a bus unit
+
+    Reads the values with read_raw_values(), so reads are merged into
+    contiguous runs and latched banks are latched.
+
+    Returns a dict of MemoryValue class to the value read, as read()
+    would return it. Values that the bus unit does not implement are
+    left out.
+    """
+    raw = yield from read_raw_values(addr, values, use_latch)
+    return {
+        memory_value: memory_value.check_raw(r) or memory_value.raw_to_value(r)
+        for memory_value, r in raw.items()
+    }
+
+
 class MemoryType(Enum):
     ROM = auto()       # ROM
     RAM_RO = auto()    # RAM-RO
@@ -116,6 +215,7 @@ class MemoryBank:
         self.__address = address
         self.locations = {x: None for x in range(0xff)}
         self.values = []
+        self._decode_plan = None
 
         # add value for last addressable location
         class LastAddress(NumericValue):
@@ -159,6 +259,20 @@ class MemoryBank:
             self.locations[location.address] = self.MemoryBankEntry(
                 location, memory_value)
 
+    def decode_plan(self):
+        """Return a DecodePlan for the values of this memory bank
+
+        The plan is made on first use, and made again if more values
+        have been declared since.
+        """
+        plan = self._decode_plan
+        if plan is None or len(plan.entries) != len(self.values):
+            # Imported here because dali.memory.decode depends on the
+            # value classes declared in this module
+            from dali.memory.decode import DecodePlan
+            plan = self._decode_plan = DecodePlan(self)
+        return plan
+
     def last_address(self, addr):
         """Sequence that returns the last available address in this bank
         """
@@ -191,8 +305,12 @@ class MemoryBank:
         if dtr0 != start_address:
             yield _DTR0(addr, start_address)
         raw_data = [None] * start_address
-        for loc in range(start_address, last_address + 1):
-            r = yield _ReadMemoryLocation(addr)
+        # The reads don't depend on each other's responses; DTR0
+        # increments after each one
+        responses = yield batch(
+            _ReadMemoryLocation(addr)
+            for _ in range(start_address, last_address + 1))
+        for loc, r in zip(range(start_address, last_address + 1), responses):
             if r.raw_value is not None:
                 if r.raw_value.error:
                     raise ResponseError(
@@ -205,15 +323,7 @@ class MemoryBank:
         if use_latch and self.has_latch:
             yield _DTR0(addr, 2)
             yield _WriteMemoryLocationNoReply(addr, 0xFF)
-        result = {}
-        for memory_value in self.values:
-            try:
-                r = memory_value.from_list(raw_data)
-            except MemoryLocationNotImplemented:
-                pass
-            else:
-                result[memory_value] = r
-        return result
+        return self.decode_plan().decode(raw_data)
 
     def latch(self, addr):
         """(Re-)latch all memory locations of this bank.
@@ -0,0 +1,278 @@
+"""
+Aggregate DiiA Part 252 energy counters across a bus
+
+`EnergyAggregator` polls a set of the Part 252 values, by default
+`energy.ActiveEnergy` and `energy.ActivePower`, from every control gear
+on a bus and turns successive readings into energy used. The energy is
+added to rollups for each control gear, each group and the whole bus,
+one per value polled.
+
+The values are read column-wise across the control gear with
+`dali.memory.bulk.read_raw_values()`, a few control gear per
+transaction so that other traffic isn't held up for long.
+
+Energy counters are turned into energy by comparing successive
+readings. Power values (W or VA) are integrated over the time between
+readings, so their rollups hold watt-hours (or VAh); dividing a slot's
+total by its length in hours gives the mean power.
+
+Each rollup is a set of `RingBuffer`s, by default per minute for an
+hour, per hour for two days and per day for a month. A ring buffer is a
+fixed-size array of doubles, so memory use does not grow with uptime,
+and exporting one is a copy of that array.
+
+Counters are compared as raw integers: readings marked TMASK are
+skipped, a counter lower than the previous reading is treated as
+having wrapped if the previous reading was in the top half of the
+counter range and as having been reset otherwise, and across a change
+of scale the scaled values are compared.
+
+Example:
+```
+aggregator = EnergyAggregator(driver, range(64), groups=groups)
+while True:
+    await aggregator.poll()
+    await asyncio.sleep(60)
+start, per_minute = aggregator.bus[energy.ActiveEnergy].buffers[0].snapshot(
+    time.time())
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from array import array
+from decimal import Decimal
+from typing import Callable, Iterable, Mapping, Optional
+
+from dali.exceptions import DALIError
+from dali.memory import energy
+from dali.memory.bulk import read_raw_values
+
+_LOG = logging.getLogger("dali.memory.metering")
+
+# (seconds per slot, number of slots) for each ring buffer in a rollup
+DEFAULT_RESOLUTIONS = ((60, 60), (3600, 48), (86400, 31))
+
+# Part 252 values that count energy, and those that give power
+ENERGY_COUNTERS = (
+    energy.ActiveEnergy, energy.ApparentEnergy, energy.ActiveEnergyLoadside)
+POWER_VALUES = (
+    energy.ActivePower, energy.ApparentPower, energy.ActivePowerLoadside)
+
+
+def counter_delta(
+    counter: type[energy.ScaledNumericValue],
+    previous: bytes,
+    current: bytes,
+) -> Optional[Decimal]:
+    """
+    Work out the energy between two raw readings of an energy counter
+
+    :param counter: The energy counter memory value, e.g.
+    `energy.ActiveEnergy`
+    :param previous: Raw bytes of the earlier reading
+    :param current: Raw bytes of the later reading
+    :return: The energy used, or None if either reading is not a valid
+    counter value, or the counter went down across a change of scale
+    """
+    if counter.check_raw(previous) or counter.check_raw(current):
+        return None
+    scale = int.from_bytes(current[:1], "big", signed=True)
+    before = int.from_bytes(previous[1:], "big")
+    after = int.from_bytes(current[1:], "big")
+    if previous[:1] != current[:1]:
+        # The unit changed its scale: compare the scaled values, and skip
+        # the sample if the counter appears to have gone backwards
+        previous_scale = int.from_bytes(previous[:1], "big", signed=True)
+        delta = after * pow(Decimal(10), scale) \
+            - before * pow(Decimal(10), previous_scale)
+        return delta if delta >= 0 else None
+    if after < before:
+        modulus = counter.max_value + 1
+        if before >= modulus // 2:
+            after += modulus
+        else:
+            # The counter was reset rather than wrapping
+            before = 0
+    return (after - before) * pow(Decimal(10), scale)
+
+
+class RingBuffer:
+    """
+    Totals for fixed time slots, keeping only the most recent slots
+
+    :param resolution: Seconds per slot
+    :param slots: The number of slots kept
+    """
+
+    def __init__(self, resolution: float, slots: int):
+        self.resolution = resolution
+        self.slots = slots
+        self._totals = array("d", bytes(8 * slots))
+        # The slot number held in each position, or -1 if empty
+        self._index = array("q", [-1]) * slots
+
+    def add(self, when: float, amount: float) -> None:
+        """Add an amount to the slot containing time 'when'"""
+        n = int(when // self.resolution)
+        pos = n % self.slots
+        if self._index[pos] != n:
+            if self._index[pos] > n:
+                # Too old to be kept
+                return
+            self._index[pos] = n
+            self._totals[pos] = 0.0
+        self._totals[pos] += amount
+
+    def snapshot(self, now: float) -> tuple[float, array]:
+        """
+        Copy out the slots up to and including the one containing 'now'
+
+        :return: The start time of the first slot, and an array with
+        the total of each slot, oldest first; slots with nothing added
+        are 0
+        """
+        last = int(now // self.resolution)
+        first = last - self.slots + 1
+        result = array("d", bytes(8 * self.slots))
+        for pos in range(self.slots):
+            n = self._index[pos]
+            if first <= n <= last:
+                result[n - first] = self._totals[pos]
+        return first * self.resolution, result
+
+
+class EnergyRollup:
+    """
+    Ring buffers of energy at several resolutions
+
+    :param resolutions: (seconds per slot, number of slots) for each
+    ring buffer
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS):
+        self.buffers = [RingBuffer(r, n) for r, n in resolutions]
+        self.total = 0.0
+
+    def add(self, when: float, amount: float) -> None:
+        self.total += amount
+        for buffer in self.buffers:
+            buffer.add(when, amount)
+
+    def snapshot(self, now: float) -> dict[float, tuple[float, array]]:
+        """Snapshots of all the ring buffers, keyed by resolution"""
+        return {b.resolution: b.snapshot(now) for b in self.buffers}
+
+
+class EnergyAggregator:
+    """
+    Polls Part 252 values from control gear and rolls up the energy
+
+    `gear`, `group` and `bus` hold an `EnergyRollup` for each value in
+    'values', e.g. `aggregator.group[3][energy.ActiveEnergy]`.
+
+    :param driver: An asyncio driver with a `run_sequence()` method
+    :param addresses: Short addresses of the control gear to poll
+    :param groups: An optional dict of short address to the groups that
+    control gear is a member of
+    :param values: The energy counters and power values to read, from
+    `ENERGY_COUNTERS` and `POWER_VALUES`
+    :param resolutions: (seconds per slot, number of slots) for the ring
+    buffers of each rollup
+    :param chunk: The number of control gear read in each transaction
+    :param clock: A function returning the current time in seconds;
+    slots are aligned to multiples of their resolution
+    """
+
+    def __init__(
+        self,
+        driver,
+        addresses: Iterable[int],
+        groups: Optional[Mapping[int, Iterable[int]]] = None,
+        values: Iterable[type[energy.ScaledNumericValue]] = (
+            energy.ActiveEnergy, energy.ActivePower),
+        resolutions=DEFAULT_RESOLUTIONS,
+        chunk: int = 8,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.values = list(values)
+        for value in self.values:
+            if value not in ENERGY_COUNTERS + POWER_VALUES:
+                raise ValueError(f"{value.__name__} is not an energy value")
+        if chunk < 1:
+            raise ValueError("chunk must be at least 1")
+        self.driver = driver
+        self.addresses = list(addresses)
+        self.groups = {a: set(g) for a, g in (groups or {}).items()}
+        self.chunk = chunk
+        self._clock = clock
+
+        def rollups():
+            return {v: EnergyRollup(resolutions) for v in self.values}
+
+        self.gear = {a: rollups() for a in self.addresses}
+        self.group = {
+            g: rollups() for g in sorted(set().union(*self.groups.values()))}
+        self.bus = rollups()
+        # (short address, value) -> (time, last valid raw reading)
+        self._last: dict[tuple[int, type], tuple[float, bytes]] = {}
+
+    def record(
+        self,
+        address: int,
+        when: float,
+        raw: bytes,
+        value: type[energy.ScaledNumericValue] = energy.ActiveEnergy,
+    ) -> None:
+        """
+        Add a raw reading of a value from one control gear
+
+        The first valid reading from a control gear only sets the
+        starting point.
+        """
+        if value.check_raw(raw):
+            return
+        previous = self._last.get((address, value))
+        self._last[(address, value)] = (when, raw)
+        if previous is None:
+            return
+        then, previous_raw = previous
+        if value in POWER_VALUES:
+            # Trapezoidal integration over the time between readings
+            hours = Decimal(when - then) / 3600
+            delta = (value.raw_to_value(previous_raw)
+                     + value.raw_to_value(raw)) / 2 * hours
+        else:
+            delta = counter_delta(value, previous_raw, raw)
+        if not delta:
+            return
+        amount = float(delta)
+        self.gear[address][value].add(when, amount)
+        for g in self.groups.get(address, ()):
+            self.group[g][value].add(when, amount)
+        self.bus[value].add(when, amount)
+
+    async def poll(self) -> int:
+        """
+        Read the values from every control gear once
+
+        :return: The number of control gear that returned a reading
+        """
+        read = 0
+        for n in range(0, len(self.addresses), self.chunk):
+            addresses = self.addresses[n:n + self.chunk]
+            try:
+                result = await self.driver.run_sequence(
+                    read_raw_values(addresses, self.values))
+            except (DALIError, OSError, asyncio.TimeoutError) as e:
+                _LOG.warning("Reading energy of %s failed: %s", addresses, e)
+                continue
+            when = self._clock()
+            for address, raws in result.items():
+                if raws:
+                    read += 1
+                for value, raw in raws.items():
+                    self.record(address, when, raw, value)
+        return read
@@ -0,0 +1,280 @@
+"""
+Poll diagnostics and maintenance memory banks within a bus budget
+
+`DiagnosticsPoller` reads the DiiA Part 253 diagnostics banks (205 and
+206) and the maintenance bank (207) from control gear on a schedule,
+using `dali.memory.location.read_values()` so that each bank is read in
+contiguous runs with the latch set, giving a consistent snapshot. Each
+bank is read as a separate transaction, so interactive traffic never
+waits for more than one bank to be read.
+
+Values stored in RAM, such as failure conditions, temperatures and
+voltages, are read often; counters and lifetimes stored in NVM are read
+rarely, and ROM values such as bank versions not at all. Between reads
+the poller waits long enough that it uses no more than `bus_share` of
+the bus time, leaving the rest for interactive traffic. Only the time
+the poller actually holds the bus counts, not time spent waiting for it.
+
+Results are kept per control gear and memory value as `TimeSeries`.
+
+Example:
+```
+poller = DiagnosticsPoller(driver, range(64), bus_share=0.1)
+asyncio.create_task(poller.run())
+...
+series = poller.series[5][diagnostics.ControlGearTemperature]
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from array import array
+from typing import Any, Callable, Iterable, Optional
+
+from dali.address import GearShort
+from dali.exceptions import DALIError, MissingResponse
+from dali.gear.general import QueryControlGearPresent
+from dali.memory import diagnostics, maintenance
+from dali.memory.location import MemoryType, MemoryValue, read_values
+
+_LOG = logging.getLogger("dali.memory.poller")
+
+_BANKS = (diagnostics.BANK_205, diagnostics.BANK_206, maintenance.BANK_207)
+
+
+def default_schedule(
+    fast: float = 60.0,
+    slow: float = 3600.0,
+) -> list[tuple[float, list[type[MemoryValue]]]]:
+    """
+    The default polling schedule for the diagnostics and maintenance banks
+
+    :param fast: Seconds between reads of values stored in RAM
+    :param slow: Seconds between reads of values stored in NVM
+    :return: A list of (interval, memory values) tuples
+    """
+    ram, nvm = [], []
+    for bank in _BANKS:
+        for value in bank.values:
+            if value in (bank.LastAddress, bank.LockByte):
+                continue
+            types = {loc.type_ for loc in value.locations}
+            if types & {MemoryType.RAM_RO, MemoryType.RAM_RW}:
+                ram.append(value)
+            elif types != {MemoryType.ROM}:
+                nvm.append(value)
+    return [(fast, ram), (slow, nvm)]
+
+
+class TimeSeries:
+    """
+    Samples of one memory value from one control gear
+
+    Times and values are kept as doubles, in fixed size rings of
+    `max_samples` samples; only the most recent samples are kept.
+    Booleans are stored as 0 and 1; values that aren't numbers, for
+    example `FlagValue.TMASK`, are stored as NaN.
+    """
+
+    def __init__(self, max_samples: int = 1440):
+        if max_samples < 1:
+            raise ValueError("max_samples must be at least 1")
+        self.max_samples = max_samples
+        self._times = array("d", bytes(8 * max_samples))
+        self._values = array("d", bytes(8 * max_samples))
+        # The position the next sample goes in
+        self._next = 0
+        self._count = 0
+
+    def append(self, when: float, value: Any) -> None:
+        try:
+            v = float(value)
+        except (TypeError, ValueError):
+            v = math.nan
+        self._times[self._next] = when
+        self._values[self._next] = v
+        self._next = (self._next + 1) % self.max_samples
+        self._count = min(self._count + 1, self.max_samples)
+
+    def _ordered(self, ring: array) -> array:
+        if self._count < self.max_samples:
+            return ring[:self._count]
+        return ring[self._next:] + ring[:self._next]
+
+    @property
+    def times(self) -> array:
+        """The times of the samples, oldest first"""
+        return self._ordered(self._times)
+
+    @property
+    def values(self) -> array:
+        """The values of the samples, oldest first"""
+        return self._ordered(self._values)
+
+    def latest(self) -> Optional[tuple[float, float]]:
+        """The most recent (time, value) sample, or None"""
+        if not self._count:
+            return None
+        return self._times[self._next - 1], self._values[self._next - 1]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return zip(self.times, self.values)
+
+
+class DiagnosticsPoller:
+    """
+    Reads diagnostics from control gear on a schedule
+
+    :param driver: An asyncio driver with a `run_sequence()` method
+    :param addresses: Short addresses of the control gear to poll
+    :param schedule: A list of (interval in seconds, memory values)
+    tuples; defaults to `default_schedule()`
+    :param bus_share: The fraction of bus time the poller may use, more
+    than 0 and at most 1
+    :param max_samples: The number of samples kept in each TimeSeries
+    :param clock: A function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        driver,
+        addresses: Iterable[int],
+        schedule: Optional[list[tuple[float, list[type[MemoryValue]]]]] = None,
+        bus_share: float = 0.1,
+        max_samples: int = 1440,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 0 < bus_share <= 1:
+            raise ValueError("bus_share must be more than 0 and at most 1")
+        self.driver = driver
+        self.addresses = list(addresses)
+        self.schedule = default_schedule() if schedule is None else schedule
+        self.bus_share = bus_share
+        self.max_samples = max_samples
+        self._clock = clock
+        self.series: dict[int, dict[type[MemoryValue], TimeSeries]] = {
+            a: {} for a in self.addresses}
+        # The last exception while polling each control gear, if any
+        self.errors: dict[int, BaseException] = {}
+        # (address, schedule index) -> time the entry is next due
+        self._due: dict[tuple[int, int], float] = {}
+        # Values that each control gear turned out not to implement
+        self._unsupported: dict[int, set] = {a: set() for a in self.addresses}
+
+    def next_due(self) -> float:
+        """The time at which polling is next due"""
+        now = self._clock()
+        return min(
+            (self._due.get((a, n), now) for a in self.addresses
+             for n in range(len(self.schedule))),
+            default=math.inf)
+
+    async def poll_once(self) -> int:
+        """
+        Poll every control gear that has values due
+
+        :return: The number of control gear that were read
+        """
+        polled = 0
+        for address in self.addresses:
+            now = self._clock()
+            values = []
+            for n, (interval, entry) in enumerate(self.schedule):
+                if self._due.get((address, n), now) <= now:
+                    self._due[(address, n)] = now + interval
+                    values.extend(
+                        v for v in entry
+                        if v not in self._unsupported[address])
+            if not values:
+                continue
+            banks: dict = {}
+            for value in values:
+                banks.setdefault(value.bank, []).append(value)
+            result = {}
+            try:
+                for bank_values in banks.values():
+                    result.update(await self._read(address, bank_values))
+            except (DALIError, OSError, asyncio.TimeoutError) as e:
+                _LOG.warning("Polling diagnostics of %s failed: %s",
+                             address, e)
+                self.errors[address] = e
+                continue
+            if await self._record(address, values, result, self._clock()):
+                polled += 1
+        return polled
+
+    async def _read(self, address, values) -> dict:
+        # Reads one bank as its own transaction, then leaves the bus to
+        # others for long enough to stay within the budget
+        started = []
+
+        def timed(seq):
+            # Runs once the driver has taken the transaction lock
+            started.append(self._clock())
+            return (yield from seq)
+
+        async def rest():
+            if started:
+                busy = self._clock() - started[0]
+                await asyncio.sleep(
+                    busy * (1 - self.bus_share) / self.bus_share)
+
+        try:
+            result = await self.driver.run_sequence(
+                timed(read_values(GearShort(address), values)))
+        except (DALIError, OSError, asyncio.TimeoutError):
+            await rest()
+            raise
+        await rest()
+        return result
+
+    async def _record(self, address, values, result, when) -> bool:
+        # A value is only unsupported if the gear answered: either for
+        # other values in the same bank or, for a bank that gave no
+        # answers at all, to QueryControlGearPresent. Otherwise the gear
+        # may just be switched off, so its values are tried again when
+        # they are next due.
+        answered = {v.bank for v in result}
+        silent = {v.bank for v in values} - answered
+        if silent:
+            try:
+                present = await self.driver.send(
+                    QueryControlGearPresent(GearShort(address)))
+            except (DALIError, OSError, asyncio.TimeoutError) as e:
+                _LOG.warning("Polling diagnostics of %s failed: %s",
+                             address, e)
+                present = None
+            if present is not None and present.value:
+                answered |= silent
+            elif not result:
+                self.errors[address] = MissingResponse(
+                    f"No response from control gear {address}")
+                return False
+        self.errors.pop(address, None)
+        series = self.series[address]
+        for value in values:
+            if value not in result:
+                if value.bank in answered:
+                    self._unsupported[address].add(value)
+                continue
+            if value not in series:
+                series[value] = TimeSeries(self.max_samples)
+            series[value].append(when, result[value])
+        return True
+
+    def rescan(self) -> None:
+        """Try again to read values that control gear didn't implement"""
+        for unsupported in self._unsupported.values():
+            unsupported.clear()
+
+    async def run(self) -> None:
+        """Poll forever"""
+        while True:
+            await self.poll_once()
+            await asyncio.sleep(max(0.0, self.next_due() - self._clock()))
@@ -0,0 +1,317 @@
+"""
+Record a sequence once, then replay it cheaply on many buses
+
+Some sequences, for example programming scenes or setting up groups
+through a group or broadcast address, never look at the responses to
+the commands they send: they send the same commands every time. Running
+them as generators on every bus means rebuilding all the Command
+objects every time.
+
+`record()` runs such a sequence against simulated responses and
+captures what it yields into a `ReplayProgram`. It then checks every
+query in the program: it runs the sequence again with a different
+response to that query, and flags the query if anything the sequence
+yields afterwards changes. A program with flagged steps can't be
+replayed, because on a real bus the sequence might have done something
+different.
+
+A replayable program turns into a sequence of `batch` steps with
+`ReplayProgram.sequence()`, so drivers that can pipeline commands do so.
+It can also be stored as packed frames with `to_bytes()` and loaded
+again with `from_bytes()`.
+
+Example:
+```
+program = record(lambda: SetGroups(GearBroadcast(), {1, 2}))
+for driver in drivers:
+    await driver.run_sequence(program.sequence())
+```
+"""
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import Any, Callable, Generator, Optional
+
+import dali.device  # noqa: F401 - registers commands for from_frame()
+import dali.gear  # noqa: F401 - registers commands for from_frame()
+from dali import command, frame
+from dali.exceptions import DALISequenceError
+from dali.sequences import batch, progress, sleep
+
+# Responses used when checking whether a sequence looks at a response
+_ALTERNATIVE_RESPONSES = (
+    None,
+    frame.BackwardFrame(0x00),
+    frame.BackwardFrame(0xff),
+    frame.BackwardFrameError(0xff),
+)
+
+
+@dataclass(frozen=True)
+class ReplayStep:
+    """
+    One step of a ReplayProgram
+
+    Exactly one of `command`, `sleep` and `progress` is set. `branches`
+    is True for commands whose response changed what the sequence did
+    next.
+    """
+
+    command: Optional[command.Command] = None
+    sleep: Optional[sleep] = None
+    progress: Optional[progress] = None
+    branches: bool = False
+
+
+def _step_key(item) -> tuple:
+    """A value that is equal for steps that do the same thing"""
+    if isinstance(item, command.Command):
+        return ("c", type(item), len(item.frame), item.frame.as_integer,
+                item.devicetype)
+    if isinstance(item, sleep):
+        return ("s", item.delay)
+    if isinstance(item, progress):
+        return ("p", item.message, item.completed, item.size)
+    raise TypeError(f"Sequence yielded unexpected object {item!r}")
+
+
+def _run(
+    factory: Callable[[], Generator],
+    respond: Callable[[int, command.Command], Optional[command.Response]],
+    steps: list,
+    limit: Optional[list] = None,
+) -> bool:
+    """Run a sequence, appending what it yields to 'steps'
+
+    'respond' is called with the index of each command step.  If
+    'limit' is given, stops as soon as the steps differ from it.
+    Returns True if the sequence ran to completion.
+    """
+    seq = factory()
+    response = None
+    try:
+        while True:
+            try:
+                item = seq.send(response)
+            except StopIteration:
+                return True
+            response = None
+            if isinstance(item, batch):
+                items = item.commands
+            else:
+                items = [item]
+            responses = []
+            for i in items:
+                steps.append(i)
+                if limit is not None:
+                    n = len(steps) - 1
+                    if n >= len(limit) or _step_key(i) != _step_key(limit[n]):
+                        return False
+                if isinstance(i, command.Command):
+                    responses.append(respond(len(steps) - 1, i))
+            if isinstance(item, batch):
+                response = responses
+            elif isinstance(item, command.Command):
+                response = responses[0]
+    finally:
+        seq.close()
+
+
+def _make_response(cmd: command.Command, raw) -> Optional[command.Response]:
+    if cmd.response is None:
+        return None
+    return cmd.response(raw)
+
+
+class ReplayProgram:
+    """
+    The commands, sleeps and progress reports captured from a sequence
+    """
+
+    def __init__(self, steps: list[ReplayStep]):
+        self.steps = tuple(steps)
+
+    @property
+    def branching_steps(self) -> list[int]:
+        """Indexes of the steps whose responses the sequence looked at"""
+        return [n for n, s in enumerate(self.steps) if s.branches]
+
+    @property
+    def replayable(self) -> bool:
+        return not any(s.branches for s in self.steps)
+
+    @property
+    def commands(self) -> list[command.Command]:
+        return [s.command for s in self.steps if s.command is not None]
+
+    def sequence(self) -> Generator[Any, Any, list]:
+        """
+        A generator sequence that replays the program
+
+        Consecutive commands are sent as a single batch.
+
+        :return: A list of the responses to the commands that expect a
+        response, in order
+        :raises DALISequenceError: if the recorded sequence looked at the
+        response to any of its commands
+        """
+        if not self.replayable:
+            raise DALISequenceError(
+                "Sequence depends on responses at steps "
+                f"{self.branching_steps}; it can't be replayed")
+        return self._replay()
+
+    def _replay(self):
+        responses = []
+        pending = []
+        for s in self.steps + (ReplayStep(),):
+            if s.command is not None:
+                pending.append(s.command)
+                continue
+            if pending:
+                r = yield batch(pending)
+                responses.extend(
+                    rsp for cmd, rsp in zip(pending, r) if cmd.response)
+                pending = []
+            if s.sleep is not None:
+                yield s.sleep
+            elif s.progress is not None:
+                yield s.progress
+        return responses
+
+    # Packed format: one record per step, starting with a type byte.
+    # Commands: frame length in bits, device type, then the frame
+    # packed into as many bytes as needed.  Sleeps: the delay as a
+    # double.  Progress: completed and size (-1 for None), then the
+    # length of the UTF-8 message and the message itself.
+    _COMMAND, _SLEEP, _PROGRESS = range(3)
+
+    def to_bytes(self) -> bytes:
+        """Pack a replayable program into bytes, for storage"""
+        if not self.replayable:
+            raise DALISequenceError("Program depends on responses")
+        out = bytearray()
+        for s in self.steps:
+            if s.command is not None:
+                f = s.command.frame
+                out += struct.pack(
+                    "!BBB", self._COMMAND, len(f), s.command.devicetype)
+                out += f.pack
+            elif s.sleep is not None:
+                out += struct.pack("!Bd", self._SLEEP, s.sleep.delay)
+            else:
+                p = s.progress
+                message = (p.message or "").encode("utf-8")
+                out += struct.pack(
+                    "!BiiH", self._PROGRESS,
+                    -1 if p.completed is None else p.completed,
+                    -1 if p.size is None else p.size,
+                    len(message))
+                out += message
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> ReplayProgram:
+        """Load a program packed by `to_bytes()`"""
+        steps = []
+        pos = 0
+        while pos < len(data):
+            kind = data[pos]
+            if kind == cls._COMMAND:
+                bits, devicetype = data[pos + 1], data[pos + 2]
+                pos += 3
+                length = (bits + 7) // 8
+                f = frame.ForwardFrame(bits, data[pos:pos + length])
+                pos += length
+                cmd = command.Command.from_frame(f, devicetype=devicetype)
+                if cmd is None:
+                    raise ValueError(f"Unknown command frame {f}")
+                steps.append(ReplayStep(command=cmd))
+            elif kind == cls._SLEEP:
+                (delay,) = struct.unpack_from("!d", data, pos + 1)
+                pos += 9
+                steps.append(ReplayStep(sleep=sleep(delay)))
+            elif kind == cls._PROGRESS:
+                completed, size, length = struct.unpack_from(
+                    "!iiH", data, pos + 1)
+                pos += 11
+                message = data[pos:pos + length].decode("utf-8") or None
+                pos += length
+                steps.append(ReplayStep(progress=progress(
+                    message=message,
+                    completed=None if completed < 0 else completed,
+                    size=None if size < 0 else size)))
+            else:
+                raise ValueError(f"Unknown step type {kind} at {pos}")
+        return cls(steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({len(self.steps)} steps, "
+                f"replayable={self.replayable})")
+
+
+def record(
+    factory: Callable[[], Generator],
+    bus=None,
+) -> ReplayProgram:
+    """
+    Record a sequence into a ReplayProgram
+
+    :param factory: A callable that returns a new instance of the
+    sequence each time it is called, e.g. `lambda: SetGroups(addr, g)`;
+    the sequence is run several times
+    :param bus: Optional simulated bus with a `send(command)` method,
+    e.g. `dali.tests.fakes.Bus`, that provides the responses for the
+    recording. If not given, no command gets a response.
+    :return: A ReplayProgram; check its `replayable` attribute
+    """
+    baseline_responses = {}
+
+    def respond(n, cmd):
+        r = bus.send(cmd) if bus is not None else _make_response(cmd, None)
+        baseline_responses[n] = r
+        return r
+
+    items = []
+    _run(factory, respond, items)
+
+    branches = set()
+    for n, item in enumerate(items):
+        if not isinstance(item, command.Command) or not item.response:
+            continue
+        baseline = baseline_responses[n]
+        baseline_raw = baseline.raw_value if baseline is not None else None
+        for raw in _ALTERNATIVE_RESPONSES:
+            if raw is None or baseline_raw is None:
+                if raw is baseline_raw:
+                    continue
+            elif raw == baseline_raw and raw.error == baseline_raw.error:
+                continue
+
+            def vary(i, cmd, n=n, raw=raw):
+                if i == n:
+                    return _make_response(cmd, raw)
+                return baseline_responses.get(i)
+
+            steps = []
+            try:
+                completed = _run(factory, vary, steps, limit=items)
+            except Exception:
+                completed = False
+            if not completed or len(steps) != len(items):
+                branches.add(n)
+                break
+
+    return ReplayProgram([
+        ReplayStep(
+            command=item if isinstance(item, command.Command) else None,
+            sleep=item if isinstance(item, sleep) else None,
+            progress=item if isinstance(item, progress) else None,
+            branches=n in branches,
+        )
+        for n, item in enumerate(items)
+    ])
@@ -14,6 +14,12 @@
 # * dali.sequence.sleep instances to request a delay in execution
 #
 # * dali.sequence.progress instances to provide updates on sequence execution
+#
+# * dali.sequence.batch instances holding several commands that do not
+#   depend on each other's responses; the commands must be sent in
+#   order, and a list of their responses passed back via .send().
+#   Drivers that can have more than one command in flight may send
+#   them without waiting for each response in turn.
 
 # Sequences may raise exceptions, which the driver should pass to the
 # caller.
@@ -21,7 +27,8 @@
 from dali.exceptions import DALISequenceError, ProgramShortAddressFailure
 
 from dali.gear.general import *
-from dali.address import Broadcast, Short
+from dali.address import Broadcast, Group, Short
+from dali.command import YesNoResponse
 
 
 class sleep:
@@ -54,6 +61,20 @@ class progress:
             return f"Progress: {self.completed}/{self.size}"
 
 
+class batch:
+    """A batch of commands
+
+    Yielded during a sequence to send several commands whose contents
+    do not depend on each other's responses.  The caller sends them in
+    order and passes back a list of the responses, one per command.
+    """
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    def __len__(self):
+        return len(self.commands)
+
+
 def QueryDeviceTypes(addr):
     """Obtain a list of part 2xx device types supported by control gear
     """
@@ -90,12 +111,12 @@ def QueryGroups(addr):
     Returns a set of integers.
     """
     groups = set()
-    g0 = yield QueryGroupsZeroToSeven(addr)
+    g0, g1 = yield batch([
+        QueryGroupsZeroToSeven(addr), QueryGroupsEightToFifteen(addr)])
     if g0.raw_value is None:
         raise DALISequenceError("No response reading groups zero to seven")
     if g0.raw_value.error:
         raise DALISequenceError("Framing error reading groups zero to seven")
-    g1 = yield QueryGroupsEightToFifteen(addr)
     if g1.raw_value is None:
         raise DALISequenceError("No response reading groups eight to fifteen")
     if g1.raw_value.error:
@@ -127,28 +148,182 @@ def SetGroups(addr, groups):
                 yield RemoveFromGroup(addr, i)
 
 
-def _find_next(low, high):
-    yield SetSearchAddrH((high >> 16) & 0xff)
-    yield SetSearchAddrM((high >> 8) & 0xff)
-    yield SetSearchAddrL(high & 0xff)
+def FindYesResponders(query, groups=None, addresses=None):
+    """Find the control gear that answer "yes" to a yes/no query
+
+    query is a command class with a YesNoResponse, for example
+    QueryControlGearPresent, QueryLampFailure or QueryResetState.
+
+    Answers from several control gear collide on the bus, but a
+    collision is still an answer: if nothing at all answers a query
+    sent to broadcast or to a group then none of the control gear
+    addressed by it would answer "yes".  The query is first sent to
+    broadcast; if anything answers, the candidates are narrowed down
+    by querying groups and finally individual short addresses.  When
+    no control gear answers "yes", this costs a single frame.
+
+    groups is an optional dict of short address to the set of groups
+    that control gear is a member of, as returned by QueryGroups().
+    It must be accurate: control gear that is a member of a group not
+    listed here may be missed.  Control gear without an entry is
+    treated as a member of no groups.
 
-    r = yield Compare()
+    addresses is an optional iterable of the short addresses to
+    consider; by default all short addresses are considered.
 
-    if low == high:
-        if r.value is True:
-            return "clash" if r.raw_value.error else low
-        return
+    Returns a set of integer short addresses.
+    """
+    if not issubclass(query.response, YesNoResponse):
+        raise ValueError(f"{query.__name__} is not a yes/no query")
+    if addresses is None:
+        addresses = range(64)
+    unknown = set(addresses)
+    if groups is None:
+        groups = {}
+    members = {}
+    for a in unknown:
+        for g in groups.get(a, ()):
+            members.setdefault(g, set()).add(a)
+    found = set()
+
+    def _answered(r):
+        return r is not None and r.raw_value is not None
+
+    def _search(candidates, has_yes):
+        # Find the "yes" responders within candidates.  has_yes is True
+        # if an earlier query has shown that candidates contain one; if
+        # not, a group made up of exactly the candidates is queried
+        # first, in case it rules them all out.  Otherwise a group is
+        # only useful if all of its members that are still unknown are
+        # candidates, none of its members are already known to answer
+        # "yes", and querying it splits the candidates.
+        if not candidates:
+            return
+        best = None
+        for g, m in members.items():
+            m = m & unknown
+            if m & found or not m <= candidates:
+                continue
+            if m == candidates and not has_yes:
+                r = yield query(Group(g))
+                if not _answered(r):
+                    unknown.difference_update(m)
+                    return
+                has_yes = True
+                continue
+            split = min(len(m), len(candidates) - len(m))
+            if split > 0 and (best is None or split > best[0]):
+                best = (split, g, m)
+        if best is None:
+            for a in sorted(candidates):
+                r = yield query(Short(a))
+                unknown.discard(a)
+                if _answered(r):
+                    found.add(a)
+            return
+        _, g, m = best
+        r = yield query(Group(g))
+        if _answered(r):
+            yield from _search(m, True)
+            # The rest may or may not contain a "yes" as well
+            yield from _search(candidates & unknown, False)
+        else:
+            unknown.difference_update(m)
+            yield from _search(candidates & unknown, has_yes)
+
+    r = yield query(Broadcast())
+    if _answered(r) and unknown:
+        yield from _search(set(unknown), True)
+    return found
+
+
+class _RandomAddressSearch:
+    """Search for control gear random addresses using Compare
+
+    Keeps track of the search address that was most recently sent to
+    the bus, so that only the search address bytes that have changed
+    need to be sent before each Compare.
+
+    Also keeps the addresses that have answered "yes" to Compare and
+    that are above every random address found so far.  Once the lowest
+    random address has been found and withdrawn, the search for the
+    next one starts from these bounds rather than from the top of the
+    address space; a bound that now answers "no" marks the interval
+    below it as empty.
+    """
+    _searchaddr_commands = (SetSearchAddrH, SetSearchAddrM, SetSearchAddrL)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything about the state of the bus
+
+        Must be called after Randomise, and after gear are initialised
+        because their search address registers may not match ours.
+        """
+        self._searchaddr = [None, None, None]
+        self._bounds = []
+
+    def set_search_addr(self, addr):
+        """Set the search address, sending only the bytes that changed
+        """
+        for i, cmd in enumerate(self._searchaddr_commands):
+            b = (addr >> (16 - 8 * i)) & 0xff
+            if self._searchaddr[i] != b:
+                yield cmd(b)
+                self._searchaddr[i] = b
+
+    def compare(self, addr):
+        yield from self.set_search_addr(addr)
+        r = yield Compare()
+        return r
+
+    def find_next(self, low):
+        """Find the lowest random address that is not below low
+
+        Returns (address, clash) where clash is True if more than one
+        control gear answered at that address, or None if there is no
+        control gear left to find.  Gear with random addresses below
+        low must already have been withdrawn.
+        """
+        self._bounds = [b for b in self._bounds if b >= low]
+
+        # Find an address that answers "yes" to bound the search
+        while True:
+            bound = self._bounds[0] if self._bounds else 0xffffff
+            r = yield from self.compare(bound)
+            if r.value is True:
+                high = bound
+                clash = r.raw_value.error
+                break
+            if self._bounds:
+                self._bounds.pop(0)
+            if bound == 0xffffff:
+                return
+            low = bound + 1
+
+        # Binary search between low and high.  We know there is no
+        # gear below low and there is at least one at or below high.
+        while low < high:
+            midpoint = (low + high) // 2
+            r = yield from self.compare(midpoint)
+            if r.value is True:
+                high = midpoint
+                clash = r.raw_value.error
+                self._bounds.insert(0, midpoint)
+            else:
+                low = midpoint + 1
 
-    if r.value is True:
-        midpoint = (low + high) // 2
-        res = yield from _find_next(low, midpoint)
-        if res is not None:
-            return res
-        return (yield from _find_next(midpoint + 1, high))
+        # Every gear that answered at 'high' must have the random
+        # address 'high', so a framing error means there is a clash
+        if self._bounds and self._bounds[0] == high:
+            self._bounds.pop(0)
+        return high, clash
 
 
 def Commissioning(available_addresses=None, readdress=False,
-                  dry_run=False):
+                  dry_run=False, assigned=None):
     """Assign short addresses to control gear
 
     If available_addresses is passed, only the specified addresses
@@ -161,6 +336,14 @@ def Commissioning(available_addresses=None, readdress=False,
 
     If "dry_run" is set then no short addresses will actually be set.
     This can be useful for testing.
+
+    Returns a dict of random address to the short address that was
+    assigned to the control gear found at that random address (or
+    would have been assigned, if "dry_run" is set).
+
+    If "assigned" is passed, it is that dict, and is filled in as each
+    short address is programmed: if the sequence fails partway through
+    it still holds the addresses that were assigned.
     """
     if available_addresses is None:
         available_addresses = list(range(64))
@@ -187,52 +370,81 @@ def Commissioning(available_addresses=None, readdress=False,
     yield Terminate()
     yield Initialise(broadcast=True if readdress else False)
 
+    search = _RandomAddressSearch()
+    if assigned is None:
+        assigned = {}
     finished = False
     # We loop here to cope with multiple devices picking the same
-    # random search address; when we discover that, we
-    # re-randomise and begin again.  Devices that have already
-    # received addresses are unaffected.
+    # random search address.  When short addresses are being
+    # programmed, clashing devices are withdrawn and the search
+    # carries on; afterwards only the gear that is still unaddressed
+    # is initialised again and picks new random addresses.  On a dry
+    # run there is no way to tell the clashing devices apart from the
+    # ones already found, so we re-randomise and begin again; devices
+    # that have already been withdrawn are unaffected.
     while not finished:
         yield Randomise()
         # Randomise can take up to 100ms
         yield sleep(0.1)
+        search.reset()
 
         low = 0
-        high = 0xffffff
-
+        clashes = 0
+        restart = False
         while low is not None:
-            yield progress(completed=low, size=high)
-            low = yield from _find_next(low, high)
-            if low == "clash":
-                yield progress(message="Multiple ballasts picked the same "
-                               "random address; restarting")
-                break
-            if low is None:
-                finished = True
+            yield progress(completed=low, size=0xffffff)
+            found = yield from search.find_next(low)
+            if found is None:
                 break
-            yield progress(
-                message=f"Ballast found at address {low:#x}")
-            if available_addresses:
-                new_addr = available_addresses.pop(0)
+            low, clash = found
+            # Program and withdraw need the search address to be
+            # exactly the random address that was found
+            yield from search.set_search_addr(low)
+            if clash:
                 if dry_run:
-                    yield progress(
-                        message="Not programming short address "
-                        f"{new_addr} because dry_run is set")
-                else:
-                    yield progress(
-                        message=f"Programming short address {new_addr}")
-                    yield ProgramShortAddress(new_addr)
-                    r = yield VerifyShortAddress(new_addr)
-                    if r.value is not True:
-                        raise ProgramShortAddressFailure(new_addr)
+                    yield progress(message="Multiple ballasts picked the "
+                                   "same random address; restarting")
+                    restart = True
+                    break
+                yield progress(message="Multiple ballasts picked the same "
+                               f"random address {low:#x}; will retry")
+                clashes += 1
             else:
                 yield progress(
-                    message="Device found but no short addresses left")
+                    message=f"Ballast found at address {low:#x}")
+                if available_addresses:
+                    new_addr = available_addresses.pop(0)
+                    if dry_run:
+                        yield progress(
+                            message="Not programming short address "
+                            f"{new_addr} because dry_run is set")
+                    else:
+                        yield progress(
+                            message=f"Programming short address {new_addr}")
+                        yield ProgramShortAddress(new_addr)
+                        r = yield VerifyShortAddress(new_addr)
+                        if r.value is not True:
+                            raise ProgramShortAddressFailure(new_addr)
+                    assigned[low] = new_addr
+                else:
+                    yield progress(
+                        message="Device found but no short addresses left")
             yield Withdraw()
-            if low < high:
-                low = low + 1
+            low = low + 1 if low < 0xffffff else None
+
+        if restart:
+            continue
+        finished = True
+        if clashes:
+            if available_addresses:
+                # Only the clashing gear is still unaddressed
+                yield Terminate()
+                yield Initialise(address=None)
+                finished = False
             else:
-                low = None
-                finished = True
+                yield progress(
+                    message=f"{clashes} random address clashes not "
+                    "resolved because no short addresses are left")
     yield Terminate()
     yield progress(message="Addressing complete")
+    return assigned
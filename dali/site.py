@@ -0,0 +1,178 @@
+"""
+Operations that span all the DALI buses of a site
+
+A site is a collection of asyncio drivers, one per DALI bus. The
+operations here run a sequence on every bus concurrently, so a site
+takes roughly as long as its slowest bus rather than the sum of all of
+them.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Mapping, Optional
+
+from dali.exceptions import DALIError
+from dali.sequences import Commissioning, progress as seq_progress
+
+_LOG = logging.getLogger("dali.site")
+
+
+@dataclass
+class BusCommissioningResult:
+    """
+    The outcome of commissioning one bus
+
+    * addresses: random address -> short address, for every control gear
+      that was assigned a short address by any attempt, including ones
+      that failed partway through
+    * attempts: the number of times the sequence was run on this bus
+    * error: the exception from the last attempt, or None if it succeeded
+    """
+
+    addresses: dict[int, int] = field(default_factory=dict)
+    attempts: int = 0
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class _SiteProgress:
+    """
+    Merges the progress reports of several buses into one stream
+
+    Messages are passed on prefixed with the name of the bus. Amounts of
+    progress are converted into a fraction of each bus, and reported as
+    the sum of those fractions in percent out of 100 per bus. A bus that
+    failed keeps the fraction it reached, so the site total only reaches
+    100% if every bus succeeded; the failed buses are listed in `failed`.
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        callback: Optional[Callable[[seq_progress], None]],
+    ):
+        self._callback = callback
+        self._fractions = {name: 0.0 for name in names}
+        self.failed: list[str] = []
+
+    def _report(self):
+        self._callback(seq_progress(
+            completed=round(sum(self._fractions.values()) * 100),
+            size=100 * len(self._fractions),
+        ))
+
+    def message(self, name: str, message: str):
+        if self._callback:
+            self._callback(seq_progress(message=f"{name}: {message}"))
+
+    def finished(self, name: str, ok: bool = True):
+        if ok:
+            self._fractions[name] = 1.0
+        else:
+            self.failed.append(name)
+        if self._callback:
+            self._report()
+
+    def summary(self):
+        if self._callback and self.failed:
+            self._callback(seq_progress(
+                message=f"{len(self.failed)} of {len(self._fractions)} "
+                f"buses failed: {', '.join(self.failed)}"))
+
+    def for_bus(self, name: str) -> Callable[[seq_progress], None]:
+        def _progress(p: seq_progress):
+            if self._callback is None:
+                return
+            if p.message:
+                self.message(name, p.message)
+            if p.completed is not None and p.size:
+                self._fractions[name] = min(p.completed / p.size, 1.0)
+                self._report()
+        return _progress
+
+
+async def commission_site(
+    buses: Mapping[str, Any] | Iterable[Any],
+    *,
+    progress: Optional[Callable[[seq_progress], None]] = None,
+    retries: int = 1,
+    max_concurrent: Optional[int] = None,
+    **kwargs,
+) -> dict[str, BusCommissioningResult]:
+    """
+    Run the Commissioning() sequence on many buses at once
+
+    :param buses: Either a mapping of bus name to driver, or an iterable
+    of drivers in which case each bus is named by str(driver). Any
+    driver with an async `run_sequence(seq, progress=...)` method can be
+    used.
+    :param progress: Called with `dali.sequences.progress` objects for
+    the whole site; messages are prefixed with the bus name. Buses that
+    failed don't count towards the total, and are listed in a message at
+    the end
+    :param retries: How many more times to try a bus whose sequence
+    raised an exception. Retries only address gear that is still
+    unaddressed, so they never undo a partially successful attempt.
+    :param max_concurrent: Limit on the number of buses commissioned at
+    the same time, or None for no limit
+    :param kwargs: Passed to `Commissioning()`
+    :return: A dict of bus name to BusCommissioningResult
+
+    Example:
+    ```
+    results = await commission_site(
+        {"floor1": driver1, "floor2": driver2}, progress=print)
+    for name, result in results.items():
+        print(name, result.ok, result.addresses)
+    ```
+    """
+    if isinstance(buses, Mapping):
+        buses = dict(buses)
+    else:
+        buses = {str(driver): driver for driver in buses}
+
+    site_progress = _SiteProgress(buses.keys(), progress)
+    semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+    results = {name: BusCommissioningResult() for name in buses}
+
+    async def _commission(name, driver):
+        result = results[name]
+        seq_kwargs = dict(kwargs)
+        while result.attempts <= retries:
+            result.attempts += 1
+            # Filled in as addresses are programmed, so a failed attempt
+            # still reports the gear it addressed
+            seq_kwargs["assigned"] = result.addresses
+            try:
+                await driver.run_sequence(
+                    Commissioning(**seq_kwargs),
+                    progress=site_progress.for_bus(name),
+                )
+            except (DALIError, OSError, asyncio.TimeoutError) as e:
+                _LOG.warning("Commissioning %s failed: %s", name, e)
+                result.error = e
+                site_progress.message(
+                    name, f"commissioning failed ({e!r})")
+                # Whatever happened, don't clear short addresses that
+                # were assigned by the failed attempt
+                seq_kwargs["readdress"] = False
+                continue
+            result.error = None
+            break
+        site_progress.finished(name, result.ok)
+
+    async def _limited(name, driver):
+        if semaphore is None:
+            return await _commission(name, driver)
+        async with semaphore:
+            return await _commission(name, driver)
+
+    await asyncio.gather(
+        *(_limited(name, driver) for name, driver in buses.items()))
+    site_progress.summary()
+    return results
@@ -1,16 +1,21 @@
 from __future__ import annotations
 
+import asyncio
 import random
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import Iterable, Optional, Type
 
 # Fake hardware for testing
 from dali import address, device, frame, gear
 from dali.command import Command
+from dali.driver.coalesce import CommandCoalescer
+from dali.driver.priority import PriorityLock
 from dali.gear.colour import QueryColourValueDTR
 from dali.memory import info, oem
 from dali.memory.location import MemoryType
-from dali.sequences import progress
+from dali.sequences import batch as seq_batch
+from dali.sequences import progress as seq_progress
+from dali.sequences import sleep as seq_sleep
 
 _yes = 0xff
 
@@ -130,6 +135,13 @@ class Gear:
         self.ct_mired_min = 153
         self.ct_mired_max = 370
         self.physical_minimum = 1
+        self.lamp_failure = False
+        self.power_on_level = 254
+        self.system_failure_level = 254
+        self.fade_time = 0
+        self.fade_rate = 7
+        self.extended_fade_time = 0
+        self.operating_mode = 0
         self.memory_banks = {}
         for fake_bank in memory_banks:
             bank_number = fake_bank.bank.address
@@ -226,6 +238,26 @@ class Gear:
             if self.level > 0:
                 if self.level < self.level_min:
                     self.level = self.level_min
+        elif isinstance(cmd, gear.general.SetPowerOnLevel):
+            self.power_on_level = self.dtr0
+        elif isinstance(cmd, gear.general.SetSystemFailureLevel):
+            self.system_failure_level = self.dtr0
+        elif isinstance(cmd, gear.general.SetFadeTime):
+            self.fade_time = min(self.dtr0, 15)
+        elif isinstance(cmd, gear.general.SetFadeRate):
+            self.fade_rate = min(max(self.dtr0, 1), 15)
+        elif isinstance(cmd, gear.general.SetExtendedFadeTime):
+            self.extended_fade_time = self.dtr0 & 0x7f
+        elif isinstance(cmd, gear.general.QueryPowerOnLevel):
+            return self.power_on_level
+        elif isinstance(cmd, gear.general.QuerySystemFailureLevel):
+            return self.system_failure_level
+        elif isinstance(cmd, gear.general.QueryFadeTimeFadeRate):
+            return (self.fade_time << 4) | self.fade_rate
+        elif isinstance(cmd, gear.general.QueryExtendedFadeTime):
+            return self.extended_fade_time
+        elif isinstance(cmd, gear.general.QueryOperatingMode):
+            return self.operating_mode
         elif isinstance(cmd, gear.general.QueryMaxLevel):
             return self.level_max
         elif isinstance(cmd, gear.general.QueryMinLevel):
@@ -239,6 +271,9 @@ class Gear:
                 self.shortaddr = (self.dtr0 & 0x7e) >> 1
         elif isinstance(cmd, gear.general.QueryControlGearPresent):
             return _yes
+        elif isinstance(cmd, gear.general.QueryLampFailure):
+            if self.lamp_failure:
+                return _yes
         elif isinstance(cmd, gear.general.QueryMissingShortAddress):
             if self.shortaddr is None:
                 return _yes
@@ -277,6 +312,8 @@ class Gear:
             if scene_level == 255:
                 # Don't change level if scene is MASK
                 return
+            elif scene_level == 0:
+                self.level = 0
             elif scene_level > self.level_max:
                 self.level = self.level_max
             elif scene_level < self.level_min:
@@ -313,7 +350,8 @@ class Gear:
                 self.withdrawn = False
                 # We don't implement the 15 minute timer
         elif isinstance(cmd, gear.general.Randomise):
-            self.randomaddr = frame.Frame(24, self._next_random_address())
+            if self.initialising:
+                self.randomaddr = frame.Frame(24, self._next_random_address())
         elif isinstance(cmd, gear.general.Compare):
             if self.initialising \
                and not self.withdrawn \
@@ -472,6 +510,10 @@ class Device:
         scheme: int
         filter: int = 0
         enabled: bool = True
+        priority: int = 4
+        primary_group: int = 0xFF
+        group_1: int = 0xFF
+        group_2: int = 0xFF
 
     # Creates 4 instances of pushbutton types, each set to Device/Instance mode
     _instances = [
@@ -488,15 +530,21 @@ class Device:
         shortaddr: Optional[address.DeviceShort] = None,
         groups: Optional[Iterable[address.DeviceGroup]] = None,
         memory_banks: Optional[Iterable[Type[FakeMemoryBank]]] = (FakeDeviceBank0,),
+        randomaddr: int = 0xFFFFFF,
     ):
         # Store parameters
         self.shortaddr = shortaddr
         self.groups = set(groups) if groups else set()
+        self.randomaddr = frame.Frame(24, randomaddr)
+        # Each device gets its own copy of the instances, so that
+        # configuring one device doesn't affect any other
+        self._instances = [replace(i) for i in self._instances]
         # Configure internal variables
         self.dtr0: int = 0
         self.dtr1: int = 0
         self.dtr2: int = 0
         self.enable_write_memory: bool = False
+        self.quiescent: bool = False
         self.memory_banks = {}
         for fake_bank in memory_banks:
             bank_number = fake_bank.bank.address
@@ -564,9 +612,36 @@ class Device:
                 elif isinstance(cmd, device.general.SetEventScheme):
                     self._instances[inst_num].scheme = self.dtr0
                 elif isinstance(cmd, device.general.QueryEventFilterZeroToSeven):
-                    return self._instances[inst_num].filter
+                    return self._instances[inst_num].filter & 0xFF
+                elif isinstance(cmd, device.general.QueryEventFilterEightToFifteen):
+                    return (self._instances[inst_num].filter >> 8) & 0xFF
+                elif isinstance(
+                    cmd, device.general.QueryEventFilterSixteenToTwentyThree
+                ):
+                    return (self._instances[inst_num].filter >> 16) & 0xFF
                 elif isinstance(cmd, device.general.SetEventFilter):
-                    self._instances[inst_num].filter = self.dtr0
+                    self._instances[inst_num].filter = \
+                        self.dtr0 | (self.dtr1 << 8) | (self.dtr2 << 16)
+                elif isinstance(cmd, device.general.EnableInstance):
+                    self._instances[inst_num].enabled = True
+                elif isinstance(cmd, device.general.DisableInstance):
+                    self._instances[inst_num].enabled = False
+                elif isinstance(cmd, device.general.QueryEventPriority):
+                    return self._instances[inst_num].priority
+                elif isinstance(cmd, device.general.SetEventPriority):
+                    self._instances[inst_num].priority = self.dtr0
+                elif isinstance(cmd, device.general.QueryPrimaryInstanceGroup):
+                    return self._instances[inst_num].primary_group
+                elif isinstance(cmd, device.general.SetPrimaryInstanceGroup):
+                    self._instances[inst_num].primary_group = self.dtr0
+                elif isinstance(cmd, device.general.QueryInstanceGroup1):
+                    return self._instances[inst_num].group_1
+                elif isinstance(cmd, device.general.SetInstanceGroup1):
+                    self._instances[inst_num].group_1 = self.dtr0
+                elif isinstance(cmd, device.general.QueryInstanceGroup2):
+                    return self._instances[inst_num].group_2
+                elif isinstance(cmd, device.general.SetInstanceGroup2):
+                    self._instances[inst_num].group_2 = self.dtr0
 
         # Command is either addressed to the entire device, or is a broadcast
         if isinstance(cmd, device.general.DTR0):
@@ -591,6 +666,16 @@ class Device:
             return self._device_status
         elif isinstance(cmd, device.general.QueryNumberOfInstances):
             return len(self._instances)
+        elif isinstance(cmd, device.general.StartQuiescentMode):
+            self.quiescent = True
+        elif isinstance(cmd, device.general.StopQuiescentMode):
+            self.quiescent = False
+        elif isinstance(cmd, device.general.QueryRandomAddressH):
+            return self.randomaddr[23:16]
+        elif isinstance(cmd, device.general.QueryRandomAddressM):
+            return self.randomaddr[15:8]
+        elif isinstance(cmd, device.general.QueryRandomAddressL):
+            return self.randomaddr[7:0]
 
         elif isinstance(cmd, device.general.EnableWriteMemory):
             self.enable_write_memory = True
@@ -641,9 +726,16 @@ class Bus:
     """
     def __init__(self, gear: list):
         self.gear: list = gear
+        # Number of frames seen on the bus, for tests and benchmarks
+        # that are concerned with bus usage
+        self.forward_frames = 0
+        self.backward_frames = 0
 
     def send(self, cmd):
+        self.forward_frames += 2 if cmd.sendtwice else 1
         r = [x for x in (i.send(cmd) for i in self.gear) if x is not None]
+        if r:
+            self.backward_frames += 1
         if len(r) > 1:
             rf = frame.BackwardFrameError(r[0])
         elif len(r) == 1:
@@ -664,5 +756,57 @@ class Bus:
             response = None
             if isinstance(cmd, Command):
                 response = self.send(cmd)
-            elif verbose and isinstance(cmd, progress):
+            elif isinstance(cmd, seq_batch):
+                response = [self.send(c) for c in cmd.commands]
+            elif verbose and isinstance(cmd, seq_progress):
                 print(cmd)
+
+
+class AsyncBus:
+    """An asyncio driver for a fake Bus
+
+    Implements the send() and run_sequence() methods of the asyncio
+    drivers, so that code written against a driver can be tested with
+    fake gear.  Each command takes 'delay' seconds to transmit.
+    """
+    def __init__(self, bus: Bus, delay: float = 0):
+        self.bus = bus
+        self.delay = delay
+        self.transaction_lock = PriorityLock()
+        self._coalescer = CommandCoalescer(self)
+
+    async def _send_raw(self, cmd):
+        await asyncio.sleep(self.delay)
+        return self.bus.send(cmd)
+
+    async def send(self, cmd, in_transaction=False):
+        if in_transaction:
+            return await self._send_raw(cmd)
+        async with self.transaction_lock:
+            return await self._send_raw(cmd)
+
+    async def send_coalesced(self, *commands):
+        return await self._coalescer.send(*commands)
+
+    async def run_sequence(self, seq, progress=None):
+        async with self.transaction_lock:
+            response = None
+            try:
+                while True:
+                    try:
+                        cmd = seq.send(response)
+                    except StopIteration as r:
+                        return r.value
+                    response = None
+                    if isinstance(cmd, seq_sleep):
+                        await asyncio.sleep(cmd.delay)
+                    elif isinstance(cmd, seq_progress):
+                        if progress:
+                            progress(cmd)
+                    elif isinstance(cmd, seq_batch):
+                        response = [
+                            await self._send_raw(c) for c in cmd.commands]
+                    else:
+                        response = await self._send_raw(cmd)
+            finally:
+                seq.close()
@@ -288,9 +288,7 @@ class DriverSerialDummy(DriverSerialBase):
         # Scan the bus for control devices, and create a mapping of addresses
         # to instance types
         if scan_dev_inst:
-            _LOG.info("Scanning DALI bus for control devices")
-            await self.run_sequence(self.dev_inst_map.autodiscover())
-            _LOG.info(f"Found {len(self.dev_inst_map.mapping)} instances")
+            self._start_scan_dev_inst()
 
     async def send(
         self, msg: command.Command, in_transaction: bool = False
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from dali.address import GearBroadcast, GearShort
+from dali.device import occupancy, pushbutton
+from dali.device.actions import ActionEngine, LatencyStats, occupied, vacant
+from dali.gear.general import DAPC, GoToScene, Off
+from dali.tests import fakes
+
+
+class RecordingBus(fakes.AsyncBus):
+    def __init__(self, gear, delay=0):
+        super().__init__(fakes.Bus(gear), delay)
+        self.sent = []
+
+    async def _send_raw(self, cmd):
+        self.sent.append(cmd)
+        return await super()._send_raw(cmd)
+
+
+def press(address=5, instance=0):
+    return pushbutton.ShortPress(short_address=address, instance_number=instance)
+
+
+def occupancy_event(is_occupied, repeat=False):
+    return occupancy.OccupancyEvent(
+        short_address=7, instance_number=0,
+        data=occupancy.OccupancyEvent.EventData(
+            movement=False, occupied=is_occupied, repeat=repeat))
+
+
+def test_rules_fire():
+    gear = [fakes.Gear(GearShort(1)), fakes.Gear(GearShort(2))]
+    gear[0].scenes[2] = 100
+    bus = RecordingBus(gear)
+    engine = ActionEngine(bus)
+    scene = engine.add_rule(
+        GoToScene(GearShort(1), 2),
+        short_address=5, event=pushbutton.ShortPress)
+    engine.add_rule(
+        [DAPC(GearShort(2), 200), DAPC(GearShort(1), 50)],
+        short_address=7, condition=occupied)
+    engine.add_rule(Off(GearBroadcast()), short_address=7, condition=vacant)
+    assert len(engine) == 3
+
+    async def run():
+        assert engine.feed(press()) == 1
+        assert engine.feed(press(address=6)) == 0
+        await engine.close()
+        assert gear[0].level == 100
+        assert engine.feed(occupancy_event(True)) == 1
+        await engine.close()
+        assert (gear[0].level, gear[1].level) == (50, 200)
+        # Repeats don't fire, in either direction
+        assert engine.feed(occupancy_event(True, repeat=True)) == 0
+        assert engine.feed(occupancy_event(False, repeat=True)) == 0
+        assert engine.feed(occupancy_event(False)) == 1
+        await engine.close()
+        assert (gear[0].level, gear[1].level) == (0, 0)
+
+    asyncio.run(run())
+    assert scene.fired == 1
+    assert len(engine.latency) == 3
+    assert len(engine.latency_sent) == 3
+    scene.remove()
+    assert len(engine) == 2
+
+
+def test_urgent_overtakes_background():
+    gear = [fakes.Gear(GearShort(1))]
+    bus = RecordingBus(gear, delay=0.001)
+    engine = ActionEngine(bus)
+    engine.add_rule(GoToScene(GearShort(1), 3), event=pushbutton.ShortPress)
+
+    async def run():
+        background = [
+            asyncio.create_task(bus.send(DAPC(GearShort(1), n)))
+            for n in range(1, 11)]
+        # Let the background sends queue up behind the first one
+        await asyncio.sleep(0)
+        engine.feed(press())
+        await asyncio.gather(*background)
+        await engine.close()
+
+    asyncio.run(run())
+    # Only the command already on the bus went first
+    assert isinstance(bus.sent[1], GoToScene)
+    assert len(bus.sent) == 11
+
+
+def test_condition_failure_does_not_fire():
+    engine = ActionEngine(RecordingBus([]))
+
+    def broken(ev):
+        raise ValueError
+
+    engine.add_rule(Off(GearBroadcast()), condition=broken)
+
+    async def run():
+        return engine.feed(press())
+
+    assert asyncio.run(run()) == 0
+
+
+def test_bus_traffic_and_watch():
+    bus = RecordingBus([fakes.Gear(GearShort(1))])
+    engine = ActionEngine(bus)
+    off = Off(GearShort(1))
+    engine.add_rule(off, event=pushbutton.ShortPress)
+
+    async def run():
+        engine.bus_traffic(None, press(), None, False)
+        engine.bus_traffic(None, Off(GearShort(1)), None, False)
+        queue = asyncio.Queue()
+        task = asyncio.create_task(engine.watch(queue))
+        queue.put_nowait(press())
+        queue.put_nowait(DAPC(GearShort(1), 10))
+        await asyncio.sleep(0)
+        task.cancel()
+        await engine.close()
+
+    asyncio.run(run())
+    assert bus.sent == [off, off]
+
+
+def test_empty_rule():
+    with pytest.raises(ValueError):
+        ActionEngine(None).add_rule([])
+
+
+def test_latency_stats():
+    stats = LatencyStats(max_samples=100)
+    assert stats.percentile(50) is None
+    for n in range(200):
+        stats.add(n / 1000)
+    assert len(stats) == 100
+    summary = stats.summary()
+    assert summary["p50"] == pytest.approx(0.150)
+    assert summary["p99"] == pytest.approx(0.199)
+    assert summary["max"] == pytest.approx(0.199)
@@ -0,0 +1,102 @@
+import pytest
+
+from dali.address import DeviceShort, GearShort
+from dali.memory import energy, info, oem
+from dali.exceptions import MemoryValueNotWriteable
+from dali.memory.bulk import read_raw_values, read_values, write_values
+from dali.tests import fakes
+from dali.tests.test_memory import FakeBank1, FakeBank202
+
+VALUES = [info.GTIN, info.FirmwareVersion, info.IdentificationNumber]
+
+
+def test_matches_individual_reads():
+    gear = [fakes.Gear(shortaddr=a) for a in range(16)]
+    bus = fakes.Bus(gear)
+    result = bus.run_sequence(read_values(range(16), VALUES))
+    columns = bus.forward_frames
+    assert sorted(result) == list(range(16))
+    bus.forward_frames = 0
+    for a in range(16):
+        for value in VALUES:
+            expected = bus.run_sequence(value.read(GearShort(a)))
+            assert result[a][value] == expected
+    # Locations 0x03..0x12 of bank 0 are contiguous: DTR1, one DTR0,
+    # then one read per byte per control gear
+    assert columns == 2 + 16 * 16
+    assert columns < bus.forward_frames
+
+
+def test_several_banks_with_latch():
+    gear = [fakes.Gear(shortaddr=a, memory_banks=(
+        fakes.FakeBank0, FakeBank1, FakeBank202)) for a in range(4)]
+    gear.append(fakes.Gear(shortaddr=4))
+    bus = fakes.Bus(gear)
+    values = [info.GTIN, energy.ActiveEnergy, oem.ManufacturerGTIN]
+    result = bus.run_sequence(read_values(
+        [GearShort(a) for a in range(5)], values))
+    for a in range(4):
+        for value in values:
+            assert result[a][value] == bus.run_sequence(
+                value.read(GearShort(a)))
+    # Gear without bank 202 leaves energy out of its results
+    assert energy.ActiveEnergy not in result[4]
+    assert result[4][info.GTIN] == result[0][info.GTIN]
+
+    raw = bus.run_sequence(read_raw_values(range(5), values))
+    assert raw[0][energy.ActiveEnergy] == bus.run_sequence(
+        energy.ActiveEnergy.read_raw(GearShort(0)))
+    assert energy.ActiveEnergy not in raw[4]
+
+
+def test_invalid_addresses():
+    with pytest.raises(TypeError):
+        list(read_values([GearShort(1), DeviceShort(1)],
+                         VALUES))
+    assert fakes.Bus([]).run_sequence(read_values([], VALUES)) == {}
+
+
+def _oem_gear(shortaddr):
+    return fakes.Gear(shortaddr=shortaddr, memory_banks=(
+        fakes.FakeBank0, FakeBank1))
+
+
+def test_write_values():
+    gear = [_oem_gear(a) for a in range(4)]
+    bus = fakes.Bus(gear)
+    wanted = {
+        oem.ManufacturerGTIN: 7654321234567,  # already set
+        oem.YearOfManufacture: 22,  # one byte differs
+        oem.LuminaireColor: "Red",
+    }
+    results = bus.run_sequence(write_values(range(4), wanted))
+    for a in range(4):
+        assert results[a].ok
+        assert results[a].unchanged == [oem.ManufacturerGTIN]
+        # "Red\0" replaces the start of "Octarine"
+        assert results[a].written == 1 + 4
+        for value, v in wanted.items():
+            assert bus.run_sequence(value.read(GearShort(a))) == v
+    # The bank is locked again afterwards
+    assert bus.run_sequence(oem.BANK_1.LockByte.read(0)) == 0xff
+
+    # Writing again changes nothing; only the current contents are
+    # read: DTR1, DTR0, 6 reads, DTR0, 1 read, DTR0, 24 reads
+    bus.forward_frames = 0
+    results = bus.run_sequence(write_values(range(4), wanted))
+    assert all(r.written == 0 for r in results.values())
+    assert bus.forward_frames == 4 * (2 + 6 + 1 + 1 + 1 + 24)
+
+
+def test_write_values_failures():
+    gear = [_oem_gear(0), fakes.Gear(shortaddr=1)]
+    # Gear 0 ignores writes to its lock byte, so stays locked
+    gear[0].memory_banks[1].unlock_value = 0x00
+    bus = fakes.Bus(gear)
+    results = bus.run_sequence(write_values(
+        [0, 1], {oem.YearOfManufacture: 22}))
+    assert results[0].failed == {oem.YearOfManufacture: "read back differs"}
+    assert not results[0].ok
+    assert results[1].ok and results[1].written == 1
+    with pytest.raises(MemoryValueNotWriteable):
+        list(write_values([0], {info.GTIN: 1}))
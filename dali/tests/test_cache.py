@@ -0,0 +1,121 @@
+import pytest
+
+from dali.address import DeviceShort, GearShort
+from dali.exceptions import MemoryLocationNotImplemented
+from dali.gear import general
+from dali.memory import info, oem
+from dali.memory.cache import MemoryCache
+from dali.tests import fakes
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _gear(shortaddr, serial):
+    g = fakes.Gear(shortaddr=shortaddr)
+    g.memory_banks[0].contents[0x12] = serial
+    return g
+
+
+def _read(bus, cache, addr, value):
+    before = bus.forward_frames
+    r = bus.run_sequence(cache.read(addr, value))
+    return r, bus.forward_frames - before
+
+
+def test_rom_cached_by_identity():
+    gear = [_gear(1, 1), _gear(2, 2)]
+    bus = fakes.Bus(gear)
+    cache = MemoryCache()
+    r, frames = _read(bus, cache, 1, info.FirmwareVersion)
+    assert r == bus.run_sequence(info.FirmwareVersion.read(1))
+    assert frames > 0
+    assert _read(bus, cache, GearShort(1), info.FirmwareVersion) == (r, 0)
+    assert cache.hits == 1 and cache.misses == 1
+
+    # Swapping short addresses: identities are read again, values stay
+    gear[0].shortaddr, gear[1].shortaddr = 2, 1
+    cache.observe(general.DTR0(0xff))
+    cache.observe(general.SetShortAddress(GearShort(1)))
+    assert _read(bus, cache, 2, info.FirmwareVersion)[0] == r
+    assert cache.hits == 2
+
+
+def test_ram_expires():
+    clock = Clock()
+    bus = fakes.Bus([_gear(1, 1)])
+    cache = MemoryCache(ttl=10, clock=clock)
+    # LockByte of bank 1 is RAM
+    value = oem.BANK_1.LockByte
+    _read(bus, cache, 1, value)
+    assert _read(bus, cache, 1, value)[1] == 0
+    clock.now = 11
+    assert _read(bus, cache, 1, value)[1] > 0
+
+
+def test_nvm_invalidated_by_writes():
+    bus = fakes.Bus([_gear(1, 1), _gear(2, 2)])
+    cache = MemoryCache()
+    assert bus.run_sequence(cache.read(1, oem.LuminaireColor)) == ""
+    bus.run_sequence(cache.read(2, oem.LuminaireColor))
+    bus.run_sequence(cache.read(1, info.GTIN))
+    assert len(cache) == 3
+    bus.run_sequence(cache.watch(oem.LuminaireColor.write(1, "red")))
+    # Both bus units may have had writing enabled; ROM is kept
+    assert len(cache) == 1
+    assert bus.run_sequence(cache.read(1, oem.LuminaireColor)) == "red"
+
+    bus.run_sequence(cache.read(2, oem.LuminaireColor))
+    cache.observe(general.DTR0(1))
+    cache.observe(general.ResetMemoryBank(GearShort(2)))
+    assert len(cache) == 2
+    _, frames = _read(bus, cache, 1, oem.LuminaireColor)
+    assert frames == 0
+
+
+def test_lru_and_unidentified():
+    bus = fakes.Bus([_gear(a, a) for a in range(4)])
+    cache = MemoryCache(max_entries=2)
+    for a in range(4):
+        bus.run_sequence(cache.read(a, info.FirmwareVersion))
+    assert len(cache) == 2
+    assert _read(bus, cache, 3, info.FirmwareVersion)[1] == 0
+    assert _read(bus, cache, 0, info.FirmwareVersion)[1] > 0
+
+    # Bus units that don't respond aren't cached
+    device = fakes.Device(DeviceShort(5), memory_banks=())
+    bus = fakes.Bus([device])
+    with pytest.raises(MemoryLocationNotImplemented):
+        bus.run_sequence(cache.read(DeviceShort(5), info.GTIN))
+    assert len(cache) == 2
+
+
+def test_swapped_gear_noticed_on_miss():
+    bus = fakes.Bus([_gear(1, 1)])
+    cache = MemoryCache()
+    _read(bus, cache, 1, info.FirmwareVersion)
+    bus.gear[0] = _gear(1, 99)
+    # A miss checks the identity before reading from the bus...
+    _read(bus, cache, 1, info.HardwareVersion)
+    assert bus.run_sequence(cache.identity(GearShort(1)))[2] == 99
+    # ...so the new unit's values aren't mixed with the old unit's
+    assert _read(bus, cache, 1, info.FirmwareVersion)[1] > 0
+    assert _read(bus, cache, 1, info.FirmwareVersion)[1] == 0
+
+
+def test_swapped_gear_noticed_after_identity_ttl():
+    clock = Clock()
+    bus = fakes.Bus([_gear(1, 1)])
+    cache = MemoryCache(identity_ttl=100, clock=clock)
+    _read(bus, cache, 1, info.FirmwareVersion)
+    bus.gear[0] = _gear(1, 99)
+    # Until the identity expires, the old unit's ROM values are returned
+    assert _read(bus, cache, 1, info.FirmwareVersion)[1] == 0
+    clock.now = 101
+    assert _read(bus, cache, 1, info.FirmwareVersion)[1] > 0
+    assert bus.run_sequence(cache.identity(GearShort(1)))[2] == 99
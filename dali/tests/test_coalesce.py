@@ -0,0 +1,109 @@
+import asyncio
+
+from dali.address import GearShort
+from dali.driver.coalesce import coalesce_key
+from dali.gear import colour
+from dali.gear.general import DAPC, DTR0, DTR1, DTR2, QueryActualLevel, SetMaxLevel
+from dali.tests import fakes
+
+
+class RecordingBus(fakes.AsyncBus):
+    def __init__(self, gear):
+        super().__init__(fakes.Bus(gear))
+        self.sent = []
+
+    async def _send_raw(self, cmd):
+        self.sent.append(cmd)
+        return await super()._send_raw(cmd)
+
+
+def test_coalesce_key():
+    assert coalesce_key([DAPC(GearShort(1), 10)]) == \
+        coalesce_key([DAPC(GearShort(1), 200)])
+    assert coalesce_key([DAPC(GearShort(1), 10)]) != \
+        coalesce_key([DAPC(GearShort(2), 10)])
+    assert coalesce_key([QueryActualLevel(GearShort(1))]) is None
+    assert coalesce_key([DTR0(10), SetMaxLevel(GearShort(1))]) is None
+    tc = [DTR0(0x70), DTR1(0x01),
+          colour.SetTemporaryColourTemperature(GearShort(3)),
+          colour.Activate(GearShort(3))]
+    assert coalesce_key(tc) == coalesce_key(
+        [DTR0(0x00), DTR1(0x02)] + tc[2:])
+    primary = [DTR0(0), DTR1(0), DTR2(0),
+               colour.SetTemporaryPrimaryNDimLevel(GearShort(3))]
+    assert coalesce_key(primary) != coalesce_key(
+        primary[:2] + [DTR2(1)] + primary[3:])
+
+
+def test_slider_drag():
+    gear = fakes.Gear(shortaddr=1)
+    bus = RecordingBus([gear])
+
+    async def drag():
+        async with bus.transaction_lock:
+            # The bus is busy while the slider moves
+            tasks = [asyncio.create_task(
+                bus.send_coalesced(DAPC(GearShort(1), level)))
+                for level in range(1, 201)]
+            await asyncio.sleep(0)
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(drag())
+    assert results == [None] * 200
+    assert len(bus.sent) == 1
+    assert gear.level == 200
+
+
+def test_queries_are_barriers():
+    gear = fakes.Gear(shortaddr=1)
+    bus = RecordingBus([gear])
+
+    async def run():
+        async with bus.transaction_lock:
+            tasks = [
+                asyncio.create_task(bus.send_coalesced(*cmds)) for cmds in (
+                    [DAPC(GearShort(1), 10)],
+                    [DAPC(GearShort(1), 20)],
+                    [QueryActualLevel(GearShort(1))],
+                    [DAPC(GearShort(1), 30)],
+                    [DAPC(GearShort(1), 40)],
+                    [DTR0(100), SetMaxLevel(GearShort(1))],
+                    [DTR0(100), SetMaxLevel(GearShort(1))],
+                )
+            ]
+            await asyncio.sleep(0)
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    assert results[2].value == 20
+    assert [type(c) for c in bus.sent] == [
+        DAPC, QueryActualLevel, DAPC, DTR0, SetMaxLevel, DTR0, SetMaxLevel]
+    assert gear.level == 40
+
+
+def test_activate_is_a_barrier():
+    bus = RecordingBus([fakes.Gear(shortaddr=1), fakes.Gear(shortaddr=3)])
+
+    async def run():
+        async with bus.transaction_lock:
+            tasks = [
+                asyncio.create_task(bus.send_coalesced(cmd)) for cmd in (
+                    colour.SetTemporaryColourTemperature(GearShort(3)),
+                    DAPC(GearShort(1), 10),
+                    colour.Activate(GearShort(3)),
+                    DAPC(GearShort(1), 20),
+                    colour.SetTemporaryColourTemperature(GearShort(3)),
+                )
+            ]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # Merging the newest colour temperature into the first would leave
+    # it after the Activate, never activated
+    assert [(type(c), c.destination.address) for c in bus.sent] == [
+        (colour.SetTemporaryColourTemperature, 3),
+        (colour.Activate, 3),
+        (DAPC, 1),
+        (colour.SetTemporaryColourTemperature, 3),
+    ]
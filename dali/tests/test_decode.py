@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from dali.exceptions import MemoryLocationNotImplemented
+from dali.memory import diagnostics, energy, info, maintenance, oem
+from dali.memory.decode import _GENERIC, DecodePlan
+from dali.memory.location import FlagValue
+
+BANKS = [
+    info.BANK_0, oem.BANK_1, energy.BANK_202, energy.BANK_203,
+    energy.BANK_204, diagnostics.BANK_205, diagnostics.BANK_206,
+    maintenance.BANK_207,
+]
+
+
+def _from_list(bank, data):
+    result = {}
+    for value in bank.values:
+        try:
+            result[value] = value.from_list(data)
+        except MemoryLocationNotImplemented:
+            pass
+    return result
+
+
+def _dumps(bank, n, rng):
+    size = max(loc.address for v in bank.values for loc in v.locations) + 1
+    for _ in range(n):
+        # Mostly random bytes, with some runs of 0xff and 0xfe to hit
+        # MASK and TMASK, and some missing locations
+        data = [rng.choice((rng.randrange(256), 0xff, 0xfe, None))
+                if rng.random() < 0.3 else rng.randrange(256)
+                for _ in range(size)]
+        yield data[:rng.randrange(size // 2, size + 1)]
+
+
+def test_matches_from_list():
+    rng = random.Random(42)
+    for bank in BANKS:
+        plan = bank.decode_plan()
+        assert plan is bank.decode_plan()
+        for data in _dumps(bank, 200, rng):
+            assert plan.decode(data) == _from_list(bank, data)
+
+
+def test_compiled():
+    kinds = {e.value: e.kind for e in diagnostics.BANK_205.decode_plan().entries}
+    assert kinds[diagnostics.ControlGearOperatingTime] != _GENERIC
+    assert kinds[diagnostics.ControlGearExternalSupplyVoltage] != _GENERIC
+    assert kinds[diagnostics.ControlGearTemperature] == _GENERIC
+    kinds = {e.value: e.kind for e in energy.BANK_202.decode_plan().entries}
+    assert kinds[energy.ActiveEnergy] != _GENERIC
+
+
+def test_decode_columns():
+    numpy = pytest.importorskip("numpy")
+    rng = random.Random(1)
+    for bank in BANKS:
+        size = max(
+            loc.address for v in bank.values for loc in v.locations) + 1
+        dumps = [[rng.choice((rng.randrange(256), 0xff, 0xfe))
+                  for _ in range(size)] for _ in range(50)]
+        present = [[rng.random() > 0.05 for _ in range(size)]
+                   for _ in range(50)]
+        columns = DecodePlan(bank).decode_columns(
+            numpy.array(dumps), numpy.array(present))
+        for row, (data, p) in enumerate(zip(dumps, present)):
+            expected = _from_list(
+                bank, [b if ok else None for b, ok in zip(data, p)])
+            for value, (values, valid) in columns.items():
+                e = expected.get(value)
+                ok = e is not None and not isinstance(e, FlagValue)
+                assert bool(valid[row]) == ok
+                if not ok:
+                    continue
+                if isinstance(e, (str, bool)):
+                    assert values[row] == e
+                else:
+                    assert float(values[row]) == pytest.approx(float(e))
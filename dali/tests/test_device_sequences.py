@@ -1,5 +1,6 @@
 import pytest
 
+from dali import frame
 from dali.address import DeviceShort, InstanceNumber
 from dali.command import NumericResponse, YesNoResponse
 from dali.device import pushbutton
@@ -19,6 +20,8 @@ from dali.device.general import (
 from dali.device.helpers import DeviceInstanceTypeMapper, check_bad_rsp
 from dali.device.pushbutton import InstanceEventFilter as EventFilter_pb
 from dali.device.sequences import (
+    ConfigureInstances,
+    InstanceConfig,
     QueryEventFilters,
     SetEventFilters,
     SetEventSchemes,
@@ -110,6 +113,111 @@ def test_device_autodiscover_skip_no_instances(fakes_bus):
     assert len(dev_inst_map.mapping) == 12
 
 
+def test_device_autodiscover_fingerprints(fakes_bus):
+    fakes_bus.gear[1].randomaddr = frame.Frame(24, 0x123456)
+    dev_inst_map = DeviceInstanceTypeMapper()
+    fakes_bus.run_sequence(dev_inst_map.autodiscover())
+    assert dev_inst_map.fingerprints == {
+        0: (0xFFFFFF, 4), 1: (0x123456, 4), 2: (0xFFFFFF, 4)}
+
+
+def test_device_instance_map_save_load(fakes_bus, tmp_path):
+    path = tmp_path / "dev_inst_map.json"
+    dev_inst_map = DeviceInstanceTypeMapper(path=path)
+    fakes_bus.run_sequence(dev_inst_map.autodiscover())
+    dev_inst_map.add_type(
+        short_address=9, instance_number=0, instance_type=pushbutton)
+    dev_inst_map.save()
+
+    loaded = DeviceInstanceTypeMapper.load(path)
+    assert loaded.path == path
+    assert loaded.mapping == dev_inst_map.mapping
+    assert loaded.fingerprints == dev_inst_map.fingerprints
+    # Types added by hand have no fingerprint
+    assert 9 not in loaded.fingerprints
+
+
+def test_device_instance_map_load_missing(tmp_path):
+    path = tmp_path / "missing.json"
+    loaded = DeviceInstanceTypeMapper.load(path)
+    assert loaded.mapping == {}
+    assert loaded.path == path
+
+    path.write_text("not json")
+    assert DeviceInstanceTypeMapper.load(path).mapping == {}
+
+
+class DeviceTwoInstances(fakes.Device):
+    _instances = [
+        fakes.Device.Instance(inst_type=3, scheme=2),
+        fakes.Device.Instance(inst_type=4, scheme=2),
+    ]
+
+
+def test_device_instance_map_refresh_unchanged(fakes_bus):
+    dev_inst_map = DeviceInstanceTypeMapper()
+    fakes_bus.run_sequence(dev_inst_map.autodiscover())
+    mapping = dict(dev_inst_map.mapping)
+
+    fakes_bus.forward_frames = 0
+    rescanned = fakes_bus.run_sequence(dev_inst_map.refresh())
+    assert rescanned == set()
+    assert dev_inst_map.mapping == mapping
+    # Quiescent mode on and off, four queries per device and one status
+    # query for each other address
+    assert fakes_bus.forward_frames == 2 * 2 + 3 * 4 + 61
+
+
+def test_device_instance_map_refresh_changed(fakes_bus):
+    dev_inst_map = DeviceInstanceTypeMapper()
+    fakes_bus.run_sequence(dev_inst_map.autodiscover())
+
+    # Replace device 1, and remove device 2 from the bus
+    fakes_bus.gear[1] = DeviceTwoInstances(
+        DeviceShort(1), memory_banks=(fakes.FakeBank0,), randomaddr=0x000102)
+    del fakes_bus.gear[2]
+
+    rescanned = fakes_bus.run_sequence(dev_inst_map.refresh())
+    assert rescanned == {1}
+    assert dev_inst_map.fingerprints[1] == (0x000102, 2)
+    assert dev_inst_map.get_type(short_address=1, instance_number=0) == 3
+    assert dev_inst_map.get_type(short_address=1, instance_number=1) == 4
+    assert dev_inst_map.get_type(short_address=1, instance_number=2) is None
+    # A device that doesn't respond keeps its entries
+    assert dev_inst_map.get_type(short_address=2, instance_number=3) == 1
+    assert len(dev_inst_map.mapping) == 10
+
+
+def test_device_instance_map_refresh_new_addresses(fakes_bus):
+    dev_inst_map = DeviceInstanceTypeMapper()
+    fakes_bus.run_sequence(dev_inst_map.autodiscover(addresses=[0, 1]))
+    assert len(dev_inst_map.mapping) == 8
+
+    rescanned = fakes_bus.run_sequence(
+        dev_inst_map.refresh(new_addresses=[2, 3]))
+    assert rescanned == {2, 3}
+    assert len(dev_inst_map.mapping) == 12
+    assert sorted(dev_inst_map.fingerprints) == [0, 1, 2]
+
+
+def test_device_instance_map_refresh_finds_new_device(fakes_bus):
+    dev_inst_map = DeviceInstanceTypeMapper()
+    fakes_bus.run_sequence(dev_inst_map.autodiscover())
+    fakes_bus.gear.append(DeviceTwoInstances(
+        DeviceShort(40), memory_banks=(fakes.FakeBank0,), randomaddr=0x000140))
+
+    rescanned = fakes_bus.run_sequence(dev_inst_map.refresh())
+    assert rescanned == {40}
+    assert dev_inst_map.fingerprints[40] == (0x000140, 2)
+    assert dev_inst_map.get_type(short_address=40, instance_number=1) == 4
+    assert len(dev_inst_map.mapping) == 14
+
+    # Without probing, only known devices are checked
+    fakes_bus.gear.append(DeviceTwoInstances(
+        DeviceShort(41), memory_banks=(fakes.FakeBank0,)))
+    assert fakes_bus.run_sequence(dev_inst_map.refresh(probe=False)) == set()
+
+
 def test_device_query_event_scheme(fakes_bus):
     rsp = fakes_bus.send(QueryEventScheme(DeviceShort(1), InstanceNumber(1)))
     assert isinstance(rsp, QueryEventSchemeResponse)
@@ -363,3 +471,79 @@ def test_query_input_values_10bit():
     except StopIteration as r:
         ret = r.value
     assert ret == 434
+
+
+def test_configure_instances(fakes_bus):
+    configs = {
+        (addr, inst): InstanceConfig(
+            scheme=EventScheme.instance_group,
+            filter=EventFilter_pb.short_press | EventFilter_pb.long_press_start,
+            priority=3,
+            group_1=inst,
+        )
+        for addr in range(3) for inst in range(4)
+    }
+    results = fakes_bus.run_sequence(ConfigureInstances(configs))
+    assert all(r.ok for r in results.values())
+    assert sorted(results[(1, 2)].written) == [
+        "filter", "group_1", "priority", "scheme"]
+    for addr in range(3):
+        for inst in range(4):
+            instance = fakes_bus.gear[addr]._instances[inst]
+            assert instance.scheme == EventScheme.instance_group
+            assert instance.filter == \
+                EventFilter_pb.short_press | EventFilter_pb.long_press_start
+            assert instance.priority == 3
+            assert instance.group_1 == inst
+            # Not asked for, so not changed
+            assert instance.group_2 == 0xFF
+
+
+def test_configure_instances_shares_dtrs(fakes_bus):
+    configs = {
+        (addr, inst): InstanceConfig(group_1=inst % 2, priority=3)
+        for addr in range(3) for inst in range(4)
+    }
+    fakes_bus.forward_frames = 0
+    fakes_bus.run_sequence(ConfigureInstances(configs))
+    # 24 queries, 3 DTR0 writes shared by 24 send-twice commands, and 24
+    # queries to read back
+    assert fakes_bus.forward_frames == 24 + 3 + 2 * 24 + 24
+
+
+def test_configure_instances_unchanged(fakes_bus):
+    fakes_bus.gear[0]._instances[1].group_2 = 7
+    configs = {
+        (0, 0): InstanceConfig(group_2=7),
+        (0, 1): InstanceConfig(group_2=7),
+    }
+    fakes_bus.forward_frames = 0
+    results = fakes_bus.run_sequence(ConfigureInstances(configs))
+    assert results[(0, 0)].written == ["group_2"]
+    assert results[(0, 1)].unchanged == ["group_2"]
+    # Two queries, one DTR0, one send-twice command and one read back
+    assert fakes_bus.forward_frames == 2 + 1 + 2 + 1
+
+    fakes_bus.forward_frames = 0
+    results = fakes_bus.run_sequence(ConfigureInstances(configs))
+    assert all(r.unchanged == ["group_2"] for r in results.values())
+    assert fakes_bus.forward_frames == 2
+
+
+def test_configure_instances_missing(fakes_bus):
+    results = fakes_bus.run_sequence(ConfigureInstances({
+        (0, 0): InstanceConfig(priority=2),
+        (5, 0): InstanceConfig(priority=2),
+    }))
+    assert results[(0, 0)].ok
+    assert results[(5, 0)].failed == ["priority"]
+    assert not results[(5, 0)].ok
+
+
+def test_configure_instances_bad_config():
+    with pytest.raises(ValueError):
+        list(ConfigureInstances({(0, 0): InstanceConfig(scheme=9)}))
+    with pytest.raises(ValueError):
+        list(ConfigureInstances({(0, 0): InstanceConfig(group_1=300)}))
+    with pytest.raises(TypeError):
+        list(ConfigureInstances({(0, 0): InstanceConfig(filter="all")}))
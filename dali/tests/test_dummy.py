@@ -17,6 +17,7 @@ details.
 You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
+import asyncio
 import os.path
 from typing import NamedTuple
 
@@ -192,3 +193,36 @@ async def test_dummy_sequence_device_types(dummy_driver):
         elif ad in range(10, 11):
             assert len(dev_types) == 1
             assert dev_types[0] == 7
+
+
+@pytest.mark.asyncio
+async def test_dummy_connect_scan_in_background(dummy_driver):
+    driver = dummy_driver.driver
+    await driver.connect(scan_dev_inst=True)
+    # 'connect()' returns before the scan has finished, and commands can be
+    # sent while it runs
+    scan = asyncio.create_task(driver.wait_dev_inst_scanned())
+    await driver.send(gear.general.GoToScene(address.GearShort(1), 11))
+    assert not scan.done()
+    await scan
+    # The dummy driver has no control devices
+    assert driver.dev_inst_map.mapping == {}
+    # Input devices are not silenced while the scan is interleaved with
+    # other traffic
+    assert "QuiescentMode" not in dummy_driver.log.read()
+
+
+@pytest.mark.asyncio
+async def test_dummy_connect_scan_fails(dummy_driver, caplog):
+    driver = dummy_driver.driver
+
+    async def broken_scan():
+        raise ValueError("broken")
+
+    driver.scan_dev_inst = broken_scan
+    await driver.connect(scan_dev_inst=True)
+    await driver.wait_dev_inst_scanned()
+    assert driver._dev_inst_scan.done()
+    # The exception was dealt with by the task, and logged
+    assert driver._dev_inst_scan.exception() is None
+    assert "Scanning for control devices failed" in caplog.text
@@ -0,0 +1,77 @@
+import asyncio
+
+from dali.address import DeviceShort
+from dali.device import pushbutton
+from dali.device.events import EventRouter
+from dali.device.light import LightEvent
+from dali.gear.general import Off
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, events):
+        self.calls.append(list(events))
+
+    @property
+    def events(self):
+        return [e for call in self.calls for e in call]
+
+
+def test_routing():
+    router = EventRouter()
+    by_address = Recorder()
+    by_class = Recorder()
+    by_group = Recorder()
+    by_instance = Recorder()
+    everything = Recorder()
+    router.subscribe(by_address, short_address=DeviceShort(5))
+    router.subscribe(by_class, event=pushbutton._PushbuttonEvent)
+    router.subscribe(by_group, instance_group=3,
+                     event=pushbutton.ShortPress)
+    router.subscribe(by_instance, short_address=5, instance_number=1)
+    handle = router.subscribe(everything)
+    assert len(router) == 5
+
+    press = pushbutton.ShortPress(short_address=5, instance_number=1)
+    group_press = pushbutton.ShortPress(instance_group=3)
+    group_release = pushbutton.ButtonReleased(instance_group=3)
+    light = LightEvent(short_address=6, instance_number=0, data=100)
+    router.dispatch([press, group_press, group_release, light])
+
+    assert by_address.events == [press]
+    assert by_class.events == [press, group_press, group_release]
+    assert by_group.events == [group_press]
+    assert by_instance.events == [press]
+    assert everything.calls == [[press, group_press, group_release, light]]
+    assert len(router.match(light)) == 1
+
+    handle.unsubscribe()
+    assert len(router) == 4
+    router.dispatch([light])
+    assert len(everything.calls) == 1
+
+
+def test_batched_per_tick():
+    router = EventRouter()
+    received = Recorder()
+    router.subscribe(received, event=pushbutton.ShortPress)
+
+    def failing(events):
+        raise RuntimeError("handler failed")
+    router.subscribe(failing)
+
+    async def main():
+        for n in range(3):
+            router.bus_traffic(
+                None, pushbutton.ShortPress(short_address=n), None, False)
+        router.bus_traffic(None, Off(1), None, False)
+        assert received.calls == []
+        await asyncio.sleep(0)
+        assert len(received.calls) == 1
+        router.feed(pushbutton.ShortPress(short_address=9))
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert [len(c) for c in received.calls] == [3, 1]
@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+import pytest
+
+from dali.driver.hid import hid, tridonic
+from dali.gear.colour import QueryColourStatus
+from dali.gear.general import EnableDeviceType, QueryActualLevel
+from dali.sequences import batch
+
+
+class _FakeSendRaw:
+    """Replaces _send_raw, recording the order of commands and how many
+    are in progress at once"""
+    def __init__(self, driver):
+        self.driver = driver
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, command):
+        self.sent.append(command)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return len(self.sent)
+
+
+def _run_batch(driver_class):
+    async def run():
+        driver = driver_class("/nonexistent")
+        fake = _FakeSendRaw(driver)
+        driver._send_raw = fake
+
+        def seq():
+            r = yield batch([QueryActualLevel(1), QueryColourStatus(2),
+                             QueryActualLevel(3)])
+            return r
+
+        return await driver.run_sequence(seq()), fake
+    return asyncio.run(run())
+
+
+def test_hid_batch_sequential():
+    responses, fake = _run_batch(hid)
+    assert [type(c) for c in fake.sent] == [
+        QueryActualLevel, EnableDeviceType, QueryColourStatus,
+        QueryActualLevel]
+    assert responses == [1, 3, 4]
+    assert fake.max_in_flight == 1
+
+
+class _FakeTransmit:
+    """Replaces tridonic._transmit, recording the order commands are
+    written in and how many are waiting for a response at once"""
+    def __init__(self, fail_on=None):
+        self.sent = []
+        self.waiting = 0
+        self.max_waiting = 0
+        self.cancelled = 0
+        self.fail_on = fail_on
+
+    async def _response(self, n):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.waiting -= 1
+        return n
+
+    async def __call__(self, command):
+        # Nothing may still be waiting to be written when the next
+        # command is
+        await asyncio.sleep(0)
+        if isinstance(command, self.fail_on or ()):
+            raise OSError("write failed")
+        self.sent.append(command)
+        return asyncio.ensure_future(self._response(len(self.sent)))
+
+
+def _run_tridonic_batch(fake):
+    async def run():
+        driver = tridonic("/nonexistent")
+        driver._transmit = fake
+
+        def seq():
+            r = yield batch([QueryActualLevel(1), QueryColourStatus(2),
+                             QueryActualLevel(3)])
+            return r
+
+        return await driver.run_sequence(seq())
+    return asyncio.run(run())
+
+
+def test_tridonic_batch_pipelined():
+    fake = _FakeTransmit()
+    responses = _run_tridonic_batch(fake)
+    # Written strictly in order, with the responses overlapping
+    assert [type(c) for c in fake.sent] == [
+        QueryActualLevel, EnableDeviceType, QueryColourStatus,
+        QueryActualLevel]
+    assert responses == [1, 3, 4]
+    assert fake.max_waiting > 1
+
+
+def test_tridonic_batch_failure_cancels_rest():
+    fake = _FakeTransmit(fail_on=QueryColourStatus)
+    with pytest.raises(OSError):
+        _run_tridonic_batch(fake)
+    # The commands already written stop waiting for their responses
+    assert [type(c) for c in fake.sent] == [QueryActualLevel, EnableDeviceType]
+    assert fake.cancelled == 2
+    assert fake.waiting == 0
+
+
+def test_tridonic_transmit_cancelled():
+    async def run():
+        driver = tridonic("/nonexistent")
+        r, w = os.pipe()
+        driver._f = w
+        driver.connected.set()
+        try:
+            tasks = [await driver._transmit(QueryActualLevel(1))
+                     for _ in range(2)]
+            assert os.read(r, 1024)
+            assert driver._command_semaphore.locked()
+            # Giving up on the responses frees the slots, even though
+            # the tasks never started
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            assert not driver._command_semaphore.locked()
+            assert driver._outstanding == {}
+        finally:
+            os.close(r)
+            os.close(w)
+
+    asyncio.run(run())
@@ -0,0 +1,77 @@
+import pytest
+
+from dali.address import DeviceShort, GearShort
+from dali.exceptions import MemoryLocationNotImplemented
+from dali.memory import energy, info, oem
+from dali.memory.image import ImageFile, MemoryImage, read_image
+from dali.tests import fakes
+from dali.tests.test_memory import FakeBank1, LatchTestBank203
+
+
+def test_read_image():
+    bus = fakes.Bus([
+        fakes.Gear(shortaddr=1, memory_banks=(
+            fakes.FakeBank0, FakeBank1, LatchTestBank203)),
+        fakes.Device(DeviceShort(2), memory_banks=(fakes.FakeBank0,)),
+    ])
+    image = bus.run_sequence(read_image(1))
+    assert image.banks == [0, 1, 203]
+    for bank in (info.BANK_0, oem.BANK_1):
+        values = bus.run_sequence(bank.read_all(1))
+        decoded = image.decode_all(bank)
+        # read_all() leaves out the last address and the lock byte
+        assert decoded[bank.LastAddress] == image.bank(bank.address)[0]
+        assert {k: decoded[k] for k in values} == values
+    # Read while latched
+    assert image.decode(energy.ApparentEnergy) == 150
+    assert image.bank(203)[2] == 0xff
+    assert image.bank(202) is None
+    with pytest.raises(MemoryLocationNotImplemented):
+        image.decode(energy.ActiveEnergy)
+
+    image = bus.run_sequence(read_image(DeviceShort(2)))
+    assert image.banks == [0]
+    assert image.decode(info.GTIN) == 1234567654321
+
+
+def test_pack():
+    image = MemoryImage.from_banks({0: [3, None, 1, 7], 5: []})
+    assert image.bank(0).to_list() == [3, None, 1, 7]
+    with pytest.raises(IndexError):
+        image.bank(0)[4]
+    assert MemoryImage(image.to_bytes()).bank(0).to_list() == [3, None, 1, 7]
+    assert len(image.bank(5)) == 0
+
+    # A bank can use every location from 0x00 to 0xff
+    full = [n & 0xff for n in range(256)]
+    full[0x80] = None
+    image = MemoryImage.from_banks({0: [0xff], 200: full, 201: [1]})
+    assert MemoryImage(image.to_bytes()).bank(200).to_list() == full
+    assert image.bank(201).to_list() == [1]
+    with pytest.raises(ValueError):
+        MemoryImage.from_banks({200: full + [0]})
+
+
+def test_image_file(tmp_path):
+    bus = fakes.Bus([fakes.Gear(shortaddr=a) for a in range(3)])
+    for g in bus.gear:
+        g.memory_banks[0].contents[0x12] = g.shortaddr
+    images = {(7, a): bus.run_sequence(read_image(GearShort(a)))
+              for a in range(3)}
+    images[(7, 0, True)] = MemoryImage.from_banks({0: [0]})
+    path = tmp_path / "site.img"
+    ImageFile.write(path, images)
+    with ImageFile(path) as f:
+        assert len(f) == 4
+        assert (7, 1) in f and (8, 1) not in f
+        for a in range(3):
+            assert f[(7, a)].decode(info.IdentificationNumber) == a
+        assert f.get(7, 0, device=True).banks == [0]
+        with pytest.raises(KeyError):
+            f[(7, 3)]
+        image = f[(7, 2)]
+    del image
+
+    path.write_bytes(b"not an image file")
+    with pytest.raises(ValueError):
+        ImageFile(path)
@@ -0,0 +1,96 @@
+from dali.address import GearGroup, GearShort
+from dali.gear import general
+from dali.gear.inventory import ReadInventory
+from dali.memory import info
+from dali.tests import fakes
+
+
+class CountingBus(fakes.Bus):
+    """Records the commands sent, for checking what was read"""
+    def __init__(self, gear):
+        super().__init__(gear)
+        self.sent = []
+
+    def send(self, cmd):
+        self.sent.append(cmd)
+        return super().send(cmd)
+
+    def count(self, cls):
+        return sum(isinstance(cmd, cls) for cmd in self.sent)
+
+
+def _bus():
+    gear = [fakes.Gear(shortaddr=a, groups={a % 2}, devicetypes=[6])
+            for a in (2, 7, 30)]
+    gear[1].scenes[3] = 100
+    gear[1].fade_time = 4
+    return gear, CountingBus(gear)
+
+
+def test_read_inventory():
+    gear, bus = _bus()
+    snapshot = bus.run_sequence(ReadInventory())
+    assert sorted(snapshot.gear) == [2, 7, 30]
+    g = snapshot[7]
+    assert g.device_types == [6]
+    assert g.groups == {1}
+    assert g.scenes[3] == 100
+    assert g.scenes[0] is None
+    assert g.fade_time == 4
+    assert g.fade_rate == 7
+    assert g.max_level == 254
+    assert g.bank0[info.GTIN] == 1234567654321
+    assert g.stale == set()
+    # One DTR1 for the bus and one DTR0 per control gear
+    assert bus.count(general.DTR1) == 1
+    assert bus.count(general.DTR0) == 3
+
+
+def test_refresh_volatile_only():
+    gear, bus = _bus()
+    snapshot = bus.run_sequence(ReadInventory())
+    gear[0].level = 50
+    bus.sent = []
+    refreshed = bus.run_sequence(ReadInventory(snapshot))
+    assert all(isinstance(cmd, general.QueryActualLevel) for cmd in bus.sent)
+    assert len(bus.sent) == 3
+    assert refreshed[2].actual_level == 50
+    assert snapshot[2].actual_level == 0
+
+
+def test_refresh_observed_traffic():
+    gear, bus = _bus()
+    snapshot = bus.run_sequence(ReadInventory())
+    commands = [
+        general.DTR0(20),
+        general.SetMinLevel(GearShort(30)),
+        general.AddToGroup(GearGroup(1), 5),
+    ]
+    for cmd in commands:
+        bus.send(cmd)
+        snapshot.observe(cmd)
+    assert snapshot[30].stale == {"min_level", "max_level"}
+    assert snapshot[7].stale == {"groups"}
+    assert snapshot[2].stale == set()
+    bus.sent = []
+    refreshed = bus.run_sequence(ReadInventory(snapshot))
+    assert refreshed[30].min_level == 20
+    assert refreshed[7].groups == {1, 5}
+    assert refreshed[30].stale == set()
+    assert bus.count(general.QuerySceneLevel) == 0
+    assert bus.count(general.ReadMemoryLocation) == 0
+
+
+def test_refresh_new_and_removed_gear():
+    gear, bus = _bus()
+    snapshot = bus.run_sequence(ReadInventory())
+    bus.gear.remove(gear[0])
+    new = fakes.Gear()
+    bus.gear.append(new)
+    cmd = general.ProgramShortAddress(12)
+    new.shortaddr = 12
+    snapshot.observe(cmd)
+    refreshed = bus.run_sequence(ReadInventory(snapshot))
+    assert sorted(refreshed.gear) == [7, 12, 30]
+    assert refreshed[12].bank0 is not None
+    assert refreshed.pending == set()
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from dali.address import GearBroadcast
+from dali.gear import general
+from dali.gear.levels import SetLevels, plan_levels
+from dali.tests import fakes
+
+
+def _verify(gear, targets, **kwargs):
+    """Run the planned commands on fake gear and check every level
+
+    Control gear not in targets must keep its level.  Returns the
+    commands that were sent.
+    """
+    bus = fakes.Bus(gear)
+    before = {g.shortaddr: g.level for g in gear}
+    groups = {g.shortaddr: set(g.groups) for g in gear}
+    commands = plan_levels(targets, groups=groups, present=before, **kwargs)
+    bus.run_sequence(SetLevels(targets, groups=groups, present=before,
+                               **kwargs))
+    for g in gear:
+        expected = targets.get(g.shortaddr, before[g.shortaddr])
+        assert g.level == expected, (g.shortaddr, commands)
+    return commands
+
+
+def test_all_but_three():
+    gear = [fakes.Gear(shortaddr=a) for a in range(64)]
+    targets = {a: 100 for a in range(64)}
+    targets[5] = 0
+    targets[6] = 200
+    targets[50] = 1
+    commands = _verify(gear, targets)
+    assert len(commands) == 4
+    assert commands[0].destination == GearBroadcast()
+
+
+def test_groups():
+    gear = [fakes.Gear(shortaddr=a, groups={a // 16}) for a in range(64)]
+    targets = {a: 50 + 50 * (a // 16) for a in range(64)}
+    targets[17] = 20
+    commands = _verify(gear, targets)
+    # Broadcast, three groups, one correction
+    assert len(commands) == 5
+
+
+def test_untouchable_gear():
+    gear = [fakes.Gear(shortaddr=a, groups={0}) for a in range(8)]
+    for g in gear:
+        g.level = 33
+    targets = {a: 100 for a in range(7)}
+    commands = _verify(gear, targets)
+    assert len(commands) == 7
+    assert not any(c.destination == GearBroadcast() for c in commands)
+
+
+def test_scenes():
+    gear = [fakes.Gear(shortaddr=a) for a in range(16)]
+    for g in gear:
+        g.scenes[4] = g.shortaddr * 10
+    scenes = {g.shortaddr: [None if s == 255 else s for s in g.scenes]
+              for g in gear}
+    targets = {a: a * 10 for a in range(16)}
+    commands = _verify(gear, targets, scenes=scenes)
+    assert len(commands) == 1
+    assert isinstance(commands[0], general.GoToScene)
+
+
+def test_unknown_scenes():
+    gear = [fakes.Gear(shortaddr=a) for a in range(16)]
+    for g in gear:
+        g.scenes[4] = g.shortaddr * 10
+    scenes = {g.shortaddr: [None if s == 255 else s for s in g.scenes]
+              for g in gear[:15]}
+    # Control gear 15 is not being set, and its scenes aren't known: a
+    # broadcast GoToScene could change its level
+    targets = {a: a * 10 for a in range(15)}
+    commands = _verify(gear, targets, scenes=scenes)
+    assert not any(isinstance(c, general.GoToScene) for c in commands)
+
+
+def test_random_plans():
+    rng = random.Random(1)
+    for _ in range(50):
+        gear = [fakes.Gear(shortaddr=a,
+                           groups=set(rng.sample(range(16), 2)))
+                for a in range(32)]
+        for g in gear:
+            g.level = rng.choice((0, 100))
+            g.scenes[0] = rng.choice((255, 0, 100, 200))
+        scenes = {g.shortaddr: [None if s == 255 else s for s in g.scenes]
+                  for g in gear}
+        targets = {a: rng.choice((0, 100, 200, 254))
+                   for a in rng.sample(range(32), rng.randrange(1, 33))}
+        commands = _verify(gear, targets, scenes=scenes)
+        assert len(commands) <= len(targets)
+
+
+def test_bad_level():
+    with pytest.raises(ValueError):
+        plan_levels({0: 255})
@@ -13,7 +13,12 @@ from dali.exceptions import (
 from dali.frame import BackwardFrame
 from dali.gear.general import DTR0, DTR1, ReadMemoryLocation
 from dali.memory import diagnostics, energy, info, maintenance, oem
-from dali.memory.location import FlagValue, MemoryBank, NumericValue
+from dali.memory.location import (
+    FlagValue,
+    MemoryBank,
+    NumericValue,
+    read_values,
+)
 from dali.tests import fakes
 
 
@@ -436,6 +441,41 @@ class TestMemory(unittest.TestCase):
         }
         self.assertEqual(values, expected)
 
+    def test_read_values(self):
+        wanted = [
+            info.GTIN, info.FirmwareVersion, info.Part102Version,
+            diagnostics.ControlGearOperatingTime,
+            diagnostics.ControlGearStartCounter,
+            diagnostics.ControlGearExternalSupplyVoltage,
+            oem.LuminaireColor,
+        ]
+        before = self.bus.forward_frames
+        values = self.bus.run_sequence(read_values(0, wanted))
+        frames = self.bus.forward_frames - before
+        for memory_value in wanted:
+            self.assertEqual(
+                values[memory_value],
+                self.bus.run_sequence(memory_value.read(0)))
+        # bank 0: DTR1, DTR0, 8 reads, DTR0 to skip a gap, 1 read
+        # bank 1: DTR1, DTR0, 24 reads
+        # bank 205: DTR1, latch (4 frames), DTR0, 9 reads, unlatch
+        # (2 frames)
+        self.assertEqual(frames, 12 + 26 + 17)
+
+        # Values that aren't implemented are left out
+        values = self.bus.run_sequence(read_values(
+            1, [oem.ManufacturerGTIN, oem.LuminaireColor]))
+        self.assertIn(oem.ManufacturerGTIN, values)
+        self.assertNotIn(oem.LuminaireColor, values)
+
+    def test_read_values_latch(self):
+        values = self.bus.run_sequence(read_values(
+            1, [energy.ApparentEnergy], use_latch=False))
+        self.assertEqual(values, {energy.ApparentEnergy: Decimal("100")})
+        values = self.bus.run_sequence(read_values(
+            1, [energy.ApparentEnergy]))
+        self.assertEqual(values, {energy.ApparentEnergy: Decimal("150")})
+
     def test_diagnostics(self):
         self._test_value(diagnostics.ControlGearDiagnosticBankVersion, 1)
         self._test_value(diagnostics.ControlGearOperatingTime, 3600)
@@ -0,0 +1,105 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from dali.memory import energy
+from dali.memory.metering import EnergyAggregator, RingBuffer, counter_delta
+from dali.tests import fakes
+from dali.tests.test_memory import FakeBank202, FakeBank203, FakeBank204
+
+
+def _raw(value, scale=0):
+    return scale.to_bytes(1, "big", signed=True) + value.to_bytes(6, "big")
+
+
+def test_counter_delta():
+    c = energy.ActiveEnergy
+    assert counter_delta(c, _raw(100), _raw(150)) == 50
+    assert counter_delta(c, _raw(100, -1), _raw(150, -1)) == Decimal("5")
+    # Wrap near the top of the range
+    top = c.max_value - 5
+    assert counter_delta(c, _raw(top), _raw(4)) == 10
+    # Reset lower down counts from zero
+    assert counter_delta(c, _raw(1000), _raw(4)) == 4
+    # Change of scale: 1000 to 4 * 10^3
+    assert counter_delta(c, _raw(1000), _raw(4, 3)) == 3000
+    assert counter_delta(c, _raw(4500), _raw(4, 3)) is None
+    # TMASK
+    assert counter_delta(c, _raw(100), _raw(0xfffffffffffe)) is None
+
+
+def test_ring_buffer():
+    b = RingBuffer(60, 3)
+    b.add(0, 1)
+    b.add(59, 1)
+    b.add(60, 5)
+    start, totals = b.snapshot(60)
+    assert start == -60
+    assert list(totals) == [0, 2, 5]
+    b.add(200, 7)
+    start, totals = b.snapshot(200)
+    assert start == 60
+    assert list(totals) == [5, 0, 7]
+    # Too old for the buffer
+    b.add(0, 100)
+    assert list(b.snapshot(200)[1]) == [5, 0, 7]
+
+
+def test_aggregator():
+    gear = [fakes.Gear(shortaddr=a, memory_banks=(
+        fakes.FakeBank0, FakeBank202)) for a in range(3)]
+    gear.append(fakes.Gear(shortaddr=3))
+    driver = fakes.AsyncBus(fakes.Bus(gear))
+    now = [1000.0]
+    aggregator = EnergyAggregator(
+        driver, range(4), groups={0: {1}, 1: {1, 2}}, clock=lambda: now[0])
+    active = energy.ActiveEnergy
+    assert asyncio.run(aggregator.poll()) == 3
+    assert aggregator.bus[active].total == 0
+
+    # Each gear's counter goes up by n kWh
+    for n, g in enumerate(gear[:3]):
+        g.memory_banks[202].contents[0x0a] += n
+    now[0] = 1060.0
+    asyncio.run(aggregator.poll())
+    assert aggregator.gear[1][active].total == 1000
+    assert aggregator.gear[2][active].total == 2000
+    assert aggregator.group[1][active].total == 1000
+    assert aggregator.group[2][active].total == 1000
+    assert aggregator.bus[active].total == 3000
+    start, per_minute = aggregator.bus[active].buffers[0].snapshot(now[0])
+    assert per_minute[-1] == 3000
+    assert len(per_minute) == 60
+    # 1000W for a minute, from each of three control gear
+    power = aggregator.bus[energy.ActivePower]
+    assert power.total == pytest.approx(3 * 1000 / 60)
+
+
+def test_aggregator_reads_columns():
+    values = [energy.ActiveEnergy, energy.ApparentEnergy,
+              energy.ActiveEnergyLoadside]
+    gear = [fakes.Gear(shortaddr=a, memory_banks=(
+        fakes.FakeBank0, FakeBank202, FakeBank203, FakeBank204))
+        for a in range(8)]
+    driver = fakes.AsyncBus(fakes.Bus(gear))
+    aggregator = EnergyAggregator(
+        driver, range(8), values=values, chunk=4, clock=lambda: 0.0)
+    assert asyncio.run(aggregator.poll()) == 8
+    for g in gear:
+        g.memory_banks[203].contents[0x0a] += 10
+    asyncio.run(aggregator.poll())
+    assert aggregator.bus[energy.ApparentEnergy].total == 8
+    assert aggregator.bus[energy.ActiveEnergy].total == 0
+
+    # Per bank and chunk of four: DTR1, DTR0, latch and unlatch (four
+    # frames each, as EnableWriteMemory is sent twice), then seven
+    # locations from each control gear
+    frames = driver.bus.forward_frames
+    asyncio.run(aggregator.poll())
+    assert driver.bus.forward_frames - frames == 2 * 3 * (10 + 7 * 4)
+
+
+def test_aggregator_bad_values():
+    with pytest.raises(ValueError):
+        EnergyAggregator(None, [], values=[energy.ActiveBankVersion])
@@ -0,0 +1,128 @@
+import asyncio
+import math
+import time
+
+from dali.exceptions import MissingResponse
+from dali.memory import diagnostics, maintenance
+from dali.memory.poller import DiagnosticsPoller, TimeSeries, default_schedule
+from dali.tests import fakes
+from dali.tests.test_memory import FakeBank205, FakeBank206, FakeBank207
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _bus():
+    return fakes.AsyncBus(fakes.Bus([
+        fakes.Gear(shortaddr=0, memory_banks=(
+            fakes.FakeBank0, FakeBank205, FakeBank206, FakeBank207)),
+        fakes.Gear(shortaddr=1),
+    ]))
+
+
+def test_default_schedule():
+    (_, fast), (_, slow) = default_schedule()
+    assert diagnostics.ControlGearTemperature in fast
+    assert diagnostics.ControlGearOverallFailureCondition in fast
+    assert diagnostics.ControlGearStartCounter in slow
+    assert maintenance.RatedMedianUsefulLifeOfLuminaire in slow
+    assert diagnostics.ControlGearDiagnosticBankVersion not in fast + slow
+
+
+def test_schedule():
+    clock = Clock()
+    driver = _bus()
+    poller = DiagnosticsPoller(driver, [0, 1], bus_share=1, clock=clock)
+    assert asyncio.run(poller.poll_once()) == 2
+    series = poller.series[0]
+    temperature = series[diagnostics.ControlGearTemperature]
+    assert len(temperature) == 1
+    assert temperature.latest()[1] == asyncio.run(driver.run_sequence(
+        diagnostics.ControlGearTemperature.read(0)))
+    # Gear 1 has no diagnostics banks, so is not polled again
+    assert poller.series[1] == {}
+    assert poller.next_due() == 60
+
+    assert asyncio.run(poller.poll_once()) == 0
+    clock.now = 61
+    frames = driver.bus.forward_frames
+    assert asyncio.run(poller.poll_once()) == 1
+    assert len(temperature) == 2
+    assert len(series[diagnostics.ControlGearStartCounter]) == 1
+    assert driver.bus.forward_frames > frames
+
+
+def test_budget():
+    driver = _bus()
+    driver.delay = 0.002
+    poller = DiagnosticsPoller(driver, [0], bus_share=0.25)
+    start = time.monotonic()
+    asyncio.run(poller.poll_once())
+    elapsed = time.monotonic() - start
+    busy = driver.bus.forward_frames * driver.delay
+    assert elapsed >= busy * 4 * 0.9
+
+
+def test_time_series():
+    s = TimeSeries(max_samples=3)
+    for n, value in enumerate([1, True, "MASK", 4]):
+        s.append(n, value)
+    assert len(s) == 3
+    assert list(s.times) == [1, 2, 3]
+    assert s.values[0] == 1 and math.isnan(s.values[1])
+    assert s.latest() == (3, 4)
+
+
+def test_switched_off_gear_is_polled_again():
+    clock = Clock()
+    driver = _bus()
+    gear = driver.bus.gear.pop(0)
+    poller = DiagnosticsPoller(driver, [0], bus_share=1, clock=clock)
+    # No answer at all isn't taken to mean the values are unsupported
+    assert asyncio.run(poller.poll_once()) == 0
+    assert isinstance(poller.errors[0], MissingResponse)
+    assert poller.series[0] == {}
+
+    driver.bus.gear.append(gear)
+    clock.now = 61
+    assert asyncio.run(poller.poll_once()) == 1
+    assert 0 not in poller.errors
+    assert len(poller.series[0][diagnostics.ControlGearTemperature]) == 1
+
+
+def test_one_transaction_per_bank():
+    driver = _bus()
+    sequences = []
+    run_sequence = driver.run_sequence
+
+    async def counting(seq, *args, **kwargs):
+        sequences.append(seq)
+        return await run_sequence(seq, *args, **kwargs)
+
+    driver.run_sequence = counting
+    poller = DiagnosticsPoller(driver, [0], bus_share=1)
+    assert asyncio.run(poller.poll_once()) == 1
+    # Banks 205, 206 and 207
+    assert len(sequences) == 3
+
+
+def test_waiting_for_the_bus_is_not_busy_time():
+    driver = _bus()
+    poller = DiagnosticsPoller(driver, [0], bus_share=0.5)
+
+    async def run():
+        async with driver.transaction_lock:
+            task = asyncio.create_task(poller.poll_once())
+            await asyncio.sleep(0.2)
+        start = time.monotonic()
+        await task
+        return time.monotonic() - start
+
+    # With no bus delay, holding the bus takes almost no time, so
+    # nothing is owed for the time spent waiting
+    assert asyncio.run(run()) < 0.1
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from dali.driver.priority import PriorityLock
+
+
+async def _take(lock, name, order, urgent=False):
+    if urgent:
+        async with lock.urgent():
+            order.append(name)
+            await asyncio.sleep(0)
+    else:
+        async with lock:
+            order.append(name)
+            await asyncio.sleep(0)
+
+
+def test_uncontended():
+    async def run():
+        lock = PriorityLock()
+        assert not lock.locked()
+        async with lock:
+            assert lock.locked()
+        assert not lock.locked()
+        async with lock.urgent():
+            assert lock.locked()
+        assert not lock.locked()
+
+    asyncio.run(run())
+
+
+def test_urgent_goes_first():
+    async def run():
+        lock = PriorityLock()
+        order = []
+        await lock.acquire()
+        tasks = [asyncio.create_task(_take(lock, n, order)) for n in "abc"]
+        await asyncio.sleep(0)
+        tasks += [
+            asyncio.create_task(_take(lock, n, order, urgent=True))
+            for n in "XY"]
+        await asyncio.sleep(0)
+        assert lock.waiting == 5
+        lock.release()
+        await asyncio.gather(*tasks)
+        assert not lock.locked()
+        return order
+
+    # Urgent waiters overtake normal ones; each queue is in order
+    assert asyncio.run(run()) == ["X", "Y", "a", "b", "c"]
+
+
+def test_cancelled_waiter():
+    async def run():
+        lock = PriorityLock()
+        order = []
+        await lock.acquire()
+        a = asyncio.create_task(_take(lock, "a", order))
+        b = asyncio.create_task(_take(lock, "b", order))
+        await asyncio.sleep(0)
+        a.cancel()
+        await asyncio.sleep(0)
+        assert lock.waiting == 1
+        lock.release()
+        await b
+        assert a.cancelled()
+        assert not lock.locked()
+        return order
+
+    assert asyncio.run(run()) == ["b"]
+
+
+def test_release_unlocked():
+    with pytest.raises(RuntimeError):
+        PriorityLock().release()
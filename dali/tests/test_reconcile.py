@@ -0,0 +1,99 @@
+from dali.address import GearBroadcast, GearGroup
+from dali.gear import general
+from dali.gear.inventory import ReadInventory
+from dali.gear.reconcile import GearConfig, Reconcile, plan_reconcile
+from dali.tests import fakes
+
+
+def _apply(gear, desired):
+    bus = fakes.Bus(gear)
+    snapshot = bus.run_sequence(ReadInventory())
+    commands = bus.run_sequence(Reconcile(desired, snapshot))
+    after = bus.run_sequence(ReadInventory())
+    return commands, after
+
+
+def _check(after, desired):
+    for address, config in desired.items():
+        g = after[address]
+        for name in ("groups", "fade_time", "fade_rate", "min_level",
+                     "max_level", "power_on_level", "system_failure_level"):
+            wanted = getattr(config, name)
+            if wanted is not None:
+                assert getattr(g, name) == wanted, (address, name)
+        for scene, level in (config.scenes or {}).items():
+            assert g.scenes[scene] == level, (address, scene)
+
+
+def test_reconcile_shared_values_use_broadcast():
+    gear = [fakes.Gear(shortaddr=a) for a in range(16)]
+    desired = {
+        a: GearConfig(max_level=200, power_on_level=200,
+                      scenes={0: 200, 1: None})
+        for a in range(16)
+    }
+    commands, after = _apply(gear, desired)
+    _check(after, desired)
+    # One DTR0, then max level, power on level and scene 0 to
+    # broadcast; scene 1 is already correct
+    assert len(commands) == 4
+    assert commands[0].frame == general.DTR0(200).frame
+    assert all(c.destination == GearBroadcast() for c in commands[1:])
+
+
+def test_reconcile_unchanged():
+    gear = [fakes.Gear(shortaddr=a, groups={1}) for a in range(4)]
+    desired = {a: GearConfig(groups={1}, max_level=254, fade_time=0)
+               for a in range(4)}
+    commands, _ = _apply(gear, desired)
+    assert commands == []
+
+
+def test_reconcile_uses_groups():
+    gear = [fakes.Gear(shortaddr=a, groups={a // 4}) for a in range(12)]
+    desired = {a: GearConfig(scenes={2: 100 if a < 8 else 50})
+               for a in range(12)}
+    # Gear 11 already has the right value, so group 2 can still be used
+    gear[11].scenes[2] = 50
+    commands, after = _apply(gear, desired)
+    _check(after, desired)
+    dests = [c.destination for c in commands
+             if isinstance(c, general.SetScene)]
+    assert GearGroup(0) in dests
+    assert GearGroup(1) in dests
+    assert GearGroup(2) in dests
+    assert len(dests) == 3
+
+
+def test_reconcile_groups_and_limits():
+    gear = [fakes.Gear(shortaddr=a, groups={0, 3}) for a in range(6)]
+    for g in gear:
+        g.level_min = 100
+        g.level_max = 150
+    desired = {
+        0: GearConfig(groups={0, 5}, min_level=20, max_level=50),
+        1: GearConfig(groups={0, 5}, min_level=200, max_level=250),
+        2: GearConfig(groups=set(), fade_time=3, fade_rate=3),
+    }
+    commands, after = _apply(gear, desired)
+    _check(after, desired)
+    # Control gear not mentioned keeps its configuration
+    for a in range(3, 6):
+        assert after[a].groups == {0, 3}
+        assert after[a].min_level == 100
+        assert after[a].max_level == 150
+    # DTR0 is written once per distinct value
+    values = [c.param for c in commands if isinstance(c, general.DTR0)]
+    assert len(values) == len(set(values))
+
+
+def test_plan_reconcile_stale_values_written():
+    gear = [fakes.Gear(shortaddr=0)]
+    bus = fakes.Bus(gear)
+    snapshot = bus.run_sequence(ReadInventory())
+    desired = {0: GearConfig(max_level=254)}
+    assert plan_reconcile(desired, snapshot) == []
+    snapshot[0].stale.add("max_level")
+    commands = plan_reconcile(desired, snapshot)
+    assert [c.frame for c in commands] == [
+        general.DTR0(254).frame, general.SetMaxLevel(GearBroadcast()).frame]
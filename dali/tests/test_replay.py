@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from dali import sequences
+from dali.address import GearBroadcast, GearGroup, GearShort
+from dali.exceptions import DALISequenceError
+from dali.gear import general
+from dali.replay import ReplayProgram, record
+from dali.tests import fakes
+
+
+def _program_scenes():
+    yield sequences.progress(message="Programming scenes")
+    for scene in range(4):
+        yield general.DTR0(scene * 50)
+        yield general.SetScene(GearGroup(2), scene)
+    yield sequences.sleep(0.01)
+    # A query whose answer isn't used
+    yield general.QueryActualLevel(GearShort(0))
+
+
+def test_record_and_replay():
+    program = record(_program_scenes)
+    assert program.replayable
+    assert len(program.commands) == 9
+
+    gear = [fakes.Gear(shortaddr=a, groups={2}) for a in range(3)]
+    bus = fakes.Bus(gear)
+    responses = bus.run_sequence(program.sequence())
+    assert len(responses) == 1
+    for g in gear:
+        assert g.scenes[:4] == [0, 50, 100, 150]
+
+
+def test_replay_async_buses():
+    program = record(
+        lambda: sequences.SetGroups(GearBroadcast(), {1, 3}))
+    assert program.replayable
+    buses = [fakes.AsyncBus(fakes.Bus([fakes.Gear(shortaddr=0)]))
+             for _ in range(3)]
+
+    async def run():
+        await asyncio.gather(
+            *(b.run_sequence(program.sequence()) for b in buses))
+
+    asyncio.run(run())
+    for b in buses:
+        assert b.bus.gear[0].groups == {1, 3}
+
+
+def test_branching_sequence_refused():
+    # SetGroups on a short address reads the current groups first
+    gear = [fakes.Gear(shortaddr=0, groups={1})]
+    program = record(
+        lambda: sequences.SetGroups(GearShort(0), {1, 3}),
+        bus=fakes.Bus(gear))
+    assert not program.replayable
+    assert program.branching_steps
+    assert all(isinstance(program.steps[n].command,
+                          (general.QueryGroupsZeroToSeven,
+                           general.QueryGroupsEightToFifteen))
+               for n in program.branching_steps)
+    with pytest.raises(DALISequenceError):
+        program.sequence()
+    with pytest.raises(DALISequenceError):
+        program.to_bytes()
+
+
+def test_pack_roundtrip():
+    program = record(_program_scenes)
+    data = program.to_bytes()
+    loaded = ReplayProgram.from_bytes(data)
+    assert len(loaded) == len(program)
+    for a, b in zip(program.steps, loaded.steps):
+        if a.command is not None:
+            assert type(a.command) is type(b.command)
+            assert a.command.frame == b.command.frame
+        elif a.sleep is not None:
+            assert a.sleep.delay == b.sleep.delay
+        else:
+            assert a.progress.message == b.progress.message
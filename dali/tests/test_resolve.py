@@ -0,0 +1,138 @@
+import asyncio
+
+from dali.address import DeviceShort
+from dali.command import Command
+from dali.device import pushbutton
+from dali.device.general import AmbiguousInstanceType, QueryInstanceType
+from dali.device.helpers import DeviceInstanceTypeMapper
+from dali.driver.resolve import InstanceTypeResolver
+from dali.frame import Frame
+from dali.tests import fakes
+
+# A short press from device 1, instance 1, using the Device/Instance scheme
+SHORT_PRESS = Frame(24, data=0b000000101000010000000010)
+
+
+class RecordingBus(fakes.AsyncBus):
+    def __init__(self, gear):
+        super().__init__(fakes.Bus(gear))
+        self.sent = []
+
+    async def _send_raw(self, cmd):
+        self.sent.append(cmd)
+        return await super()._send_raw(cmd)
+
+
+def _ambiguous():
+    ev = Command.from_frame(SHORT_PRESS)
+    assert isinstance(ev, AmbiguousInstanceType)
+    return ev
+
+
+def test_resolve_once():
+    bus = RecordingBus([fakes.Device(DeviceShort(1))])
+    dev_inst_map = DeviceInstanceTypeMapper()
+    resolver = InstanceTypeResolver(bus, dev_inst_map, idle=0)
+    emitted = []
+
+    async def run():
+        for _ in range(3):
+            resolver.hold(_ambiguous(), emitted.append)
+        # Nothing is passed on until the type is known
+        assert emitted == []
+        assert resolver.pending == 3
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert len(bus.sent) == 1
+    assert isinstance(bus.sent[0], QueryInstanceType)
+    assert dev_inst_map.get_type(short_address=1, instance_number=1) == 1
+    assert len(emitted) == 3
+    assert all(isinstance(ev, pushbutton.ShortPress) for ev in emitted)
+    assert resolver.pending == 0
+
+
+def test_resolve_known_passes_straight_through():
+    bus = RecordingBus([])
+    dev_inst_map = DeviceInstanceTypeMapper()
+    dev_inst_map.add_type(
+        short_address=1, instance_number=1, instance_type=pushbutton)
+    resolver = InstanceTypeResolver(bus, dev_inst_map)
+    emitted = []
+
+    async def run():
+        resolver.hold(_ambiguous(), emitted.append)
+
+    asyncio.run(run())
+    assert isinstance(emitted[0], pushbutton.ShortPress)
+    assert bus.sent == []
+
+
+def test_resolve_waits_for_bus():
+    bus = RecordingBus([fakes.Device(DeviceShort(1))])
+    resolver = InstanceTypeResolver(
+        bus, DeviceInstanceTypeMapper(), idle=0.005)
+    emitted = []
+
+    async def run():
+        async with bus.transaction_lock:
+            resolver.hold(_ambiguous(), emitted.append)
+            await asyncio.sleep(0.03)
+            # Still waiting for the bus to be free
+            assert bus.sent == []
+        await asyncio.sleep(0.03)
+
+    asyncio.run(run())
+    assert len(bus.sent) == 1
+    assert isinstance(emitted[0], pushbutton.ShortPress)
+
+
+def test_resolve_no_answer():
+    bus = RecordingBus([])
+    resolver = InstanceTypeResolver(
+        bus, DeviceInstanceTypeMapper(), idle=0, retry_after=60)
+    emitted = []
+
+    async def run():
+        resolver.hold(_ambiguous(), emitted.append)
+        await asyncio.sleep(0.01)
+        assert len(emitted) == 1
+        # Not asked again until retry_after has passed
+        resolver.hold(_ambiguous(), emitted.append)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert len(bus.sent) == 1
+    assert len(emitted) == 2
+    assert all(isinstance(ev, AmbiguousInstanceType) for ev in emitted)
+
+
+def test_resolve_max_held():
+    bus = RecordingBus([fakes.Device(DeviceShort(1))])
+    resolver = InstanceTypeResolver(
+        bus, DeviceInstanceTypeMapper(), idle=0, max_held=2)
+    emitted = []
+
+    async def run():
+        for _ in range(5):
+            resolver.hold(_ambiguous(), emitted.append)
+        assert resolver.pending == 2
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert len(emitted) == 2
+
+
+def test_resolve_close():
+    bus = RecordingBus([fakes.Device(DeviceShort(1))])
+    resolver = InstanceTypeResolver(bus, DeviceInstanceTypeMapper(), idle=1)
+    emitted = []
+
+    async def run():
+        resolver.hold(_ambiguous(), emitted.append)
+        await resolver.close()
+
+    asyncio.run(run())
+    assert bus.sent == []
+    assert len(emitted) == 1
+    assert isinstance(emitted[0], AmbiguousInstanceType)
@@ -2,6 +2,7 @@ import unittest
 from dali.tests import fakes
 from dali import sequences
 from dali import address
+from dali.gear import general as gear
 
 
 class TestSequences(unittest.TestCase):
@@ -85,6 +86,35 @@ class TestSequences(unittest.TestCase):
                 self.assertIn(g.shortaddr, available)
         self.assertEqual(missed, 5)
 
+    def test_commissioning_clash_only_rerandomises_unresolved(self):
+        # The gear that didn't clash must not be asked to pick a new
+        # random address: they only have one preloaded
+        randoms = list(range(0x10000, 0xffffff, 0x100000))
+        gear = [fakes.Gear(random_preload=[x]) for x in randoms]
+        gear[3].random_preload.append(0x654321)
+        gear.append(fakes.Gear(random_preload=[randoms[3], 0x123456]))
+        bus = fakes.Bus(gear)
+        bus.run_sequence(sequences.Commissioning())
+        self._check_addresses(gear)
+        for i, (g, x) in enumerate(zip(gear, randoms)):
+            if i != 3:
+                self.assertEqual(g.randomaddr.as_integer, x)
+        self.assertEqual(gear[3].randomaddr.as_integer, 0x654321)
+        self.assertEqual(gear[-1].randomaddr.as_integer, 0x123456)
+
+    def test_commissioning_frame_count(self):
+        # The search only sends search address bytes that have
+        # changed, and reuses earlier Compare results, so
+        # commissioning a full bus must stay well under the ~10000
+        # frames taken by a plain binary search from the top of the
+        # address space for every device.
+        gear = [fakes.Gear(random_preload=[x])
+                for x in range(0x1234, 0xffffff, 0x40000)]
+        bus = fakes.Bus(gear)
+        bus.run_sequence(sequences.Commissioning())
+        self._check_addresses(gear)
+        self.assertLess(bus.forward_frames, 5000)
+
     def test_query_groups(self):
         gear = [fakes.Gear(shortaddr=x, groups={x}) for x in range(0, 16)]
         bus = fakes.Bus(gear)
@@ -104,6 +134,68 @@ class TestSequences(unittest.TestCase):
             bus.run_sequence(sequences.SetGroups(i, tp))
             self.assertEqual(bus.run_sequence(sequences.QueryGroups(i)), tp)
 
+    def test_batch(self):
+        units = [fakes.Gear(shortaddr=x) for x in range(4)]
+        units[2].level = 100
+        bus = fakes.Bus(units)
+
+        def seq():
+            responses = yield sequences.batch(
+                gear.QueryActualLevel(x) for x in range(5))
+            return [r.raw_value.as_integer if r.raw_value else None
+                    for r in responses]
+
+        self.assertEqual(bus.run_sequence(seq()), [0, 0, 100, 0, None])
+        self.assertEqual(bus.forward_frames, 5)
+
+    def _yes_bus(self, failing):
+        # 32 gear in four groups of eight
+        gear = [fakes.Gear(shortaddr=x, groups={x // 8}) for x in range(32)]
+        for x in failing:
+            gear[x].lamp_failure = True
+        groups = {g.shortaddr: set(g.groups) for g in gear}
+        return fakes.Bus(gear), groups
+
+    def test_find_yes_responders_none(self):
+        bus, groups = self._yes_bus([])
+        r = bus.run_sequence(sequences.FindYesResponders(
+            gear.QueryLampFailure, groups=groups))
+        self.assertEqual(r, set())
+        self.assertEqual(bus.forward_frames, 1)
+
+    def test_find_yes_responders(self):
+        bus, groups = self._yes_bus([3, 5, 30])
+        r = bus.run_sequence(sequences.FindYesResponders(
+            gear.QueryLampFailure, groups=groups,
+            addresses=range(32)))
+        self.assertEqual(r, {3, 5, 30})
+        # Broadcast, the four groups, then the eight shorts of each of
+        # the two groups that answered
+        self.assertEqual(bus.forward_frames, 1 + 4 + 16)
+
+    def test_find_yes_responders_one_group(self):
+        bus, groups = self._yes_bus([3])
+        r = bus.run_sequence(sequences.FindYesResponders(
+            gear.QueryLampFailure, groups=groups,
+            addresses=range(32)))
+        self.assertEqual(r, {3})
+        # Broadcast, the four groups, and the eight shorts of the group
+        # that answered; the other groups rule out their members
+        self.assertEqual(bus.forward_frames, 1 + 4 + 8)
+
+    def test_find_yes_responders_without_groups(self):
+        bus, _ = self._yes_bus([0, 31])
+        r = bus.run_sequence(sequences.FindYesResponders(
+            gear.QueryLampFailure))
+        self.assertEqual(r, {0, 31})
+        r = bus.run_sequence(sequences.FindYesResponders(
+            gear.QueryControlGearPresent))
+        self.assertEqual(r, set(range(32)))
+
+    def test_find_yes_responders_bad_query(self):
+        with self.assertRaises(ValueError):
+            next(sequences.FindYesResponders(gear.QueryActualLevel))
+
 
 if __name__ == '__main__':
     unittest.main()
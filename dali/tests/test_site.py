@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from dali.exceptions import DALIError
+from dali.site import commission_site
+from dali.tests import fakes
+
+
+class FailingOnceBus(fakes.AsyncBus):
+    """Fails partway through the first sequence it is asked to run"""
+    def __init__(self, bus, fail_after):
+        super().__init__(bus)
+        self.fail_after = fail_after
+
+    async def _send_raw(self, cmd):
+        if self.fail_after is not None:
+            self.fail_after -= 1
+            if self.fail_after < 0:
+                self.fail_after = None
+                raise DALIError("simulated bus failure")
+        return await super()._send_raw(cmd)
+
+
+def _buses(sizes, delay=0):
+    return {
+        f"bus{n}": fakes.AsyncBus(
+            fakes.Bus([fakes.Gear() for _ in range(size)]), delay=delay)
+        for n, size in enumerate(sizes)
+    }
+
+
+def test_commission_site():
+    buses = _buses([1, 4, 8])
+    results = asyncio.run(commission_site(buses))
+    assert set(results) == set(buses)
+    for name, driver in buses.items():
+        result = results[name]
+        assert result.ok
+        assert result.attempts == 1
+        gear = driver.bus.gear
+        assert sorted(g.shortaddr for g in gear) == list(range(len(gear)))
+        assert result.addresses == {
+            g.randomaddr.as_integer: g.shortaddr for g in gear}
+
+
+def test_commission_site_iterable_names():
+    driver = fakes.AsyncBus(fakes.Bus([fakes.Gear()]))
+    results = asyncio.run(commission_site([driver]))
+    assert list(results) == [str(driver)]
+
+
+def test_commission_site_concurrent():
+    # Four buses of equal size should take about as long as one
+    delay = 0.001
+    start = time.monotonic()
+    asyncio.run(commission_site(_buses([2], delay=delay)))
+    single = time.monotonic() - start
+    start = time.monotonic()
+    asyncio.run(commission_site(_buses([2] * 4, delay=delay)))
+    multiple = time.monotonic() - start
+    assert multiple < single * 2.5
+
+
+def test_commission_site_progress():
+    reports = []
+    asyncio.run(commission_site(_buses([2, 2]), progress=reports.append))
+    assert any(p.message and p.message.startswith("bus1: ")
+               for p in reports)
+    totals = [p for p in reports if p.completed is not None]
+    assert all(p.size == 200 for p in totals)
+    assert totals[-1].completed == 200
+
+
+def test_commission_site_retry():
+    gear = [fakes.Gear() for _ in range(4)]
+    driver = FailingOnceBus(fakes.Bus(gear), fail_after=200)
+    results = asyncio.run(commission_site({"flaky": driver}))
+    result = results["flaky"]
+    assert result.ok
+    assert result.attempts == 2
+    assert sorted(g.shortaddr for g in gear) == list(range(4))
+    # Including the gear addressed by the attempt that failed
+    assert result.addresses == {
+        g.randomaddr.as_integer: g.shortaddr for g in gear}
+
+
+def test_commission_site_gives_up():
+    driver = FailingOnceBus(fakes.Bus([fakes.Gear()]), fail_after=0)
+    results = asyncio.run(commission_site({"flaky": driver}, retries=0))
+    assert not results["flaky"].ok
+    assert isinstance(results["flaky"].error, DALIError)
+    assert results["flaky"].attempts == 1
+
+
+def test_commission_site_failed_progress():
+    buses = _buses([2])
+    buses["flaky"] = FailingOnceBus(fakes.Bus([fakes.Gear()]), fail_after=0)
+    reports = []
+    results = asyncio.run(commission_site(
+        buses, progress=reports.append, retries=0))
+    assert not results["flaky"].ok
+    totals = [p for p in reports if p.size]
+    # Only the bus that succeeded counts as finished
+    assert totals[-1].completed < totals[-1].size
+    assert reports[-1].message == "1 of 2 buses failed: flaky"
@@ -0,0 +1,307 @@
+import asyncio
+
+import pytest
+
+from dali.address import DeviceShort
+from dali.device import pushbutton
+from dali.device.general import (
+    QueryEventFilterL,
+    QueryEventFilterM,
+    StartQuiescentMode,
+)
+from dali.device.storm import (
+    DisableInstanceMitigation,
+    EventFilterMitigation,
+    EventRate,
+    EventStormMonitor,
+    QuiescentModeMitigation,
+)
+from dali.tests import fakes
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def press(address=1, instance=0):
+    return pushbutton.ShortPress(short_address=address, instance_number=instance)
+
+
+# A push button's filter is 8 bits wide
+DEFAULT_FILTER = (
+    pushbutton.InstanceEventFilter.short_press
+    | pushbutton.InstanceEventFilter.long_press_start
+    | pushbutton.InstanceEventFilter.long_press_stop
+)
+
+
+@pytest.fixture
+def bus():
+    return fakes.AsyncBus(fakes.Bus([
+        fakes.Device(DeviceShort(1)),
+        fakes.Device(DeviceShort(2)),
+    ]))
+
+
+def test_event_rate():
+    rate = EventRate(window=1.0)
+    assert rate.value(0.0) == 0.0
+    for n in range(100):
+        rate.add(n * 0.1)
+    # Ten events per second, once settled
+    assert rate.value(9.9) == pytest.approx(10, rel=0.1)
+    # And decaying once they stop
+    assert rate.value(19.9) < 0.01
+
+
+def test_storm_alert_only():
+    clock = Clock()
+    alerts = []
+    monitor = EventStormMonitor(
+        None, instance_rate=5, device_rate=100, window=1.0,
+        alert=alerts.append, clock=clock)
+    # Two events per second is fine
+    for _ in range(20):
+        monitor.feed(press())
+        clock.now += 0.5
+    assert alerts == []
+    # Twenty per second isn't
+    for _ in range(20):
+        monitor.feed(press())
+        clock.now += 0.05
+    assert len(alerts) == 1
+    assert (alerts[0].short_address, alerts[0].instance_number) == (1, 0)
+    assert not alerts[0].mitigated
+    assert monitor.is_mitigated(1, 0)
+    assert not monitor.is_mitigated(1, 1)
+    assert monitor.rate(1, 0) > 5
+    # Events without a short address are not counted
+    monitor.feed(pushbutton.ShortPress(instance_number=0))
+
+    clock.now += 60
+    monitor.check()
+    assert alerts[-1].recovered
+    assert not monitor.is_mitigated(1, 0)
+
+
+def test_storm_disable_instance(bus):
+    clock = Clock()
+    alerts = []
+    monitor = EventStormMonitor(
+        bus, instance_rate=5, device_rate=100, window=1.0,
+        instance_mitigation=DisableInstanceMitigation(),
+        hold_off=0.01, alert=alerts.append, clock=clock)
+    instance = bus.bus.gear[0]._instances[2]
+
+    async def run():
+        for _ in range(20):
+            monitor.feed(press(1, 2))
+            clock.now += 0.01
+        await monitor.close()
+        assert not instance.enabled
+        assert alerts[-1].mitigated
+        clock.now += 1
+        # The hold off is checked on a timer
+        await asyncio.sleep(0.05)
+        await monitor.close()
+
+    asyncio.run(run())
+    assert instance.enabled
+    assert alerts[-1].recovered and alerts[-1].mitigated
+    # Only the noisy instance was touched
+    assert all(i.enabled for i in bus.bus.gear[1]._instances)
+
+
+def test_storm_repeat_doubles_hold_off():
+    clock = Clock()
+    monitor = EventStormMonitor(
+        None, instance_rate=5, window=1.0, hold_off=10, max_hold_off=25,
+        clock=clock)
+
+    def storm():
+        for _ in range(20):
+            monitor.feed(press())
+            clock.now += 0.01
+
+    storm()
+    clock.now += 10
+    monitor.check()
+    assert not monitor.is_mitigated(1, 0)
+    storm()
+    # Back within one hold off, so held for 20 s this time
+    clock.now += 15
+    monitor.check()
+    assert monitor.is_mitigated(1, 0)
+    clock.now += 5
+    monitor.check()
+    assert not monitor.is_mitigated(1, 0)
+    storm()
+    clock.now += 25
+    monitor.check()
+    assert not monitor.is_mitigated(1, 0)
+
+
+def test_storm_device_quiescent(bus):
+    clock = Clock()
+    monitor = EventStormMonitor(
+        bus, instance_rate=100, device_rate=5, window=1.0,
+        device_mitigation=QuiescentModeMitigation(), hold_off=60, clock=clock)
+
+    async def run():
+        # Spread across instances, so no single instance is over its limit
+        for n in range(20):
+            monitor.feed(press(2, n % 4))
+            clock.now += 0.01
+        await monitor.close()
+
+    asyncio.run(run())
+    assert monitor.is_mitigated(2)
+    assert bus.bus.gear[1].quiescent
+    assert not bus.bus.gear[0].quiescent
+
+
+def test_storm_event_filter(bus):
+    clock = Clock()
+    mitigation = EventFilterMitigation(pushbutton.InstanceEventFilter.short_press)
+    monitor = EventStormMonitor(
+        bus, instance_rate=5, window=1.0, instance_mitigation=mitigation,
+        hold_off=60, clock=clock)
+    instance = bus.bus.gear[0]._instances[1]
+    instance.filter = DEFAULT_FILTER
+
+    async def run():
+        for _ in range(20):
+            monitor.feed(press(1, 1))
+            clock.now += 0.01
+        await monitor.close()
+        assert instance.filter == pushbutton.InstanceEventFilter.short_press
+        clock.now += 60
+        monitor.check()
+        await monitor.close()
+
+    asyncio.run(run())
+    assert instance.filter == DEFAULT_FILTER
+
+
+def test_storm_event_filter_8_bit():
+    # Push buttons need not answer the queries for filter bits 8-23
+    bus = TimeoutBus(
+        fakes.Bus([fakes.Device(DeviceShort(1))]), QueryEventFilterM)
+    clock = Clock()
+    monitor = EventStormMonitor(
+        bus, instance_rate=5, window=1.0,
+        instance_mitigation=EventFilterMitigation(
+            pushbutton.InstanceEventFilter.short_press),
+        hold_off=60, clock=clock)
+    instance = bus.bus.gear[0]._instances[1]
+    instance.filter = DEFAULT_FILTER
+
+    async def run():
+        for _ in range(20):
+            monitor.feed(press(1, 1))
+            clock.now += 0.01
+        await monitor.close()
+        assert instance.filter == pushbutton.InstanceEventFilter.short_press
+        clock.now += 60
+        monitor.check()
+        await monitor.close()
+
+    asyncio.run(run())
+    assert instance.filter == DEFAULT_FILTER
+
+
+def test_storm_device_disable_keeps_disabled_instances(bus):
+    clock = Clock()
+    monitor = EventStormMonitor(
+        bus, instance_rate=100, device_rate=5, window=1.0,
+        device_mitigation=DisableInstanceMitigation(), hold_off=60,
+        clock=clock)
+    instances = bus.bus.gear[1]._instances
+    # Disabled by the installer
+    instances[3].enabled = False
+
+    async def run():
+        for n in range(20):
+            monitor.feed(press(2, n % 3))
+            clock.now += 0.01
+        await monitor.close()
+        assert not any(i.enabled for i in instances)
+        clock.now += 60
+        monitor.check()
+        await monitor.close()
+
+    asyncio.run(run())
+    assert [i.enabled for i in instances] == [True, True, True, False]
+
+
+class TimeoutBus(fakes.AsyncBus):
+    """Times out on one kind of command"""
+    def __init__(self, bus, timeout_on):
+        super().__init__(bus)
+        self.timeout_on = timeout_on
+
+    async def _send_raw(self, cmd):
+        if isinstance(cmd, self.timeout_on):
+            raise asyncio.TimeoutError
+        return await super()._send_raw(cmd)
+
+
+def test_storm_event_filter_query_fails():
+    bus = TimeoutBus(
+        fakes.Bus([fakes.Device(DeviceShort(1))]), QueryEventFilterL)
+    clock = Clock()
+    alerts = []
+    monitor = EventStormMonitor(
+        bus, instance_rate=5, window=1.0,
+        instance_mitigation=EventFilterMitigation(
+            pushbutton.InstanceEventFilter.short_press),
+        hold_off=60, alert=alerts.append, clock=clock)
+    instance = bus.bus.gear[0]._instances[1]
+    instance.filter = DEFAULT_FILTER
+
+    async def run():
+        for _ in range(20):
+            monitor.feed(press(1, 1))
+            clock.now += 0.01
+        await monitor.close()
+        # The filter is left alone, and the alert says so
+        assert instance.filter == DEFAULT_FILTER
+        assert not alerts[-1].mitigated
+        clock.now += 60
+        monitor.check()
+        await monitor.close()
+
+    asyncio.run(run())
+    # Nothing was saved, so nothing is written back
+    assert instance.filter == DEFAULT_FILTER
+    assert alerts[-1].recovered
+
+
+def test_storm_bus_traffic():
+    clock = Clock()
+    monitor = EventStormMonitor(None, instance_rate=5, window=1.0, clock=clock)
+    for _ in range(20):
+        monitor.bus_traffic(None, press(), None, False)
+        monitor.bus_traffic(None, StartQuiescentMode(DeviceShort(1)), None, False)
+        clock.now += 0.01
+    assert monitor.is_mitigated(1, 0)
+
+
+def test_storm_watch_queue():
+    clock = Clock()
+    monitor = EventStormMonitor(None, instance_rate=5, window=1.0, clock=clock)
+
+    async def run():
+        queue = asyncio.Queue()
+        task = asyncio.create_task(monitor.watch(queue))
+        for _ in range(20):
+            queue.put_nowait(press())
+        await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run())
+    assert monitor.is_mitigated(1, 0)
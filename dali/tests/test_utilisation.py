@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from dali.device import occupancy, pushbutton
+from dali.device.utilisation import OccupancyAggregator
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def event(address, occupied, instance=0, movement=False, repeat=False):
+    return occupancy.OccupancyEvent(
+        short_address=address, instance_number=instance,
+        data=occupancy.OccupancyEvent.EventData(
+            movement=movement, occupied=occupied, repeat=repeat))
+
+
+def test_sensor_occupancy():
+    clock = Clock()
+    agg = OccupancyAggregator(windows=(600,), bucket=60, clock=clock)
+    assert agg.sensor(1, 0) is None
+    agg.feed(event(1, True, movement=True))
+    clock.now += 120
+    agg.feed(event(1, True, repeat=True))
+    clock.now += 180
+    agg.feed(event(1, False))
+    clock.now += 300
+
+    s = agg.sensor(1, 0)
+    assert not s.occupied
+    assert s.occupied_time == pytest.approx(300)
+    assert s.periods == 1
+    assert s.mean_dwell == pytest.approx(300)
+    assert s.dwell == pytest.approx(300)
+    assert s.events == 3
+    assert not s.movement
+    # To within a bucket
+    assert s.utilisation[600] == pytest.approx(0.5, abs=0.1)
+
+    # The occupied period slides out of the window
+    clock.now += 600
+    s = agg.sensor(1, 0)
+    assert s.utilisation[600] == pytest.approx(0.0)
+    assert s.occupied_time == pytest.approx(300)
+
+
+def test_utilisation_while_occupied():
+    clock = Clock()
+    agg = OccupancyAggregator(windows=(300, 3600), bucket=60, clock=clock)
+    agg.feed(event(2, True))
+    clock.now += 30
+    # Only the time since the sensor was first seen counts
+    assert agg.sensor(2, 0).utilisation == {300: 1.0, 3600: 1.0}
+    clock.now += 1000
+    agg.feed(event(2, False))
+    clock.now += 150
+    s = agg.sensor(2, 0)
+    assert s.utilisation[300] == pytest.approx(0.5, abs=0.1)
+    assert s.utilisation[3600] == pytest.approx(1030 / 1180)
+    # A long gap doesn't take long to account for
+    clock.now += 10 ** 9
+    assert agg.sensor(2, 0).utilisation[3600] == 0.0
+
+
+def test_zones():
+    clock = Clock()
+    agg = OccupancyAggregator(
+        zones={"room": [(1, 0), (2, 0)]}, windows=(600,), clock=clock)
+    agg.feed(event(1, True))
+    clock.now += 60
+    agg.feed(event(2, True))
+    clock.now += 60
+    agg.feed(event(1, False))
+    clock.now += 60
+    assert agg.zone("room").occupied
+    agg.feed(event(2, False))
+    clock.now += 60
+    # Sensors not in a zone are still tracked
+    agg.feed(event(3, True))
+
+    zone = agg.zone("room")
+    assert not zone.occupied
+    assert zone.periods == 1
+    assert zone.occupied_time == pytest.approx(180)
+    assert zone.events == 4
+    assert agg.sensors == [(1, 0), (2, 0), (3, 0)]
+
+    # A zone added later picks up its sensors' current state
+    agg.add_zone("corridor", [(3, 0)])
+    assert agg.zone("corridor").occupied
+    with pytest.raises(ValueError):
+        agg.add_zone("room", [])
+    sensors, zones = agg.snapshot()
+    assert set(sensors) == {(1, 0), (2, 0), (3, 0)}
+    assert set(zones) == {"room", "corridor"}
+
+
+def test_ignores_other_events():
+    agg = OccupancyAggregator()
+    agg.feed(pushbutton.ShortPress(short_address=1, instance_number=0))
+    agg.bus_traffic(None, event(4, True), None, False)
+
+    async def run():
+        queue = asyncio.Queue()
+        task = asyncio.create_task(agg.watch(queue))
+        queue.put_nowait(event(5, True))
+        await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run())
+    assert agg.sensors == [(4, 0), (5, 0)]
+
+
+def test_bad_windows():
+    with pytest.raises(ValueError):
+        OccupancyAggregator(windows=())
+    with pytest.raises(ValueError):
+        OccupancyAggregator(bucket=0)
@@ -74,6 +74,9 @@ async def setup():
 
     driver = DriverLubaRs232(uri=URI)
     await driver.connect(scan_dev_inst=True)
+    # The scan for control devices continues in the background; this
+    # example goes on to use the full mapping, so wait for it
+    await driver.wait_dev_inst_scanned()
     return driver
 
 
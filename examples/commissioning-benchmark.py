@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Count the frames needed to commission a bus of fake control gear,
+# and estimate how long that would take on a real DALI bus.
+
+# Example usage:
+# commissioning-benchmark.py --runs 10 1 16 64
+
+import argparse
+import random
+
+from dali.sequences import Commissioning
+from dali.tests import fakes
+
+# Approximate DALI timings in seconds (IEC 62386-101).  A forward
+# frame is 19 bit periods at 1200 baud; a backward frame is 11 bit
+# periods.  Forward frames are separated by at least 13.5ms of
+# settling time; a backward frame starts 5.5-10.5ms after its forward
+# frame, and a master waits about 22ms before deciding there is no
+# backward frame.
+BIT_TIME = 1 / 1200
+FORWARD_FRAME = 19 * BIT_TIME
+BACKWARD_FRAME = 11 * BIT_TIME
+FORWARD_SETTLING = 0.0135
+BACKWARD_SETTLING = 0.0105
+NO_ANSWER_TIMEOUT = 0.022
+
+
+class TimingBus(fakes.Bus):
+    """A fake bus that estimates how long its traffic would take"""
+    def __init__(self, gear):
+        super().__init__(gear)
+        self.bus_time = 0.0
+
+    def send(self, cmd):
+        backward_frames = self.backward_frames
+        r = super().send(cmd)
+        frames = 2 if cmd.sendtwice else 1
+        self.bus_time += frames * (FORWARD_FRAME + FORWARD_SETTLING)
+        if self.backward_frames != backward_frames:
+            self.bus_time += BACKWARD_SETTLING + BACKWARD_FRAME
+        elif cmd.response:
+            self.bus_time += NO_ANSWER_TIMEOUT
+        return r
+
+
+def run(num_gear, runs, readdress):
+    frames = 0
+    bus_time = 0.0
+    for _ in range(runs):
+        bus = TimingBus([fakes.Gear() for _ in range(num_gear)])
+        bus.run_sequence(Commissioning(readdress=readdress))
+        frames += bus.forward_frames + bus.backward_frames
+        bus_time += bus.bus_time
+    return frames / runs, bus_time / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark commissioning of fake control gear")
+    parser.add_argument('sizes', type=int, nargs='*', default=[1, 16, 64],
+                        help="numbers of control gear to commission")
+    parser.add_argument('--runs', '-r', type=int, default=5,
+                        help="number of runs to average over")
+    parser.add_argument('--readdress', action="store_true",
+                        help="clear short addresses and start again")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for random addresses")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(f"{'gear':>6} {'frames':>10} {'bus time (s)':>14}")
+    for size in args.sizes:
+        frames, bus_time = run(size, args.runs, args.readdress)
+        print(f"{size:>6} {frames:>10.1f} {bus_time:>14.2f}")
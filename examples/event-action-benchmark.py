@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Measure how long lighting actions wait for the bus when it is busy
+# with background traffic, with and without urgent priority.
+#
+# Push button presses are fed to an ActionEngine while several pollers
+# keep the fake bus busy with queries.  Each command takes as long as
+# it would on a real DALI bus, divided by --speedup.
+
+# Example usage:
+# event-action-benchmark.py --events 50 --pollers 8
+
+import argparse
+import asyncio
+import random
+
+from dali.address import GearBroadcast, GearShort
+from dali.device import pushbutton
+from dali.device.actions import ActionEngine
+from dali.gear.general import GoToScene, QueryActualLevel
+from dali.tests import fakes
+
+# A forward frame with its settling time, then a backward frame with
+# its settling time (IEC 62386-101); see commissioning-benchmark.py
+BIT_TIME = 1 / 1200
+QUERY_TIME = 19 * BIT_TIME + 0.0135 + 11 * BIT_TIME + 0.0105
+
+
+async def poll(bus, address):
+    while True:
+        await bus.send(QueryActualLevel(GearShort(address)))
+
+
+async def run(args, urgent):
+    bus = fakes.AsyncBus(
+        fakes.Bus([fakes.Gear(GearShort(a)) for a in range(args.pollers)]),
+        delay=QUERY_TIME / args.speedup)
+    engine = ActionEngine(bus, urgent=urgent)
+    engine.add_rule(GoToScene(GearBroadcast(), 1), event=pushbutton.ShortPress)
+    pollers = [
+        asyncio.create_task(poll(bus, a)) for a in range(args.pollers)]
+    for _ in range(args.events):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * args.interval)
+        engine.feed(pushbutton.ShortPress(short_address=1, instance_number=0))
+    await engine.close()
+    for task in pollers:
+        task.cancel()
+    await asyncio.gather(*pollers, return_exceptions=True)
+    # Report in real bus time
+    return {k: v * args.speedup * 1000
+            for k, v in engine.latency.summary().items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark event to action latency on a busy fake bus")
+    parser.add_argument('--events', '-e', type=int, default=50,
+                        help="number of button presses")
+    parser.add_argument('--pollers', '-p', type=int, default=8,
+                        help="number of tasks polling gear in the background")
+    parser.add_argument('--interval', type=float, default=0.02,
+                        help="mean seconds between button presses")
+    parser.add_argument('--speedup', type=float, default=10,
+                        help="how much faster than a real bus to run")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for the times between presses")
+    args = parser.parse_args()
+
+    print(f"{'priority':>9} {'p50 (ms)':>10} {'p95 (ms)':>10} "
+          f"{'p99 (ms)':>10} {'max (ms)':>10}")
+    for urgent in (False, True):
+        random.seed(args.seed)
+        s = asyncio.run(run(args, urgent))
+        print(f"{'urgent' if urgent else 'normal':>9} {s['p50']:>10.1f} "
+              f"{s['p95']:>10.1f} {s['p99']:>10.1f} {s['max']:>10.1f}")